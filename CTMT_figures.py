@@ -259,7 +259,8 @@ def plot_sagittal_network(G,
                          fractional_adjust=2.5,
                          cmap_name='jet',
                          ax=None, 
-                         figure_name=None):
+                         figure_name=None,
+                         n_runs=1):
     
     import matplotlib.pylab as plt
     import numpy as np
@@ -277,8 +278,9 @@ def plot_sagittal_network(G,
     for u,v,d in G_edge.edges(data=True):
         d['weight']=1
         
-    # Compute the best partition based on the threshold you've specified in cost
-    partition = community.best_partition(G)
+    # Compute the consensus partition based on the threshold you've specified in cost
+    # (use the same n_runs as for the participation coefficient so it's the same partition)
+    partition = consensus_partition(G, n_runs=n_runs)['partition']
 
     # Create a sorted list of communitites (modules) according to their average
     # Y coordinate (front to back)
@@ -447,9 +449,27 @@ def degree_r_values(graph_dict, y, covars_list=['ones'], measure='CT', group='al
         
         degrees = np.array(G.degree().values())
         (r_array[i], p_array[i]) = pearsonr(degrees, y)
-    
+
     return r_array, p_array
-        
+
+def degree_r_values_from_mat(M, y, cost_list=range(1,31)):
+    '''
+    The same as degree_r_values but straight from the correlation
+    matrix (M) so the 30 graphs don't have to be made (or exist in
+    graph_dict). The edges are only ranked once for all the costs.
+    '''
+    from scipy.stats import pearsonr
+
+    deg_array = degrees_sweep(M, cost_list)
+
+    r_array = np.ones([len(cost_list)])
+    p_array = np.ones([len(cost_list)])
+
+    for i, degrees in enumerate(deg_array):
+        (r_array[i], p_array[i]) = pearsonr(degrees, y)
+
+    return r_array, p_array
+
 def create_violin_labels():
     '''
     A little function to create a labels list for the MT depth
@@ -765,7 +785,8 @@ def old_figure_1(graph_dict,
                     measure_dict, 
                     n=10, 
                     covars_list=['ones'], 
-                    group='all'):
+                    group='all',
+                    n_runs=1):
     
     big_fig, ax_list = plt.subplots(6, 5, figsize=(40, 35), facecolor='white', sharey='row')
     
@@ -789,11 +810,11 @@ def old_figure_1(graph_dict,
                                                                                                     cost))
         plot_sagittal_network(G, G_edge, sagittal_pos, axial_pos, 
                                 integer_adjust=0.1, fractional_adjust=100.0/cost, cmap_name='jet',
-                                figure_name=figure_name)
+                                figure_name=figure_name, n_runs=n_runs)
                                 
         ax_list[0, i] = plot_sagittal_network(G, G_edge, sagittal_pos, axial_pos, 
                                                 integer_adjust=0.1, fractional_adjust=100.0/cost, cmap_name='jet',
-                                                ax=ax_list[0, i])
+                                                ax=ax_list[0, i], n_runs=n_runs)
         
         #==== SET UP RANDOM GRAPH =====-=======================
         # Start by creating n random graphs
@@ -1051,7 +1072,7 @@ def old_figure_2(df_ct, df_mpm, measure_dict, figures_dir, results_dir, aparc_na
     plt.close()
 
     
-def old_figure_3(graph_dict, measure_dict, figures_dir, covars_list=['ones'], group='all', measure='CT'):
+def old_figure_3(graph_dict, measure_dict, figures_dir, covars_list=['ones'], group='all', measure='CT', n_runs=1):
 
     import matplotlib.pylab as plt
     import numpy as np
@@ -1070,7 +1091,7 @@ def old_figure_3(graph_dict, measure_dict, figures_dir, covars_list=['ones'], gr
     key = '{}_covar_{}_{}_COST_{:02.0f}'.format(measure, covars, group, cost)
 
     G = graph_dict[key]
-    pc_dict = participation_coefficient(G)    
+    partition, pc_dict = participation_coefficient(G, n_runs=n_runs)
     pc = np.array(pc_dict.values())
     degrees = np.array(G.degree().values())
     
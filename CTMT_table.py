@@ -48,7 +48,7 @@ def setup_table_data(data_dir, graph_dir, table_dir, fsaverage_dir):
                                                         'PARC_500aparc_MT_projfrac+030_mean_behavmerge.csv')
                                                         
     table_var_dict['ct_graph_file'] = os.path.join(graph_dir,
-                                                         'Graph_CT_covar_ones_all_COST_10.gpickle')
+                                                         'Ranks_CT_covar_ones_all.npz')
 
     # Load the names of each region
     aparc_names_file = os.path.join(fsaverage_dir, 'parcellation', '500.names.txt' )
@@ -74,7 +74,7 @@ def setup_table_data(data_dir, graph_dir, table_dir, fsaverage_dir):
                                             table_var_dict['aparc_names'])
     table_var_dict['mt70_df'] = read_in_df(table_var_dict['mt70_data_file'], 
                                             table_var_dict['aparc_names'])
-    table_var_dict['G'] = nx.read_gpickle(table_var_dict['ct_graph_file'])
+    table_var_dict['G'] = graph_from_edge_ranks(load_edge_ranks(table_var_dict['ct_graph_file']), 10)
 
     # Get the graph degrees
     table_var_dict['deg'] = table_var_dict['G'].degree()
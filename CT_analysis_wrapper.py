@@ -54,6 +54,13 @@ from create_correlation_matrix import *
 sys.path.append(os.path.join(scripts_dir, 'NSPN_CODE'))
 from networkx_functions import *
 from regional_correlation_functions import *
+from permutation_stats import permutation_group_corr
+from covariance_functions import create_mat_estimators, create_cross_mats, bootstrap_consensus
+from cache_functions import create_cache, load_or_create, cache_summary
+from array_graph_functions import weighted_measures, cost_sweep_measures, nx_to_array_graph, array_graph_dense
+from multiplex_functions import multiplex_from_mats, multiplex_measures, multilayer_partition
+from graph_batch_functions import calculate_measures_batch
+from robustness_functions import robustness_curves
 
 #=============================================================================
 # Define a few fun functions
@@ -388,6 +395,9 @@ print "Making or loading correlation matrices"
 
 mat_dict = {}
 
+# Keep track of which matrices and graphs are up to date
+cache_dict = create_cache()
+
 #for covars in [ ['ones'], ['age'], ['male'], ['age', 'male'] ]:
 for covars, demean in it.product([ ['ones'] ], [ True , False ]):
     
@@ -405,14 +415,14 @@ for covars, demean in it.product([ ['ones'] ], [ True , False ]):
 
     print key
 
-    # If it doesn't already exist, then make it
-    if not os.path.isfile(mat_name):
-        df_ct = read_in_df(ct_data_file)
-        mat_dict[key] = create_mat(df_ct, aparc_names, covars, demean=demean)[1]
-        save_mat(mat_dict[key], mat_name)
-    # Otherwise just load it into the dictionary
-    else:
-        mat_dict[key] = np.loadtxt(mat_name)
+    # Make it if it doesn't exist or if anything that goes into it
+    # has changed (data, covariates or the young/old split)
+    # otherwise just load it into the dictionary
+    df_ct = read_in_df(ct_data_file)
+    df_sub = df_ct
+    mat_dict[key] = load_or_create(cache_dict, mat_name,
+                                    [ df_sub[aparc_names + covars], covars, demean ],
+                                    lambda : create_mat(df_sub, aparc_names, covars, demean=demean)[1])
 
     # YOUNG
     if demean:
@@ -424,14 +434,14 @@ for covars, demean in it.product([ ['ones'] ], [ True , False ]):
 
     print key
 
-    # If it doesn't already exist, then make it
-    if not os.path.isfile(mat_name):
-        df_ct = read_in_df(ct_data_file)
-        mat_dict[key] = create_mat(df_ct[df_ct['young']==1], aparc_names, covars, demean=demean)[1]
-        save_mat(mat_dict[key], mat_name)
-    # Otherwise just load it into the dictionary
-    else:
-        mat_dict[key] = np.loadtxt(mat_name)
+    # Make it if it doesn't exist or if anything that goes into it
+    # has changed (data, covariates or the young/old split)
+    # otherwise just load it into the dictionary
+    df_ct = read_in_df(ct_data_file)
+    df_sub = df_ct[df_ct['young']==1]
+    mat_dict[key] = load_or_create(cache_dict, mat_name,
+                                    [ df_sub[aparc_names + covars], covars, demean ],
+                                    lambda : create_mat(df_sub, aparc_names, covars, demean=demean)[1])
 
     # OLD
     if demean:
@@ -443,14 +453,14 @@ for covars, demean in it.product([ ['ones'] ], [ True , False ]):
 
     print key
 
-    # If it doesn't already exist, then make it
-    if not os.path.isfile(mat_name):
-        df_ct = read_in_df(ct_data_file)
-        mat_dict[key] = create_mat(df_ct[df_ct['young']==0], aparc_names, covars, demean=demean)[1]
-        save_mat(mat_dict[key], mat_name)
-    # Otherwise just load it into the dictionary
-    else:
-        mat_dict[key] = np.loadtxt(mat_name)
+    # Make it if it doesn't exist or if anything that goes into it
+    # has changed (data, covariates or the young/old split)
+    # otherwise just load it into the dictionary
+    df_ct = read_in_df(ct_data_file)
+    df_sub = df_ct[df_ct['young']==0]
+    mat_dict[key] = load_or_create(cache_dict, mat_name,
+                                    [ df_sub[aparc_names + covars], covars, demean ],
+                                    lambda : create_mat(df_sub, aparc_names, covars, demean=demean)[1])
     
     # Loop through the MT fractional depths
     for i in np.arange(0.0,110,10):
@@ -467,14 +477,14 @@ for covars, demean in it.product([ ['ones'] ], [ True , False ]):
     
         print key
 
-        # If it doesn't already exist, then make it
-        if not os.path.isfile(mat_name):
-            df_mt_cort = read_in_df(cort_mt_data_file)
-            mat_dict[key] = create_mat(df_mt_cort, aparc_names, covars, demean=demean)[1]
-            save_mat(mat_dict[key], mat_name)
-        # Otherwise just load it into the dictionary
-        else:
-            mat_dict[key] = np.loadtxt(mat_name)
+        # Make it if it doesn't exist or if anything that goes into it
+        # has changed (data, covariates or the young/old split)
+        # otherwise just load it into the dictionary
+        df_mt_cort = read_in_df(cort_mt_data_file)
+        df_sub = df_mt_cort
+        mat_dict[key] = load_or_create(cache_dict, mat_name,
+                                        [ df_sub[aparc_names + covars], covars, demean ],
+                                        lambda : create_mat(df_sub, aparc_names, covars, demean=demean)[1])
     
         # YOUNG
         if demean:
@@ -486,14 +496,14 @@ for covars, demean in it.product([ ['ones'] ], [ True , False ]):
         
         print key
         
-        # If it doesn't already exist, then make it
-        if not os.path.isfile(mat_name):
-            df_mt_cort = read_in_df(cort_mt_data_file)
-            mat_dict[key] = create_mat(df_mt_cort[df_mt_cort['young']==1], aparc_names, covars, demean=demean)[1]
-            save_mat(mat_dict[key], mat_name)
-        # Otherwise just load it into the dictionary
-        else:
-            mat_dict[key] = np.loadtxt(mat_name)
+        # Make it if it doesn't exist or if anything that goes into it
+        # has changed (data, covariates or the young/old split)
+        # otherwise just load it into the dictionary
+        df_mt_cort = read_in_df(cort_mt_data_file)
+        df_sub = df_mt_cort[df_mt_cort['young']==1]
+        mat_dict[key] = load_or_create(cache_dict, mat_name,
+                                        [ df_sub[aparc_names + covars], covars, demean ],
+                                        lambda : create_mat(df_sub, aparc_names, covars, demean=demean)[1])
     
 
         # OLD
@@ -506,15 +516,87 @@ for covars, demean in it.product([ ['ones'] ], [ True , False ]):
         
         print key
 
-        # If it doesn't already exist, then make it
-        if not os.path.isfile(mat_name):
-            df_mt_cort = read_in_df(cort_mt_data_file)
-            mat_dict[key] = create_mat(df_mt_cort[df_mt_cort['young']==0], aparc_names, covars, demean=True)[1]
-            save_mat(mat_dict[key], mat_name)
-        # Otherwise just load it into the dictionary
-        else:
-            mat_dict[key] = np.loadtxt(mat_name)
+        # Make it if it doesn't exist or if anything that goes into it
+        # has changed (data, covariates or the young/old split)
+        # otherwise just load it into the dictionary
+        df_mt_cort = read_in_df(cort_mt_data_file)
+        df_sub = df_mt_cort[df_mt_cort['young']==0]
+        mat_dict[key] = load_or_create(cache_dict, mat_name,
+                                        [ df_sub[aparc_names + covars], covars, True ],
+                                        lambda : create_mat(df_sub, aparc_names, covars, demean=True)[1])
     
+#=============================================================================
+# Add the shrinkage and graphical lasso matrices for CT
+#=============================================================================
+print "=================================================="
+print "Making or loading shrinkage and graphical lasso matrices"
+
+est_names = [ 'LW', 'OAS' ] + [ 'GL{:03.0f}'.format(alpha * 1000) for alpha in np.logspace(np.log10(0.5), np.log10(0.01), 10) ]
+
+for covars in [ ['ones'] ]:
+    
+    for group in [ 'all', 'young', 'old' ]:
+        
+        df_ct = read_in_df(ct_data_file)
+        if group == 'young':
+            df_ct = df_ct[df_ct['young']==1]
+        elif group == 'old':
+            df_ct = df_ct[df_ct['young']==0]
+        
+        # The graphical lasso path is run in one go so all the
+        # estimators for this group are cached together
+        est_filename = os.path.join(data_dir, 'CORR_MATS', 'Mats_CT_estimators_covar_{}_{}.pkl'.format('_'.join(covars), group.upper()))
+        est_dict = load_or_create(cache_dict, est_filename,
+                                    [ df_ct[aparc_names + covars], covars, est_names ],
+                                    lambda : create_mat_estimators(df_ct, aparc_names, covars),
+                                    kind='pickle')
+        
+        # Put them in the dictionary and save text copies
+        # in the CORR_MATS folder alongside the others
+        for est in est_names:
+            key = 'CT_{}_covar_{}_{}'.format(est, '_'.join(covars), group)
+            print key
+            mat_dict[key] = est_dict[est]
+            mat_name = os.path.join(data_dir, 'CORR_MATS', 'Mat_CT_{}_Corr_covar_{}_{}.txt'.format(est, '_'.join(covars), group.upper()))
+            save_mat(mat_dict[key], mat_name)
+
+#=============================================================================
+# Cross-correlation matrices between CT and each of the MT depths
+#=============================================================================
+print "=================================================="
+print "Making or loading CT x MT cross-correlation matrices"
+
+cross_mat_dict = {}
+
+# Read in CT and all 21 MT depths
+df_dict = { 'CT' : read_in_df(ct_data_file) }
+
+for i in np.arange(0.0,110,10):
+    df_dict['MT_projfrac{:+04.0f}'.format(i)] = read_in_df(os.path.join(data_dir, 
+                                                'PARC_500aparc_MT_projfrac{:+04.0f}_behavmerge.csv'.format(i)))
+for i in np.arange(-20,-201,-20):
+    df_dict['MT_projdist{:+04.0f}'.format(i)] = read_in_df(os.path.join(data_dir, 
+                                                'PARC_500aparc_MT_projdist{:+04.0f}_fromBoundary_behavmerge.csv'.format(i)))
+
+pairs = [ ('CT', measure) for measure in sorted(df_dict.keys()) if not measure == 'CT' ]
+
+for covars in [ ['ones'] ]:
+    
+    # All the pairs are made in one go so cache them together
+    cross_filename = os.path.join(data_dir, 'CORR_MATS', 'Mats_CTxMT_CrossCorr_covar_{}_ALL.pkl'.format('_'.join(covars)))
+    cross_dict = load_or_create(cache_dict, cross_filename,
+                                [ dict([ (measure, df[['nspn_id'] + aparc_names + covars]) for measure, df in df_dict.items() ]), covars, pairs ],
+                                lambda : create_cross_mats(df_dict, aparc_names, covars, pairs=pairs),
+                                kind='pickle')
+    
+    # Save text copies in the CORR_MATS folder alongside the others
+    for pair_name, M in cross_dict.items():
+        key = '{}_covar_{}_all'.format(pair_name, '_'.join(covars))
+        print key
+        cross_mat_dict[key] = M
+        mat_name = os.path.join(data_dir, 'CORR_MATS', 'Mat_{}_CrossCorr_covar_{}_ALL.txt'.format(pair_name, '_'.join(covars)))
+        save_mat(M, mat_name)
+
 #=============================================================================
 # Lets do some graaaaaphs!
 #=============================================================================
@@ -535,39 +617,271 @@ for k in mat_dict.keys():
     M = mat_dict[k]
     
     #=======
-    # Read in the full graph first
+    # Rank the edges once for each matrix
     #=======
     
-    # Define the graph's file name
-    g_filename = os.path.join(data_dir, 'GRAPHS', 'Graph_{}_COST_100.gpickle'.format(k))
-    
-    # If it already exists just read it in from the pickled file
-    if os.path.isfile(g_filename):
-        graph_dict['{}_COST_100'.format(k)] = nx.read_gpickle(g_filename)
-    
-    # Otherwise you'll have to create it using the graph_at_cost function above
-    else:
-        graph_dict['{}_COST_100'.format(k)] = full_graph(M)
-        
-        # Save it as a gpickle file so you don't have to do this next time!
-        nx.write_gpickle(graph_dict['{}_COST_100'.format(k)], g_filename)
+    # Rather than saving a gpickle file for every cost we save one
+    # small archive of the ranked edges for each matrix, and build
+    # the graph at any cost from that
+    r_filename = os.path.join(data_dir, 'GRAPHS', 'Ranks_{}.npz'.format(k))
+    
+    # Read it in unless it's missing or the matrix it was made
+    # from has changed, in which case you'll have to create it
+    rank_dict = load_or_create(cache_dict, r_filename,
+                                [ M, 'create_edge_ranks' ],
+                                lambda : create_edge_ranks(M),
+                                kind='ranks')
+    
+    # The full graph first (the same as full_graph)
+    graph_dict['{}_COST_100'.format(k)] = graph_from_edge_ranks(rank_dict, 100, weight_sign=1)
+    
+    # The graphical lasso matrices are sparse, and the bigger the
+    # penalty the fewer positive partial correlations there are. If
+    # there aren't enough of them to fill the graph at this cost it
+    # would have to be made up with zero (or negative) edges picked
+    # in an arbitrary order, so that graph just isn't made (and the
+    # measures and figures below skip it)
+    n_positive = np.sum(np.triu(M, k=1) > 0)
     
     # For three different costs...
     for cost in [2, 10, 20]:
         
-        # Define the graph's file name
-        g_filename = os.path.join(data_dir, 'GRAPHS', 'Graph_{}_COST_{:02.0f}.gpickle'.format(k, cost))
+        n_edges = n_edges_at_cost(M.shape[0], cost, int(rank_dict['n_mst']))
+        if n_edges > n_positive:
+            print '    Only {} positive edges, not enough for cost {} ({} edges)'.format(n_positive, cost, n_edges)
+            continue
         
-        # If it already exists just read it in from the pickled file
-        if os.path.isfile(g_filename):
-            graph_dict['{}_COST_{:02.0f}'.format(k, cost)] = nx.read_gpickle(g_filename)
+        # The same as graph_at_cost
+        graph_dict['{}_COST_{:02.0f}'.format(k, cost)] = graph_from_edge_ranks(rank_dict, cost)
+
+# Report how much was re-used
+cache_summary(cache_dict)
+
+#=============================================================================
+# Weighted measures of the full (unthresholded) matrices
+#=============================================================================
+print "=================================================="
+print "Calculating weighted measures"
+
+weighted_dict = {}
+
+for key in [ x for x in mat_dict.keys() if 'CT_covar_ones' in x ]:
+
+    print key
+    
+    # These don't depend on the cost so there's
+    # just the one set of measures per matrix
+    weighted_dict[key] = load_or_create(cache_dict,
+                                        os.path.join(data_dir, 'GRAPHS', 'Weighted_{}.p'.format(key)),
+                                        [ mat_dict[key], 'weighted_measures' ],
+                                        lambda : weighted_measures(mat_dict[key]),
+                                        kind='pickle')
+    
+    nodal_names = [ 'strength', 'clustering', 'shortest_path', 'efficiency' ]
+    np.savetxt(os.path.join(results_dir, 'Weighted_{}_nodal.txt'.format(key)),
+                np.vstack([ weighted_dict[key][name] for name in nodal_names ]).T,
+                header=' '.join(nodal_names),
+                fmt='%.5f')
         
-        # Otherwise you'll have to create it using the graph_at_cost function above
-        else:
-            graph_dict['{}_COST_{:02.0f}'.format(k, cost)] = graph_at_cost(M, cost)
+    print '    C_w: {:.3f}  L_w: {:.3f}  E_w: {:.3f}'.format(weighted_dict[key]['C_w'],
+                                                          weighted_dict[key]['L_w'],
+                                                          weighted_dict[key]['E_w'])
+
+#=============================================================================
+# Cost integrated measures
+#=============================================================================
+print "=================================================="
+print "Calculating measures across costs 1 to 30"
+
+sweep_dict = {}
+
+for key in [ x for x in mat_dict.keys() if 'CT_covar_ones' in x ]:
+
+    print key
+    
+    sweep_dict[key] = load_or_create(cache_dict,
+                                        os.path.join(data_dir, 'GRAPHS', 'CostSweep_{}.p'.format(key)),
+                                        [ mat_dict[key], range(1,31) ],
+                                        lambda : cost_sweep_measures(mat_dict[key], cost_list=range(1,31)),
+                                        kind='pickle')
+    
+    # Save the area under the curve for each of the nodal measures
+    nodal_names = sorted(sweep_dict[key]['nodal_auc'].keys())
+    np.savetxt(os.path.join(results_dir, 'CostAUC_{}_nodal.txt'.format(key)),
+                np.vstack([ sweep_dict[key]['nodal_auc'][name] for name in nodal_names ]).T,
+                header=' '.join(nodal_names),
+                fmt='%.5f')
+    
+    # And the global curves with their areas in the last row
+    global_names = sorted(sweep_dict[key]['global'].keys())
+    curves = np.vstack([ sweep_dict[key]['global'][name] for name in global_names ]).T
+    auc = np.array([ sweep_dict[key]['global_auc'][name] for name in global_names ])
+    np.savetxt(os.path.join(results_dir, 'CostAUC_{}_global.txt'.format(key)),
+                np.vstack([ curves, auc ]),
+                header=' '.join(global_names) + ' (rows are costs 1 to 30 then AUC)',
+                fmt='%.5f')
+
+#=============================================================================
+# MT depths as the layers of one multiplex network
+#=============================================================================
+print "=================================================="
+print "Multiplex network of the MT depths"
+
+for group in [ 'all', 'young', 'old' ]:
+    
+    for cost in [ 10 ]:
+    
+        key = 'MT_projfrac_covar_ones_{}_COST_{:02.0f}'.format(group, cost)
+        print key
+        
+        layer_keys = [ 'MT_projfrac{:+04.0f}_covar_ones_{}'.format(i, group) for i in np.arange(0.0,110,10) ]
+        
+        def make_multiplex_dict():
+            mp = multiplex_from_mats(mat_dict, layer_keys, cost)
+            mp_dict = multiplex_measures(mp)
+            
+            # Multilayer modules (these are in the same order as the layers)
+            mp_dict['partition'], mp_dict['Q'] = multilayer_partition(mp, omega=1.0, seed=0)
             
-            # Save it as a gpickle file so you don't have to do this next time!
-            nx.write_gpickle(graph_dict['{}_COST_{:02.0f}'.format(k, cost)], g_filename)
+            return mp_dict
+        
+        # Only made again if the layers, the cost or omega change
+        mp_dict = load_or_create(cache_dict,
+                                    os.path.join(data_dir, 'GRAPHS', 'Multiplex_{}.p'.format(key)),
+                                    [ [ mat_dict[k] for k in layer_keys ], layer_keys, cost, 1.0, 0 ],
+                                    make_multiplex_dict,
+                                    kind='pickle')
+        
+        np.savetxt(os.path.join(results_dir, 'Multiplex_{}_nodal.txt'.format(key)),
+                    np.vstack([ mp_dict['overlap_degree'], mp_dict['participation'], mp_dict['partition'] ]).T,
+                    header='overlap_degree participation ' + ' '.join([ 'module_{}'.format(k.split('_covar')[0]) for k in layer_keys ]),
+                    fmt='%.5f')
+        
+        save_mat(mp_dict['layer_similarity'],
+                    os.path.join(results_dir, 'Multiplex_{}_layer_similarity.txt'.format(key)))
+        
+        print '    Edge overlap: {:.3f}  Multilayer Q: {:.3f}'.format(mp_dict['edge_overlap'], mp_dict['Q'])
+
+#=============================================================================
+# Bootstrap consensus graphs
+#=============================================================================
+print "=================================================="
+print "Bootstrap consensus graphs"
+
+consensus_dict = {}
+
+df_ct = read_in_df(ct_data_file)
+group_df_dict = { 'all'   : df_ct,
+                  'young' : df_ct[df_ct['young']==1],
+                  'old'   : df_ct[df_ct['young']==0] }
+
+for group in [ 'all', 'young', 'old' ]:
+    
+    for cost in [ 10 ]:
+    
+        covars = [ 'ones' ]
+        key = 'CT_covar_{}_{}_COST_{:02.0f}'.format('_'.join(covars), group, cost)
+        print key
+        
+        df_sub = group_df_dict[group]
+        
+        # The proportion of 1000 bootstrap resamples that each edge is in
+        mat_name = os.path.join(data_dir, 'CORR_MATS', 'Mat_CT_BootFreq_covar_{}_{}_COST_{:02.0f}.txt'.format('_'.join(covars), group.upper(), cost))
+        freq = load_or_create(cache_dict, mat_name,
+                                [ df_sub[aparc_names + covars], covars, cost, 1000, 0 ],
+                                lambda : bootstrap_consensus(df_sub, aparc_names, covars, cost=cost, n=1000, seed=0)['frequency'])
+        
+        # Keep the edges that are in at least half of them
+        A_consensus = ( freq >= 0.5 ).astype('float')
+        A_consensus[np.diag_indices_from(A_consensus)] = 0
+        consensus_dict[key] = nx.from_numpy_matrix(A_consensus)
+        
+        print '    {} edges in the consensus graph'.format(consensus_dict[key].number_of_edges())
+
+#=============================================================================
+# Consensus modular partitions
+#=============================================================================
+print "=================================================="
+print "Consensus modular partitions"
+
+for key in [ x for x in graph_dict.keys() if 'CT_covar_ones' in x and x.endswith('_COST_10') ]:
+
+    print key
+    
+    # Only run again if the graph's edges change
+    partition_dict = load_or_create(cache_dict,
+                                    os.path.join(data_dir, 'GRAPHS', 'Consensus_{}.p'.format(key)),
+                                    [ graph_key(graph_dict[key]), 100, 0 ],
+                                    lambda : consensus_partition(graph_dict[key], n_runs=100, seed=0, n_processes=4),
+                                    kind='pickle')
+    
+    # Keep it on the graph so the measures and the figures
+    # below use this partition rather than running Louvain again
+    set_partition_cache(graph_dict[key], partition_dict, n_runs=100, seed=0)
+    
+    np.savetxt(os.path.join(results_dir, 'Modularity_{}_Q_runs.txt'.format(key)),
+                partition_dict['Q_runs'],
+                fmt='%.5f')
+    
+    print '    Consensus Q: {:.3f}  Q over 100 runs: {:.3f} +/- {:.3f}'.format(partition_dict['Q'],
+                                                                            np.mean(partition_dict['Q_runs']),
+                                                                            np.std(partition_dict['Q_runs']))
+    
+#=============================================================================
+# Nodal and global measures for all the cost 10 graphs
+#=============================================================================
+print "=================================================="
+print "Calculating nodal and global measures"
+
+# These are saved as they go, so if this dies
+# just run it again and it'll carry on
+key_list = sorted([ x for x in graph_dict.keys() if x.endswith('_COST_10') ])
+
+graph_dict, timing_dict = calculate_measures_batch(graph_dict,
+                                                    key_list,
+                                                    centroids,
+                                                    aparc_names,
+                                                    os.path.join(data_dir, 'GRAPHS', 'MEASURES'),
+                                                    n=10,
+                                                    n_runs=100,
+                                                    n_processes=8)
+    
+#=============================================================================
+# Robustness to targeted attack and random failure
+#=============================================================================
+print "=================================================="
+print "Robustness curves"
+
+for key in [ x for x in graph_dict.keys() if 'covar_ones_all' in x and x.endswith('_COST_10') ]:
+
+    print key
+    
+    A = array_graph_dense(nx_to_array_graph(graph_dict[key]))
+    
+    for strategy in [ 'degree', 'betweenness', 'random' ]:
+        
+        # The approximate efficiency is too high for these modular
+        # graphs so the exact efficiency is calculated too, at every
+        # 10% of the nodes removed (n_exact=11)
+        rob_dict = load_or_create(cache_dict,
+                                    os.path.join(data_dir, 'GRAPHS', 'Robustness_{}_{}.p'.format(key, strategy)),
+                                    [ graph_key(graph_dict[key]), strategy, 100, 11, 0 ],
+                                    lambda : robustness_curves(A, strategy=strategy, n_random=100, n_exact=11, seed=0),
+                                    kind='pickle')
+        
+        # One row per number of nodes removed
+        np.savetxt(os.path.join(results_dir, 'Robustness_{}_{}.txt'.format(key, strategy)),
+                    np.vstack([ rob_dict['fraction_removed'], rob_dict['giant'], rob_dict['E_approx'] ]).T,
+                    fmt='%.5f',
+                    header='fraction_removed giant E_approx (R = {:.5f})'.format(rob_dict['R']))
+        
+        # And the exact efficiency, which is the one to report
+        np.savetxt(os.path.join(results_dir, 'Robustness_{}_{}_exact.txt'.format(key, strategy)),
+                    np.vstack([ rob_dict['exact_fraction'], rob_dict['E_exact'] ]).T,
+                    fmt='%.5f',
+                    header='fraction_removed E_exact')
+        
+        print '    {}: R = {:.3f}'.format(strategy, rob_dict['R'])
     
 #=============================================================================
 # Make some pictures
@@ -596,7 +910,7 @@ for key in [ x for x in graph_dict.keys() if 'CT_covar_ones' in x and 'COST_20'
     filename = os.path.join(figures_dir, '{}_covar_{}_{}_network_COST_{:02.0f}.png'.format(measure, covars, group.upper(), cost))
 
     if not os.path.isfile(filename):
-        fig = plot_modules(G, G_edge, cost_mod=cost, title=title, axial_pos=axial_pos, coronal_pos=coronal_pos, sagittal_pos=sagittal_pos,)
+        fig = plot_modules(G, G_edge, cost_mod=cost, title=title, axial_pos=axial_pos, coronal_pos=coronal_pos, sagittal_pos=sagittal_pos, n_runs=100)
         fig.savefig(filename, bbox_inches=0, dpi=300)
         plt.close(fig)
 
@@ -748,6 +1062,47 @@ for key in old_keys:
         fig.savefig(filename, bbox_inches=0, dpi=300)
         plt.close(fig)
         
+#=============================================================================
+# Permutation test of the young vs old differences
+#=============================================================================
+print "=================================================="
+print "Permutation testing young vs old matrices"
+
+for covars in [ ['ones'] ]:
+
+    key = 'CT_covar_{}_YOUNGvsOLD'.format('_'.join(covars))
+
+    print key
+
+    # Only run again if the data, the covariates, the
+    # young/old split or the settings change
+    df_ct = read_in_df(ct_data_file)
+    perm_dict = load_or_create(cache_dict,
+                                os.path.join(results_dir, 'Perm_{}.p'.format(key)),
+                                [ df_ct[aparc_names + covars + ['young']], covars, 5000, 10, 0 ],
+                                lambda : permutation_group_corr(df_ct, aparc_names, covars, group='young', n=5000, cost=10, seed=0),
+                                kind='pickle')
+
+    save_mat(perm_dict['r_diff'], os.path.join(results_dir, 'Perm_{}_r_diff.txt'.format(key)))
+    save_mat(perm_dict['r_diff_p'], os.path.join(results_dir, 'Perm_{}_r_diff_p.txt'.format(key)))
+    np.savetxt(os.path.join(results_dir, 'Perm_{}_degree_diff.txt'.format(key)), perm_dict['degree_diff'])
+    np.savetxt(os.path.join(results_dir, 'Perm_{}_degree_diff_p.txt'.format(key)), perm_dict['degree_diff_p'])
+
+    # The true differences in the global measures and their p values
+    global_names = [ 'mean_r_diff', 'degree_std_diff', 'E_diff' ]
+    np.savetxt(os.path.join(results_dir, 'Perm_{}_global.txt'.format(key)),
+                np.array([ [ perm_dict[name] for name in global_names ],
+                           [ perm_dict['{}_p'.format(name)] for name in global_names ] ]),
+                header=' '.join(global_names) + ' (rows are the true differences then the p values)',
+                fmt='%.5f')
+
+    for name in global_names:
+        print '    {}: {:.4f}  p = {:.4f}'.format(name, perm_dict[name], perm_dict['{}_p'.format(name)])
+
+    for name in [ 'r_diff_max', 'mean_r_diff', 'degree_std_diff', 'E_diff' ]:
+        np.savetxt(os.path.join(results_dir, 'Perm_{}_{}_null.txt'.format(key, name)),
+                        perm_dict['{}_null'.format(name)])
+
 #====
 # DEGREE DISTRIBUTION
 #====
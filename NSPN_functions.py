@@ -563,6 +563,8 @@ def save_network_values(measure_dict, G_name, graph_dict):
     measure_dict['Global_Assortativity_rand_{}'.format(G_name)] = global_dict['a_rand']
     measure_dict['Global_SmallWorld_{}'.format(G_name)] = global_dict['sigma']
     measure_dict['Global_SmallWorld_rand_{}'.format(G_name)] = global_dict['sigma_rand']
+    measure_dict['Global_Omega_{}'.format(G_name)] = global_dict['omega']
+    measure_dict['Global_SmallWorldPropensity_{}'.format(G_name)] = global_dict['swp']
 
     return measure_dict
     
@@ -0,0 +1,1437 @@
+#!/usr/bin/env python
+
+'''
+Graph functions that work on numpy/scipy arrays rather than networkx
+graphs. Our graphs are small (308 nodes), fixed size and fairly dense
+so the networkx dict-of-dicts is a lot of overhead for them.
+
+An "array graph" is just a dictionary:
+    * A ----------- scipy.sparse csr_matrix binary adjacency (symmetric)
+    * W ----------- scipy.sparse csr_matrix of the edge weights with the
+                      same sparsity pattern as A (or None)
+    * n_nodes ----- number of nodes
+    * centroids --- (n_nodes x 3) array of x, y, z coordinates (or None)
+    * name_500 ---- array of region names (or None)
+    * name_DK ----- array of Desikan-Killiany region names (or None)
+    * hemi -------- array of hemispheres (or None)
+
+The node attributes are named to match assign_node_names and
+assign_nodal_distance in networkx_functions.
+'''
+
+def create_array_graph(edge_i, edge_j, n_nodes, weights=None, centroids=None, aparc_names=None):
+    '''
+    Make an array graph from a list of edges (eg: the first n edges
+    from rank_edges in networkx_functions).
+
+    INPUTS:
+        edge_i, edge_j -- arrays of node indices for each edge (each edge
+                            should only be listed once)
+        n_nodes --------- number of nodes in the graph
+        weights --------- array of edge weights
+                            default = None
+        centroids ------- (n_nodes x 3) array of coordinates
+                            default = None
+        aparc_names ----- list of region names
+                            default = None
+
+    RETURNS:
+        G_arr ----------- array graph dictionary
+    '''
+    import numpy as np
+    from scipy import sparse
+
+    edge_i = np.asarray(edge_i)
+    edge_j = np.asarray(edge_j)
+
+    # Put each edge in both directions
+    rows = np.hstack([ edge_i, edge_j ])
+    cols = np.hstack([ edge_j, edge_i ])
+
+    if weights is None:
+        data = np.ones(len(rows))
+    else:
+        data = np.hstack([ weights, weights ]).astype('float')
+
+    W = sparse.csr_matrix((data, (rows, cols)), shape=(n_nodes, n_nodes))
+    W.sort_indices()
+
+    # The binary adjacency shares the index arrays with the
+    # weights so it doesn't take up much more room
+    A = sparse.csr_matrix((np.ones(W.nnz), W.indices, W.indptr), shape=(n_nodes, n_nodes))
+
+    G_arr = { 'A'         : A,
+              'W'         : W if weights is not None else None,
+              'n_nodes'   : n_nodes,
+              'centroids' : None,
+              'name_500'  : None,
+              'name_DK'   : None,
+              'hemi'      : None }
+
+    G_arr = assign_array_graph_attributes(G_arr, centroids=centroids, aparc_names=aparc_names)
+
+    return G_arr
+
+
+def assign_array_graph_attributes(G_arr, centroids=None, aparc_names=None):
+    '''
+    Add the centroids and names to an array graph (the
+    array version of assign_node_names)
+    '''
+    import numpy as np
+
+    if centroids is not None:
+        G_arr['centroids'] = np.asarray(centroids)[:, :3]
+
+    if aparc_names is not None:
+        G_arr['name_500'] = np.array(aparc_names)
+        G_arr['name_DK'] = np.array([ name.rsplit('_', 1)[0] for name in aparc_names ])
+        G_arr['hemi'] = np.array([ name.split('_', 1)[0] for name in aparc_names ])
+
+    return G_arr
+
+
+def array_graph_from_matrix(M, centroids=None, aparc_names=None, weighted=True):
+    '''
+    Make an array graph from a thresholded (n x n) matrix, eg: the
+    output of adjacency_at_cost, or a correlation matrix with everything
+    below the threshold set to zero. Every non-zero off diagonal value
+    is an edge.
+    '''
+    import numpy as np
+
+    edge_i, edge_j = np.nonzero(np.triu(M, k=1))
+
+    if weighted:
+        weights = M[edge_i, edge_j]
+    else:
+        weights = None
+
+    return create_array_graph(edge_i, edge_j, M.shape[0],
+                                weights=weights,
+                                centroids=centroids,
+                                aparc_names=aparc_names)
+
+
+def array_graph_at_cost(M, cost, centroids=None, aparc_names=None):
+    '''
+    The array graph version of graph_at_cost. The edge weights are the
+    values in M (not multiplied by -1 like they are in graph_at_cost).
+    '''
+    from networkx_functions import rank_edges, n_edges_at_cost
+
+    n = M.shape[0]
+    edge_i, edge_j, n_mst = rank_edges(M)
+    n_edges = n_edges_at_cost(n, cost, n_mst)
+
+    return create_array_graph(edge_i[:n_edges], edge_j[:n_edges], n,
+                                weights=M[edge_i[:n_edges], edge_j[:n_edges]],
+                                centroids=centroids,
+                                aparc_names=aparc_names)
+
+
+def array_graph_edges(G_arr):
+    '''
+    Return the edges (each one only once) and their weights
+    (None if the graph is unweighted)
+    '''
+    import numpy as np
+    from scipy import sparse
+
+    A_triu = sparse.triu(G_arr['A'], k=1).tocoo()
+    edge_i, edge_j = A_triu.row, A_triu.col
+
+    if G_arr['W'] is None:
+        weights = None
+    else:
+        weights = np.asarray(G_arr['W'][edge_i, edge_j]).flatten()
+
+    return edge_i, edge_j, weights
+
+
+def array_graph_to_nx(G_arr):
+    '''
+    Convert an array graph into a networkx graph with the same
+    node attributes that assign_node_names and assign_nodal_distance
+    would have given it
+    '''
+    import networkx as nx
+
+    edge_i, edge_j, weights = array_graph_edges(G_arr)
+
+    G = nx.Graph()
+    G.add_nodes_from(range(G_arr['n_nodes']))
+
+    if weights is None:
+        G.add_edges_from(zip(edge_i.tolist(), edge_j.tolist()))
+    else:
+        G.add_weighted_edges_from(zip(edge_i.tolist(), edge_j.tolist(), weights.tolist()))
+
+    # Add in the node attributes
+    attr_dict = {}
+    for node in range(G_arr['n_nodes']):
+        attr_dict[node] = {}
+        if G_arr['centroids'] is not None:
+            attr_dict[node]['x'] = G_arr['centroids'][node, 0]
+            attr_dict[node]['y'] = G_arr['centroids'][node, 1]
+            attr_dict[node]['z'] = G_arr['centroids'][node, 2]
+            attr_dict[node]['centroids'] = G_arr['centroids'][node, :]
+        for name in [ 'name_500', 'name_DK', 'hemi' ]:
+            if G_arr[name] is not None:
+                attr_dict[node][name] = G_arr[name][node]
+
+    # This works for old and new versions of networkx
+    G.add_nodes_from(attr_dict.items())
+
+    return G
+
+
+def nx_to_array_graph(G, weight='weight'):
+    '''
+    Convert a networkx graph into an array graph. The nodes are
+    taken in sorted order (0 to n-1 for all the graphs we make) and
+    any centroids or names assigned to the nodes are kept.
+    '''
+    import numpy as np
+
+    nodes = sorted(G.nodes())
+    node_index = dict(zip(nodes, range(len(nodes))))
+
+    edge_i = []
+    edge_j = []
+    weights = []
+    weighted = True
+
+    for u, v, d in G.edges(data=True):
+        edge_i += [ node_index[u] ]
+        edge_j += [ node_index[v] ]
+        if weight in d:
+            weights += [ d[weight] ]
+        else:
+            weighted = False
+
+    if not weighted:
+        weights = None
+
+    G_arr = create_array_graph(np.array(edge_i, dtype='int'),
+                                np.array(edge_j, dtype='int'),
+                                len(nodes),
+                                weights=weights)
+
+    # Hold on to the node attributes if they're there
+    node_data = dict(G.nodes(data=True))
+    if all([ 'centroids' in node_data[node] for node in nodes ]):
+        G_arr['centroids'] = np.array([ node_data[node]['centroids'] for node in nodes ])
+    for name in [ 'name_500', 'name_DK', 'hemi' ]:
+        if all([ name in node_data[node] for node in nodes ]):
+            G_arr[name] = np.array([ node_data[node][name] for node in nodes ])
+
+    return G_arr
+
+
+def array_graph_degrees(G_arr, weighted=False):
+    '''
+    Degree (or strength if weighted is True) of every node
+    '''
+    import numpy as np
+
+    if weighted and G_arr['W'] is not None:
+        return np.asarray(G_arr['W'].sum(axis=1)).flatten()
+
+    return np.diff(G_arr['A'].indptr).astype('float')
+
+
+def array_graph_distance_measures(G_arr, dist_mats=None):
+    '''
+    The array graph version of assign_nodal_distance: average_dist,
+    total_dist and interhem_proportion for every node. dist_mats is
+    the output of create_distance_mats, and if it isn't given it's
+    made from the graph's centroids.
+    '''
+    from networkx_functions import create_distance_mats, nodal_distance_measures
+
+    if dist_mats is None:
+        dist_mats = create_distance_mats(G_arr['centroids'])
+
+    return nodal_distance_measures(G_arr['A'].toarray(), dist_mats)
+
+
+def array_graph_dense(G_arr, weighted=False):
+    '''
+    The (n x n) dense numpy adjacency (or weight) matrix
+    '''
+    if weighted and G_arr['W'] is not None:
+        return G_arr['W'].toarray()
+
+    return G_arr['A'].toarray()
+
+
+def positive_weights(M):
+    '''
+    Copy of the weight matrix (or (k x n x n) stack of matrices)
+    with the diagonal and any negative or missing values set to 0.
+
+    The weighted measures below only make sense for positive
+    weights, and for a correlation matrix that means the negative
+    correlations are treated as "no edge".
+    '''
+    import numpy as np
+
+    W = np.array(M, dtype='float')
+    W[np.isnan(W)] = 0
+    W[W < 0] = 0
+
+    n = W.shape[-1]
+    W[..., np.arange(n), np.arange(n)] = 0
+
+    return W
+
+
+def weighted_strength(M):
+    '''
+    Strength (sum of the positive edge weights) of every node.
+    M can be one (n x n) matrix or a (k x n x n) stack of them.
+    '''
+    W = positive_weights(M)
+
+    return W.sum(axis=-1)
+
+
+def weighted_clustering(M):
+    '''
+    Onnela et al. (2005) weighted clustering coefficient of every node:
+
+        C_i = 1 / (k_i (k_i - 1)) * sum_jh (w_ij w_jh w_hi)^(1/3)
+
+    where the weights are divided by the largest weight in the matrix
+    and k_i is the number of (positive) edges. This is the same as
+    nx.clustering(G, weight='weight'). M can be one (n x n) matrix or
+    a (k x n x n) stack of them.
+    '''
+    import numpy as np
+
+    W = positive_weights(M)
+
+    # Scale the weights to a maximum of 1 (separately for each matrix)
+    w_max = W.max(axis=(-2, -1))
+    w_max = np.where(w_max > 0, w_max, 1.0)
+    W_3 = ( W / w_max[..., None, None] ) ** (1/3.0)
+
+    # The diagonal of W^3 sums the geometric means round each triangle
+    cycles = np.einsum('...ij,...ji->...i', np.matmul(W_3, W_3), W_3)
+
+    k = (W > 0).sum(axis=-1).astype('float')
+    n_pairs = k * (k - 1)
+
+    clustering = np.zeros_like(cycles)
+    np.divide(cycles, n_pairs, out=clustering, where=n_pairs > 0)
+
+    return clustering
+
+
+def weighted_distances(M):
+    '''
+    Weighted shortest path lengths between every pair of nodes,
+    using a length of 1/weight for each edge so that strongly
+    connected nodes are "close". Pairs that aren't connected are
+    np.inf. M can be one (n x n) matrix or a (k x n x n) stack of them.
+    '''
+    import numpy as np
+    from scipy import sparse
+    from scipy.sparse.csgraph import dijkstra
+
+    W = positive_weights(M)
+
+    if W.ndim == 2:
+        return weighted_distances(W[None, ...])[0]
+
+    D = np.zeros_like(W)
+
+    for b in range(W.shape[0]):
+        # Only put the edges into the sparse matrix as csgraph
+        # would otherwise treat the zeros as edges of length 0
+        edge_i, edge_j = np.nonzero(W[b])
+        L = sparse.csr_matrix((1.0 / W[b][edge_i, edge_j], (edge_i, edge_j)), shape=W[b].shape)
+        D[b] = dijkstra(L, directed=False)
+
+    return D
+
+
+def weighted_measures(M):
+    '''
+    The weighted versions of the nodal and global measures for a
+    (n x n) weight matrix, eg: an unthresholded correlation matrix, so
+    the results don't depend on the choice of cost.
+
+    INPUTS:
+        M ---------------- (n x n) weight matrix (only the positive
+                             off diagonal values are used)
+
+    RETURNS:
+        measure_dict ----- a dictionary containing
+            * strength --------- (n) sum of each node's weights
+            * clustering ------- (n) Onnela weighted clustering
+            * shortest_path ---- (n) average weighted distance to the
+                                   nodes it can reach (including itself,
+                                   see path_length_measures)
+            * efficiency ------- (n) average inverse weighted distance
+                                   to all the other nodes
+            * C_w -------------- average weighted clustering
+            * L_w -------------- weighted characteristic path length
+            * E_w -------------- weighted global efficiency
+    '''
+    import numpy as np
+
+    D = weighted_distances(M)
+    path_dict = path_length_measures(D)
+
+    measure_dict = {}
+    measure_dict['strength'] = weighted_strength(M)
+    measure_dict['clustering'] = weighted_clustering(M)
+    measure_dict['shortest_path'] = path_dict['shortest_path']
+    measure_dict['efficiency'] = path_dict['efficiency']
+
+    measure_dict['C_w'] = np.mean(measure_dict['clustering'])
+    measure_dict['L_w'] = path_dict['L']
+    measure_dict['E_w'] = path_dict['E']
+
+    return measure_dict
+
+
+def triangle_clustering(A):
+    '''
+    Binary clustering coefficient of every node (the same as
+    nx.clustering for an unweighted graph) for one graph or a
+    stack of graphs at once.
+
+    The number of triangles around each node is half the row sum
+    of (A . A) * A, and the stack goes through that as one sparse
+    block diagonal matrix so there's only one product for all
+    the graphs (eg: a real graph and its random graphs).
+
+    INPUTS:
+        A ------------- (n x n) adjacency matrix, array graph, or
+                          (k x n x n) stack of adjacency matrices
+
+    RETURNS:
+        clustering ---- (k x n) array
+    '''
+    import numpy as np
+    from scipy import sparse
+
+    A = _adjacency_stack(A)
+    k, n, n = A.shape
+
+    # Self loops don't make triangles
+    A[:, np.arange(n), np.arange(n)] = False
+
+    B = sparse.block_diag([ sparse.csr_matrix(a) for a in A ], format='csr').astype('float')
+
+    # Number of triangles each node is part of
+    triangles = np.asarray(B.dot(B).multiply(B).sum(axis=1)).reshape(k, n) / 2.0
+
+    degree = np.diff(B.indptr).reshape(k, n).astype('float')
+    n_pairs = degree * ( degree - 1 ) / 2.0
+
+    clustering = np.zeros([k, n])
+    np.divide(triangles, n_pairs, out=clustering, where=n_pairs > 0)
+
+    return clustering
+
+
+def array_graph_clustering(G_arr):
+    '''
+    Binary clustering coefficient of every node (the same
+    as nx.clustering for an unweighted graph)
+    '''
+    return triangle_clustering(G_arr)[0]
+
+
+def array_graph_assortativity(G_arr):
+    '''
+    Degree assortativity (the same as nx.degree_assortativity_coefficient
+    for an unweighted graph): the correlation between the degrees at
+    either end of every edge
+    '''
+    import numpy as np
+
+    A_coo = G_arr['A'].tocoo()
+    k = np.diff(G_arr['A'].indptr).astype('float')
+
+    # Each edge is in A in both directions which
+    # makes the correlation symmetric
+    return np.corrcoef(k[A_coo.row], k[A_coo.col])[0, 1]
+
+
+def path_length_measures(D):
+    '''
+    The nodal and global measures that only depend on the (n x n)
+    shortest path lengths D. Unreachable pairs (np.inf) are left out
+    of the path lengths and count as zero efficiency.
+
+    RETURNS:
+        path_dict --- a dictionary containing
+            * shortest_path -- (n) average distance to the nodes it can
+                                 reach, including itself (the same as
+                                 averaging nx.shortest_path_length, which
+                                 is what shortest_path in networkx_functions
+                                 has always done)
+            * efficiency ----- (n) average inverse distance to
+                                 the other nodes
+            * closeness ------ (n) closeness centrality, scaled by the
+                                 fraction of nodes that can be reached
+                                 (the same as networkx)
+            * L -------------- characteristic path length
+            * E -------------- global efficiency
+    '''
+    import numpy as np
+
+    n = D.shape[0]
+    off_diag = ~np.eye(n, dtype=bool)
+    finite = np.isfinite(D) & off_diag
+
+    inv_D = np.zeros_like(D)
+    inv_D[finite] = 1.0 / D[finite]
+    D_finite = np.where(finite, D, 0)
+    n_reach = finite.sum(axis=1)
+    sum_D = D_finite.sum(axis=1)
+
+    path_dict = {}
+    path_dict['shortest_path'] = sum_D / ( n_reach + 1.0 )
+    path_dict['efficiency'] = inv_D.sum(axis=1) / (n - 1.0)
+
+    closeness = np.zeros(n)
+    np.divide(n_reach * n_reach / (n - 1.0), sum_D, out=closeness, where=sum_D > 0)
+    path_dict['closeness'] = closeness
+
+    path_dict['L'] = D_finite.sum() / max(finite.sum(), 1)
+    path_dict['E'] = inv_D.sum() / (n * (n - 1.0))
+
+    return path_dict
+
+
+def array_graph_measures(G_arr, n_runs=1):
+    '''
+    The global and nodal measures for one graph, calculated with
+    arrays rather than networkx wherever possible. Graphs that aren't
+    connected are fine: unreachable pairs are left out of the path
+    lengths and count as zero efficiency.
+
+    The modules come from the consensus of n_runs runs of the Louvain
+    algorithm (see consensus_partition in networkx_functions). One
+    seeded run is the default because this is run for every subject.
+
+    RETURNS:
+        global_dict --- a dictionary containing
+            * n_edges ------- number of edges
+            * density ------- proportion of possible edges
+            * degree -------- average degree
+            * n_components -- number of connected components
+            * C ------------- average clustering
+            * L ------------- characteristic path length
+            * E ------------- global efficiency
+            * a ------------- degree assortativity
+            * M ------------- modularity of the consensus Louvain partition
+        nodal_dict ---- a dictionary of (n_nodes) arrays containing
+            * degree, strength, clustering, closeness, betweenness,
+              shortest_path, efficiency, module, pc, within_module_z
+              and role (see module_degree_measures)
+    '''
+    import numpy as np
+    import community
+    from scipy.sparse.csgraph import connected_components
+    from networkx_functions import consensus_partition
+
+    n = G_arr['n_nodes']
+
+    # Hop counts between every pair of nodes
+    D = hop_distances(G_arr)[0]
+    path_dict = path_length_measures(D)
+
+    nodal_dict = {}
+    nodal_dict['degree'] = array_graph_degrees(G_arr)
+    nodal_dict['strength'] = array_graph_degrees(G_arr, weighted=True)
+    nodal_dict['clustering'] = array_graph_clustering(G_arr)
+    for name in [ 'shortest_path', 'efficiency', 'closeness' ]:
+        nodal_dict[name] = path_dict[name]
+
+    nodal_dict['betweenness'] = betweenness_centrality(G_arr)
+
+    # Modularity still comes from python-louvain on the binary
+    # graph (the consensus of n_runs runs, see consensus_partition)
+    G_bin = dict(G_arr)
+    G_bin['W'] = None
+    G = array_graph_to_nx(G_bin)
+
+    partition = consensus_partition(G, n_runs=n_runs)['partition']
+    nodal_dict['module'] = np.array([ partition[node] for node in range(n) ])
+
+    module_dict = module_degree_measures(G_arr, nodal_dict['module'])
+    for name in [ 'pc', 'within_module_z', 'role' ]:
+        nodal_dict[name] = module_dict[name][0]
+
+    global_dict = {}
+    global_dict['n_edges'] = G_arr['A'].nnz // 2
+    global_dict['density'] = G_arr['A'].nnz / (n * (n - 1.0))
+    global_dict['degree'] = np.mean(nodal_dict['degree'])
+    global_dict['n_components'] = connected_components(G_arr['A'], directed=False)[0]
+    global_dict['C'] = np.mean(nodal_dict['clustering'])
+    global_dict['L'] = path_dict['L']
+    global_dict['E'] = path_dict['E']
+    global_dict['a'] = array_graph_assortativity(G_arr)
+    # Modularity isn't defined for a graph without any edges
+    if G_arr['A'].nnz > 0:
+        global_dict['M'] = community.modularity(partition, G)
+    else:
+        global_dict['M'] = np.nan
+
+    return global_dict, nodal_dict
+
+
+def _trapezoid(y, x):
+    '''
+    Area under the curve(s) y (first axis) over x
+    '''
+    import numpy as np
+
+    y = np.asarray(y, dtype='float')
+    dx = np.diff(np.asarray(x, dtype='float'))
+    dx = dx.reshape([-1] + [1] * (y.ndim - 1))
+
+    return np.sum(dx * ( y[1:] + y[:-1] ) / 2.0, axis=0)
+
+
+def cost_sweep_measures(M, cost_list=range(1, 31)):
+    '''
+    Global and nodal measures at every cost in cost_list, and the area
+    under each measure's curve (integrated over cost) so the results
+    don't hang on one arbitrary choice of cost.
+
+    The graphs are nested (each cost just adds the next edges in the
+    rank_edges order to the one before) so the degrees and the number
+    of triangles around each node are updated as the edges are added
+    rather than worked out from scratch for every cost. The path length
+    measures are recalculated with hop_distances, and the betweenness
+    with betweenness_centrality, at each cost. Modularity is left out
+    because it costs as much as everything else put together.
+
+    Every graph contains the minimum spanning tree so there is only ever
+    one connected component.
+
+    INPUTS:
+        M ------------- full association matrix
+        cost_list ----- list of at least two different costs (percentages,
+                          0 to 100), they're put in increasing order
+                          default = range(1, 31)
+
+    RETURNS:
+        sweep_dict ---- a dictionary containing
+            * cost ----------- the costs
+            * global --------- dictionary of (n_costs) arrays: n_edges,
+                                 degree, C, L, E, a
+            * nodal ---------- dictionary of (n_costs x n) arrays: degree,
+                                 clustering, shortest_path, efficiency,
+                                 closeness, betweenness
+            * global_auc ----- area under each of the global curves
+            * nodal_auc ------ (n) area under each node's curves
+    '''
+    import numpy as np
+    from networkx_functions import rank_edges, n_edges_at_cost
+
+    # The edges are added in order of cost and the curves
+    # need at least two points to have an area under them
+    cost_list = np.unique(np.asarray(cost_list, dtype='float'))
+    if len(cost_list) < 2:
+        raise ValueError('cost_sweep_measures needs at least two different costs, got {}'.format(list(cost_list)))
+
+    n = M.shape[0]
+    n_costs = len(cost_list)
+    edge_i, edge_j, n_mst = rank_edges(M)
+
+    global_names = [ 'n_edges', 'degree', 'C', 'L', 'E', 'a' ]
+    nodal_names = [ 'degree', 'clustering', 'shortest_path', 'efficiency', 'closeness', 'betweenness' ]
+
+    sweep_dict = { 'cost'   : np.array(cost_list, dtype='float'),
+                   'global' : dict([ (name, np.zeros(n_costs)) for name in global_names ]),
+                   'nodal'  : dict([ (name, np.zeros([n_costs, n])) for name in nodal_names ]) }
+
+    # The graph so far, its degrees and the number
+    # of triangles around each node
+    A = np.zeros([n, n], dtype=bool)
+    degree = np.zeros(n)
+    triangles = np.zeros(n)
+    n_done = 0
+
+    for c, cost in enumerate(cost_list):
+
+        n_edges = n_edges_at_cost(n, cost, n_mst)
+
+        # Add the new edges one at a time. Each one makes a new
+        # triangle with every neighbour its two nodes have in common
+        for e in range(n_done, n_edges):
+            u, v = edge_i[e], edge_j[e]
+            common = A[u] & A[v]
+            n_common = np.sum(common)
+            triangles[u] += n_common
+            triangles[v] += n_common
+            triangles[common] += 1
+            A[u, v] = True
+            A[v, u] = True
+
+        degree += ( np.bincount(edge_i[n_done:n_edges], minlength=n)
+                        + np.bincount(edge_j[n_done:n_edges], minlength=n) )
+        n_done = n_edges
+
+        n_pairs = degree * (degree - 1) / 2.0
+        clustering = np.zeros(n)
+        np.divide(triangles, n_pairs, out=clustering, where=n_pairs > 0)
+
+        # The path lengths have to be calculated again
+        D = hop_distances(A)[0]
+        path_dict = path_length_measures(D)
+
+        # Assortativity is the correlation of the degrees
+        # at either end of every edge (in both directions)
+        k_i = degree[edge_i[:n_edges]]
+        k_j = degree[edge_j[:n_edges]]
+        a = np.corrcoef(np.hstack([ k_i, k_j ]), np.hstack([ k_j, k_i ]))[0, 1]
+
+        sweep_dict['global']['n_edges'][c] = n_edges
+        sweep_dict['global']['degree'][c] = np.mean(degree)
+        sweep_dict['global']['C'][c] = np.mean(clustering)
+        sweep_dict['global']['L'][c] = path_dict['L']
+        sweep_dict['global']['E'][c] = path_dict['E']
+        sweep_dict['global']['a'][c] = a
+
+        sweep_dict['nodal']['degree'][c, :] = degree
+        sweep_dict['nodal']['clustering'][c, :] = clustering
+        for name in [ 'shortest_path', 'efficiency', 'closeness' ]:
+            sweep_dict['nodal'][name][c, :] = path_dict[name]
+        sweep_dict['nodal']['betweenness'][c, :] = betweenness_centrality(A)
+
+    # Integrate each curve over the costs
+    sweep_dict['global_auc'] = {}
+    sweep_dict['nodal_auc'] = {}
+
+    for name in global_names:
+        sweep_dict['global_auc'][name] = _trapezoid(sweep_dict['global'][name], cost_list)
+    for name in nodal_names:
+        sweep_dict['nodal_auc'][name] = _trapezoid(sweep_dict['nodal'][name], cost_list)
+
+    return sweep_dict
+
+
+def _adjacency_stack(A):
+    '''
+    Turn an array graph, a (sparse or dense) adjacency matrix or
+    a (k x n x n) stack of them into a boolean (k x n x n) array
+    '''
+    import numpy as np
+    from scipy import sparse
+
+    if isinstance(A, dict):
+        A = A['A']
+    if sparse.issparse(A):
+        A = A.toarray()
+
+    A = np.asarray(A) != 0
+    if A.ndim == 2:
+        A = A[np.newaxis, :, :]
+
+    return A
+
+
+def hop_distances(A):
+    '''
+    Unweighted shortest path lengths (number of edges) between every
+    pair of nodes, for one graph or a (k x n x n) stack of them at once.
+
+    This works outwards from every node at the same time: the nodes
+    that are d steps away are the neighbours of the nodes that are
+    d - 1 steps away that haven't been reached yet, which is one
+    (batched) matrix multiplication per step. Our graphs are small
+    world so it only takes a handful of steps.
+
+    INPUTS:
+        A ----------- adjacency matrix (dense or sparse), array graph,
+                        or (k x n x n) stack of adjacency matrices
+
+    RETURNS:
+        D ----------- (k x n x n) array of distances (np.inf for pairs
+                        that aren't connected)
+    '''
+    import numpy as np
+
+    A = _adjacency_stack(A)
+    k, n, n = A.shape
+
+    A_f = A.astype('float32')
+
+    D = np.full([k, n, n], np.inf)
+    D[:, np.arange(n), np.arange(n)] = 0
+    D[A] = 1
+
+    reached = A | np.eye(n, dtype=bool)[np.newaxis, :, :]
+    frontier = A_f
+
+    d = 1
+    while True:
+        d += 1
+        new = ( np.matmul(frontier, A_f) > 0 ) & ~reached
+        if not new.any():
+            break
+        D[new] = d
+        reached |= new
+        frontier = new.astype('float32')
+
+    return D
+
+
+def _inverse_distances(D):
+    '''
+    1/D with zeros on the diagonal and for unconnected pairs
+    '''
+    import numpy as np
+
+    inv_D = np.zeros_like(D)
+    finite = np.isfinite(D) & ( D > 0 )
+    inv_D[finite] = 1.0 / D[finite]
+
+    return inv_D
+
+
+def local_efficiency(A):
+    '''
+    Local efficiency of every node (Latora and Marchiori 2001): the
+    global efficiency of the subgraph made up of the node's neighbours
+    (the same as networkx's local_efficiency before averaging). Nodes
+    with fewer than two neighbours have a local efficiency of 0.
+
+    All the neighbourhood subgraphs of a graph are padded to the same
+    size and put through hop_distances together.
+
+    RETURNS:
+        E_local ----- (k x n) array of local efficiencies
+    '''
+    import numpy as np
+
+    A = _adjacency_stack(A)
+    k, n, n = A.shape
+
+    E_local = np.zeros([k, n])
+
+    for g in range(k):
+        degrees = A[g].sum(axis=1)
+        k_max = max(degrees.max(), 1)
+
+        # One (padded) neighbourhood subgraph per node
+        sub = np.zeros([n, k_max, k_max], dtype=bool)
+        for i in range(n):
+            nbrs = np.flatnonzero(A[g, i])
+            sub[i, :len(nbrs), :len(nbrs)] = A[g][np.ix_(nbrs, nbrs)]
+
+        inv_sum = _inverse_distances(hop_distances(sub)).sum(axis=(1, 2))
+
+        n_pairs = degrees * (degrees - 1.0)
+        np.divide(inv_sum, n_pairs, out=E_local[g], where=n_pairs > 0)
+
+    return E_local
+
+
+def efficiency_measures(A, local=True):
+    '''
+    Global, nodal and (if local is True) local efficiency for one
+    graph or a (k x n x n) stack of graphs from their hop distances.
+
+    INPUTS:
+        A ----------- adjacency matrix (dense or sparse), array graph,
+                        or (k x n x n) stack of adjacency matrices
+        local ------- whether to calculate the local efficiency too
+                        default = True
+
+    RETURNS:
+        eff_dict ---- a dictionary containing
+            * E ------------------- (k) global efficiency
+            * nodal_efficiency ---- (k x n) average inverse distance
+                                      from each node to all the others
+            * local_efficiency ---- (k x n) local efficiency
+            * E_local ------------- (k) average local efficiency
+    '''
+    import numpy as np
+
+    A = _adjacency_stack(A)
+    k, n, n = A.shape
+
+    inv_D = _inverse_distances(hop_distances(A))
+
+    eff_dict = {}
+    eff_dict['nodal_efficiency'] = inv_D.sum(axis=2) / (n - 1.0)
+    eff_dict['E'] = eff_dict['nodal_efficiency'].mean(axis=1)
+
+    if local:
+        eff_dict['local_efficiency'] = local_efficiency(A)
+        eff_dict['E_local'] = eff_dict['local_efficiency'].mean(axis=1)
+
+    return eff_dict
+
+
+def betweenness_from_sources(A, sources):
+    '''
+    The contribution of the shortest paths that start at each of the
+    sources to every node's (unnormalised) betweenness, using Brandes'
+    algorithm on all the sources at once.
+
+    Going forwards, each BFS level's number of shortest paths (sigma)
+    is the previous level's multiplied by the adjacency matrix. Going
+    backwards, the dependencies (delta) are passed from each level to
+    the one before it in the same way:
+
+        delta(v) = sum over w one level further out of
+                       sigma(v) / sigma(w) * (1 + delta(w))
+
+    INPUTS:
+        A ----------- (n x n) binary adjacency matrix
+        sources ----- list of source nodes
+
+    RETURNS:
+        betweenness - (n) array of the summed dependencies
+    '''
+    import numpy as np
+
+    A = ( np.asarray(A) != 0 ).astype('float')
+    n = A.shape[0]
+    sources = np.asarray(sources, dtype='int')
+    b = len(sources)
+
+    # Forward: count the shortest paths to each node level by level
+    sigma = np.zeros([b, n])
+    sigma[np.arange(b), sources] = 1
+    visited = sigma > 0
+    frontier = sigma.copy()
+    levels = []
+
+    while True:
+        paths = np.dot(frontier, A)
+        new = ( paths > 0 ) & ~visited
+        if not new.any():
+            break
+        frontier = paths * new
+        sigma += frontier
+        visited |= new
+        levels += [ new ]
+
+    # Backward: accumulate the dependencies from the furthest
+    # level in to the first one (the sources themselves don't count)
+    delta = np.zeros([b, n])
+    sigma_safe = np.where(sigma > 0, sigma, 1)
+
+    for d in range(len(levels) - 1, 0, -1):
+        w = levels[d] * ( 1 + delta ) / sigma_safe
+        delta += levels[d - 1] * sigma * np.dot(w, A)
+
+    return delta.sum(axis=0)
+
+
+def _betweenness_task(args):
+    '''
+    One job for the process pool: (A, sources)
+    '''
+    A, sources = args
+
+    return betweenness_from_sources(A, sources)
+
+
+def betweenness_centrality(A, normalized=True, n_processes=1, batch_size=100):
+    '''
+    Betweenness centrality of every node (the same as
+    nx.betweenness_centrality for an unweighted graph).
+
+    INPUTS:
+        A ------------- (n x n) adjacency matrix, or array graph
+        normalized ---- divide by the number of pairs of other nodes
+                          default = True
+        n_processes --- number of processes to share the source
+                          nodes between
+                          default = 1
+        batch_size ---- number of source nodes in each job
+                          default = 100
+
+    RETURNS:
+        betweenness --- (n) array
+    '''
+    import numpy as np
+
+    A = _adjacency_stack(A)[0].astype('float')
+    n = A.shape[0]
+
+    jobs = [ (A, range(start, min(start + batch_size, n))) for start in range(0, n, batch_size) ]
+
+    if n_processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(n_processes)
+        results = pool.map(_betweenness_task, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = [ _betweenness_task(job) for job in jobs ]
+
+    return _rescale_betweenness(np.sum(results, axis=0), n, normalized)
+
+
+def _rescale_betweenness(betweenness, n, normalized):
+    '''
+    Every path has been counted from both ends so either halve
+    the betweenness or divide by the number of ordered pairs of
+    other nodes (which is what networkx does)
+    '''
+    if normalized:
+        if n > 2:
+            return betweenness / ( (n - 1.0) * (n - 2.0) )
+        return betweenness
+
+    return betweenness / 2.0
+
+
+def _betweenness_graph_task(args):
+    '''
+    One job for the process pool: (A, normalized) for a whole graph
+    '''
+    A, normalized = args
+
+    return _rescale_betweenness(betweenness_from_sources(A, range(A.shape[0])), A.shape[0], normalized)
+
+
+def betweenness_batch(A_stack, normalized=True, n_processes=1):
+    '''
+    Betweenness centrality for lots of graphs at once (eg: every
+    cost for every matrix), with the graphs shared out between
+    a pool of processes.
+
+    INPUTS:
+        A_stack ------- (k x n x n) stack (or list) of adjacency matrices
+        normalized ---- see betweenness_centrality
+                          default = True
+        n_processes --- number of processes
+                          default = 1
+
+    RETURNS:
+        betweenness --- (k x n) array
+    '''
+    import numpy as np
+
+    jobs = [ (( np.asarray(A) != 0 ).astype('float'), normalized) for A in A_stack ]
+
+    if n_processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(n_processes)
+        results = pool.map(_betweenness_graph_task, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = [ _betweenness_graph_task(job) for job in jobs ]
+
+    return np.array(results)
+
+
+def module_degree_measures(A, partition):
+    '''
+    Participation coefficient, within-module degree z-score and
+    node role (Guimera and Amaral 2005) for one graph or a stack of
+    graphs and their partitions.
+
+    The number of edges from every node to every module comes from
+    one product of the adjacency matrix and a module indicator matrix.
+
+    INPUTS:
+        A ------------- (n x n) adjacency matrix, array graph, or
+                          (k x n x n) stack of adjacency matrices
+        partition ----- (n) or (k x n) array of module labels
+
+    RETURNS:
+        module_dict --- a dictionary of (k x n) arrays containing
+            * pc ------------------ participation coefficient:
+                                      1 - sum over modules of
+                                      (edges to that module / degree)^2
+            * within_module_degree  number of edges to the node's own module
+            * within_module_z ----- within module degree z-scored within
+                                      each module (0 if every node in the
+                                      module has the same degree)
+            * role ---------------- 1 to 7: ultra-peripheral, peripheral,
+                                      non-hub connector, non-hub kinless,
+                                      provincial hub, connector hub and
+                                      kinless hub
+    '''
+    import numpy as np
+
+    A = _adjacency_stack(A).astype('float')
+    k, n, n = A.shape
+
+    partition = np.asarray(partition).reshape(-1, n)
+    if partition.shape[0] == 1 and k > 1:
+        partition = np.tile(partition, (k, 1))
+
+    # Renumber the modules from 0 for each graph
+    labels = np.array([ np.unique(p, return_inverse=True)[1] for p in partition ])
+    n_modules = labels.max() + 1
+
+    S = np.zeros([k, n, n_modules])
+    S[np.arange(k)[:, None], np.arange(n)[None, :], labels] = 1
+
+    # Edges from every node to every module
+    K = np.matmul(A, S)
+    degree = K.sum(axis=2)
+
+    frac = np.zeros_like(K)
+    np.divide(K, degree[:, :, None], out=frac, where=degree[:, :, None] > 0)
+    pc = np.where(degree > 0, 1 - np.sum(frac ** 2, axis=2), 0)
+
+    graph_index = np.arange(k)[:, None]
+    within = K[graph_index, np.arange(n)[None, :], labels]
+
+    # Mean and standard deviation of the within module
+    # degree for each module
+    n_in = S.sum(axis=1)
+    n_in_safe = np.where(n_in > 0, n_in, 1)
+    mod_mean = np.matmul(within[:, None, :], S)[:, 0, :] / n_in_safe
+    mod_sq = np.matmul(( within ** 2 )[:, None, :], S)[:, 0, :] / n_in_safe
+    mod_std = np.sqrt(np.maximum(mod_sq - mod_mean ** 2, 0))
+
+    node_mean = mod_mean[graph_index, labels]
+    node_std = mod_std[graph_index, labels]
+
+    z = np.zeros([k, n])
+    np.divide(within - node_mean, node_std, out=z, where=node_std > 0)
+
+    # Guimera and Amaral's roles
+    hub = z >= 2.5
+    role = np.where(hub,
+                    5 + np.digitize(pc, [ 0.30, 0.75 ], right=True),
+                    1 + np.digitize(pc, [ 0.05, 0.62, 0.80 ], right=True))
+
+    module_dict = {}
+    module_dict['pc'] = pc
+    module_dict['within_module_degree'] = within
+    module_dict['within_module_z'] = z
+    module_dict['role'] = role
+
+    return module_dict
+
+
+def rich_club_coefficients(A, k_max=None):
+    '''
+    The (unnormalized) rich club coefficient of one graph or a stack
+    of graphs for every degree k at once:
+
+        phi(k) = 2 E_k / ( N_k (N_k - 1) )
+
+    where N_k is the number of nodes with degree > k and E_k is the
+    number of edges between them.
+
+    The nodes are sorted by degree once, so the nodes with degree > k
+    are always the last N_k rows and columns of the sorted adjacency
+    matrix. Cumulative sums from the bottom right corner then give the
+    number of edges in every one of those corners in one go.
+
+    INPUTS:
+        A ------------- (n x n) adjacency matrix, array graph, or
+                          (g x n x n) stack of adjacency matrices
+        k_max --------- the coefficients are for k = 0 to k_max - 1
+                          default = None (the largest degree in any
+                          of the graphs)
+
+    RETURNS:
+        phi ----------- (g x k_max) array (nan where there are fewer
+                          than two nodes with degree > k)
+    '''
+    import numpy as np
+
+    A = _adjacency_stack(A)
+    g, n, n = A.shape
+
+    degree = A.sum(axis=2)
+    if k_max is None:
+        k_max = int(degree.max())
+
+    # Sort the nodes by degree and put the highest degree nodes first
+    order = np.argsort(-degree, axis=1, kind='mergesort')
+    graph_index = np.arange(g)[:, None, None]
+    A_sorted = A[graph_index, order[:, :, None], order[:, None, :]].astype('float')
+
+    # Edges (counted twice) among the first t nodes for t = 1 to n
+    corner = np.cumsum(np.cumsum(A_sorted, axis=1), axis=2)
+    corner = corner[:, np.arange(n), np.arange(n)]
+    corner = np.hstack([ np.zeros([g, 1]), corner ])
+
+    # The number of nodes with degree > k, for every k
+    k_values = np.arange(k_max)
+    N_k = np.sum(degree[:, :, None] > k_values[None, None, :], axis=1)
+
+    E_k = corner[np.arange(g)[:, None], N_k] / 2.0
+
+    phi = np.ones([g, k_max]) * np.nan
+    possible = N_k * ( N_k - 1 ) / 2.0
+    np.divide(E_k, possible, out=phi, where=N_k > 1)
+
+    return phi
+
+
+def rich_club_curves(A, A_null):
+    '''
+    The rich club curve of a graph, normalized against an ensemble
+    of null graphs (eg: the random graphs from random_graph), for
+    every degree at once.
+
+    INPUTS:
+        A ------------- (n x n) adjacency matrix or array graph
+        A_null -------- (r x n x n) stack (or list) of the null graphs'
+                          adjacency matrices
+
+    RETURNS:
+        rc_dict ------- a dictionary containing
+            * degree ------- the k values: 0 up to the last k that has at
+                               least two nodes with degree > k in the
+                               real graph
+            * rc ----------- the rich club coefficient of the real graph
+            * rc_rand ------ (len(degree) x r) coefficients for each of
+                               the null graphs
+            * rc_norm ------ rc divided by the mean of rc_rand (nan where
+                               the mean is 0)
+            * rc_norm_std -- standard deviation across the null graphs
+                               of rc / rc_rand
+    '''
+    import numpy as np
+
+    A = _adjacency_stack(A)
+    A_null = _adjacency_stack(np.asarray(A_null))
+
+    # Stop at the same place as nx.rich_club_coefficient: the last
+    # k that has at least two nodes with degree > k
+    degree = A[0].sum(axis=1)
+    k_max = int(np.sum([ np.sum(degree > k) > 1 for k in range(int(degree.max())) ]))
+
+    phi = rich_club_coefficients(np.concatenate([ A, A_null ]), k_max=k_max)
+
+    rc = phi[0]
+    rc_rand = phi[1:].T
+
+    rc_norm = np.ones_like(rc) * np.nan
+    rand_mean = np.mean(rc_rand, axis=1)
+    np.divide(rc, rand_mean, out=rc_norm, where=rand_mean > 0)
+
+    ratio = np.ones_like(rc_rand) * np.nan
+    np.divide(rc[:, None], rc_rand, out=ratio, where=rc_rand > 0)
+
+    rc_dict = {}
+    rc_dict['degree'] = np.arange(k_max)
+    rc_dict['rc'] = rc
+    rc_dict['rc_rand'] = rc_rand
+    rc_dict['rc_norm'] = rc_norm
+    rc_dict['rc_norm_std'] = np.nanstd(ratio, axis=1)
+
+    return rc_dict
+
+
+def ring_order(centroids):
+    '''
+    An order for the nodes that goes round the brain in a ring:
+    from the back to the front of the left hemisphere and then
+    from the front to the back of the right hemisphere, so that
+    nodes next to each other in the ring are close together.
+
+    INPUTS:
+        centroids ----- (n x 3) array of x, y, z coordinates
+
+    RETURNS:
+        order --------- (n) array of node indices
+    '''
+    import numpy as np
+
+    centroids = np.asarray(centroids)
+    left = np.flatnonzero(centroids[:, 0] < 0)
+    right = np.flatnonzero(centroids[:, 0] >= 0)
+
+    left = left[np.argsort(centroids[left, 1], kind='mergesort')]
+    right = right[np.argsort(-centroids[right, 1], kind='mergesort')]
+
+    return np.hstack([ left, right ])
+
+
+def lattice_reference(A, order=None, n_lattices=1, max_rounds=500, seed=None):
+    '''
+    Lattice versions of a graph with the same degree for every node,
+    made by swapping pairs of edges (a, b) and (c, d) for (a, d) and
+    (c, b) whenever that brings the edges closer to the diagonal of
+    the ring (Sporns and Zwi 2004, like nx.lattice_reference).
+
+    Rather than trying one swap at a time, every round pairs up all
+    of the edges at random and tries all the swaps at once for all
+    of the lattices. The swaps that would make an edge that's already
+    there, or the same edge as another swap, are left out. Every
+    other round the edges are paired with ones that run alongside
+    them instead, which finds most of the swaps once the easy ones
+    have been made. It stops when two rounds in a row don't make any
+    swaps or after max_rounds rounds.
+
+    Unlike nx.lattice_reference this doesn't check that the lattice
+    stays connected. Unreachable pairs are left out of the path
+    lengths anyway (see path_length_measures).
+
+    INPUTS:
+        A ------------- (n x n) adjacency matrix or array graph
+        order --------- the order of the nodes around the ring (eg:
+                          from ring_order)
+                          default = None (0 to n-1)
+        n_lattices ---- number of lattices to make
+                          default = 1
+        max_rounds ---- maximum number of rounds of swaps
+                          default = 500
+        seed ---------- seed for the random pairing of the edges
+                          default = None
+
+    RETURNS:
+        A_latt -------- (n_lattices x n x n) boolean array
+    '''
+    import numpy as np
+
+    rng = np.random.RandomState(seed)
+
+    A = _adjacency_stack(A)[0]
+    n = A.shape[0]
+    A[np.arange(n), np.arange(n)] = False
+
+    if order is None:
+        order = np.arange(n)
+
+    # Where each node is round the ring
+    position = np.zeros(n, dtype='int')
+    position[np.asarray(order)] = np.arange(n)
+
+    def ring_distance(x, y):
+        d = np.abs(position[x] - position[y])
+        return np.minimum(d, n - d)
+
+    # Every lattice starts off as a copy of the graph and the
+    # edges are kept in one list with the lattice they belong to
+    edge_i, edge_j = np.nonzero(np.triu(A, k=1))
+    m = len(edge_i)
+    half = m // 2
+
+    A_latt = np.repeat(A[np.newaxis, :, :], n_lattices, axis=0)
+    u = np.tile(edge_i, n_lattices)
+    v = np.tile(edge_j, n_lattices)
+
+    if half == 0:
+        return A_latt
+
+    n_quiet = 0
+
+    for r in range(max_rounds):
+
+        # Every other round pair each edge with one that runs alongside
+        # it (both ends in nearly the same places round the ring, so
+        # swapping their ends makes two short edges), otherwise pair
+        # them at random
+        if r % 2:
+            width = rng.randint(2, 11)
+            low = np.minimum(position[u], position[v])
+            high = np.maximum(position[u], position[v])
+            key = ( ( low + rng.randint(width) ) // width ) * n + high
+        else:
+            key = rng.rand(len(u))
+        perm = np.argsort(key.reshape(n_lattices, m), axis=1, kind='mergesort') + np.arange(n_lattices)[:, None] * m
+        e1 = perm[:, 0:2 * half:2].ravel()
+        e2 = perm[:, 1:2 * half:2].ravel()
+        g = np.repeat(np.arange(n_lattices), half)
+
+        a, b = u[e1], v[e1]
+        c, d = u[e2], v[e2]
+
+        # The two ways to swap the ends: (a, d) and (c, b) or
+        # (a, c) and (d, b). The new edges mustn't be self loops
+        # or edges that are already there, and they have to be
+        # closer to the ring's diagonal than the old ones
+        old_distance = ring_distance(a, b) + ring_distance(c, d)
+        gain = []
+        for x, y in [ (c, d), (d, c) ]:
+            ok = ( a != x ) & ( a != y ) & ( b != x ) & ( b != y )
+            ok &= ~A_latt[g, a, y] & ~A_latt[g, x, b]
+            gain += [ np.where(ok, old_distance - ring_distance(a, y) - ring_distance(x, b), 0) ]
+
+        # Take whichever way is better
+        flip = gain[1] > gain[0]
+        c, d = np.where(flip, d, c), np.where(flip, c, d)
+        ok = np.maximum(gain[0], gain[1]) > 0
+
+        # Leave out any swaps that would make the same
+        # edge as another swap in this round
+        s = np.flatnonzero(ok)
+        new_edges = np.hstack([ ( g[s] * n + np.minimum(a[s], d[s]) ) * n + np.maximum(a[s], d[s]),
+                                ( g[s] * n + np.minimum(c[s], b[s]) ) * n + np.maximum(c[s], b[s]) ])
+        unique_edges, inverse, counts = np.unique(new_edges, return_inverse=True, return_counts=True)
+        repeated = counts[inverse] > 1
+        s = s[~( repeated[:len(s)] | repeated[len(s):] )]
+
+        # Stop once neither sort of pairing finds any swaps
+        n_quiet = n_quiet + 1 if len(s) == 0 else 0
+        if n_quiet == 2:
+            break
+
+        g, a, b, c, d = g[s], a[s], b[s], c[s], d[s]
+
+        A_latt[g, a, b] = False
+        A_latt[g, b, a] = False
+        A_latt[g, c, d] = False
+        A_latt[g, d, c] = False
+        A_latt[g, a, d] = True
+        A_latt[g, d, a] = True
+        A_latt[g, c, b] = True
+        A_latt[g, b, c] = True
+
+        u[e1[s]], v[e1[s]] = a, d
+        u[e2[s]], v[e2[s]] = c, b
+
+    return A_latt
+
+
+def small_world_measures(C, L, C_rand, L_rand, C_latt, L_latt):
+    '''
+    The small world measures that compare a graph to both random
+    and lattice graphs with the same degrees. The random and lattice
+    values can be single numbers or arrays (in which case their
+    averages are used).
+
+    RETURNS:
+        sw_dict ------- a dictionary containing
+            * omega -------- L_rand / L - C / C_latt (Telesford et al.
+                               2011): close to 0 for small world graphs,
+                               negative for lattices and positive for
+                               random graphs
+            * swp ---------- small world propensity (Muldoon et al. 2016):
+                               1 - sqrt((dC^2 + dL^2) / 2) where dC and dL
+                               are how far the clustering and path length
+                               have moved from the lattice and random
+                               values (both clipped to 0 to 1)
+    '''
+    import numpy as np
+
+    C_rand = np.mean(C_rand)
+    L_rand = np.mean(L_rand)
+    C_latt = np.mean(C_latt)
+    L_latt = np.mean(L_latt)
+
+    sw_dict = {}
+
+    if L > 0 and C_latt > 0:
+        sw_dict['omega'] = L_rand / L - C / C_latt
+    else:
+        sw_dict['omega'] = np.nan
+
+    delta_C = ( C_latt - C ) / ( C_latt - C_rand ) if C_latt != C_rand else 0.0
+    delta_L = ( L - L_rand ) / ( L_latt - L_rand ) if L_latt != L_rand else 0.0
+
+    delta_C = np.clip(delta_C, 0, 1)
+    delta_L = np.clip(delta_L, 0, 1)
+
+    sw_dict['swp'] = 1 - np.sqrt(( delta_C ** 2 + delta_L ** 2 ) / 2.0)
+
+    return sw_dict
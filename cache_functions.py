@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+'''
+A little cache for the things we derive over and over again
+(correlation matrices, thresholded graphs, nodal measures).
+
+Checking whether the output file exists isn't enough because the
+file survives changes to the behavmerge csv, the covariates or the
+way the cohort is split. So every output gets a small ".hash" file
+next to it that records a hash of everything that went into making
+it, and the output is only re-used if that hash still matches.
+
+Usage:
+    cache_dict = create_cache()
+    M = load_or_create(cache_dict, mat_name,
+                        [ df[aparc_names + covars], covars, demean ],
+                        lambda : create_mat(df, aparc_names, covars, demean=demean)[1])
+    cache_summary(cache_dict)
+'''
+
+def create_cache():
+    '''
+    Create the dictionary that keeps track of the cache statistics
+    '''
+    cache_dict = { 'hits'    : 0,
+                   'misses'  : 0,
+                   'stale'   : 0,
+                   'log'     : [] }
+
+    return cache_dict
+
+
+def _update_hash(h, x):
+    '''
+    Add x to the hashlib object h, looking inside
+    lists, dictionaries, numpy arrays and pandas objects
+    '''
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(x, pd.DataFrame):
+        h.update(b'DataFrame')
+        _update_hash(h, list(x.columns))
+        _update_hash(h, list(x.index))
+        for col in x.columns:
+            _update_hash(h, x[col].values)
+
+    elif isinstance(x, pd.Series):
+        h.update(b'Series')
+        _update_hash(h, list(x.index))
+        _update_hash(h, x.values)
+
+    elif isinstance(x, np.ndarray):
+        h.update(repr((x.dtype.str, x.shape)).encode('utf-8'))
+        if x.dtype.kind == 'O':
+            _update_hash(h, x.tolist())
+        else:
+            h.update(np.ascontiguousarray(x))
+
+    elif isinstance(x, dict):
+        h.update(b'dict')
+        for key in sorted(x.keys()):
+            _update_hash(h, key)
+            _update_hash(h, x[key])
+
+    elif isinstance(x, (list, tuple)):
+        h.update(repr((type(x).__name__, len(x))).encode('utf-8'))
+        for item in x:
+            _update_hash(h, item)
+
+    else:
+        h.update(repr(x).encode('utf-8'))
+
+
+def hash_inputs(inputs):
+    '''
+    Return a hex string hash of the inputs (any mixture of strings,
+    numbers, lists, dictionaries, numpy arrays and data frames)
+    '''
+    import hashlib
+
+    h = hashlib.md5()
+    _update_hash(h, inputs)
+
+    return h.hexdigest()
+
+
+def file_hash(filename):
+    '''
+    Hash the contents of a file, so you can add eg: the
+    behavmerge csv file to the inputs of a cached output
+    '''
+    import hashlib
+
+    h = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def save_output(output, filename, kind='mat'):
+    '''
+    Save the output according to its kind:
+        'mat' ----- numpy array saved as a text file (save_mat)
+        'graph' --- networkx graph saved as a gpickle file
+        'ranks' --- edge ranks dictionary saved with save_edge_ranks
+        'pickle' -- anything else (eg: nodal measure dictionaries)
+    '''
+    import networkx as nx
+    import pickle
+    from networkx_functions import save_mat, save_edge_ranks
+
+    if kind == 'mat':
+        save_mat(output, filename)
+    elif kind == 'graph':
+        nx.write_gpickle(output, filename)
+    elif kind == 'ranks':
+        save_edge_ranks(output, filename)
+    else:
+        with open(filename, 'wb') as f:
+            pickle.dump(output, f, protocol=2)
+
+
+def load_output(filename, kind='mat'):
+    '''
+    The partner of save_output
+    '''
+    import numpy as np
+    import networkx as nx
+    import pickle
+    from networkx_functions import load_edge_ranks
+
+    if kind == 'mat':
+        return np.loadtxt(filename)
+    elif kind == 'graph':
+        return nx.read_gpickle(filename)
+    elif kind == 'ranks':
+        return load_edge_ranks(filename)
+    else:
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+
+def output_hash(filename, inputs, kind='mat'):
+    '''
+    The hash that load_or_create keeps next to filename
+    '''
+    import os
+
+    # Put the kind and the file's name in the hash too
+    # so that two outputs can't be confused for each other
+    return hash_inputs([ kind, os.path.basename(filename), inputs ])
+
+
+def is_up_to_date(filename, h):
+    '''
+    True if filename exists and its ".hash" file matches h
+    '''
+    import os
+
+    hash_filename = filename + '.hash'
+
+    old_h = None
+    if os.path.isfile(filename) and os.path.isfile(hash_filename):
+        with open(hash_filename) as f:
+            old_h = f.read().strip()
+
+    return old_h == h
+
+
+def save_with_hash(output, filename, h, kind='mat'):
+    '''
+    Save the output and then its hash. The hash goes second so an
+    output that was only half written (eg: because the job died)
+    never looks up to date.
+    '''
+    import os
+
+    # Make sure the directory exists
+    if not os.path.isdir(os.path.dirname(os.path.abspath(filename))):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)))
+
+    save_output(output, filename, kind=kind)
+    with open(filename + '.hash', 'w') as f:
+        f.write(h)
+
+
+def load_or_create(cache_dict, filename, inputs, create_func, kind='mat'):
+    '''
+    Load filename if it exists *and* was made from the same inputs,
+    otherwise call create_func() to (re)make it and save it.
+
+    INPUTS:
+        cache_dict --- the dictionary from create_cache
+        filename ----- where the output lives
+        inputs ------- everything that the output depends on (data,
+                         covariates, parameters, upstream matrices...)
+        create_func -- function with no arguments that makes the output
+        kind --------- 'mat', 'graph', 'ranks' or 'pickle' (see save_output)
+                         default = 'mat'
+
+    RETURNS:
+        output ------- the loaded or newly created output
+    '''
+    import os
+
+    h = output_hash(filename, inputs, kind=kind)
+
+    if is_up_to_date(filename, h):
+        cache_dict['hits'] += 1
+        cache_dict['log'] += [ (filename, 'hit') ]
+        return load_output(filename, kind=kind)
+
+    # It's either missing or out of date so make it again
+    if os.path.isfile(filename):
+        cache_dict['stale'] += 1
+        cache_dict['log'] += [ (filename, 'stale') ]
+    else:
+        cache_dict['log'] += [ (filename, 'miss') ]
+    cache_dict['misses'] += 1
+
+    output = create_func()
+
+    save_with_hash(output, filename, h, kind=kind)
+
+    # Text matrices are only saved to 5 decimal places so hand back
+    # what's on disk, otherwise anything downstream that is keyed
+    # on this matrix would look out of date on the next run
+    if kind == 'mat':
+        output = load_output(filename, kind=kind)
+
+    return output
+
+
+def cache_summary(cache_dict):
+    '''
+    Print the number of outputs that were re-used (hits),
+    made from scratch (misses) and of those misses how many
+    were remade because their inputs had changed (stale)
+    '''
+    n = cache_dict['hits'] + cache_dict['misses']
+    if n == 0:
+        print 'Cache not used yet'
+        return
+
+    print 'Cache: {} hits, {} misses ({} stale) - hit rate {:2.0f}%'.format(cache_dict['hits'],
+                                                                          cache_dict['misses'],
+                                                                          cache_dict['stale'],
+                                                                          cache_dict['hits'] * 100.0 / n)
@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+
+'''
+Alternatives to the plain partial correlation matrix that
+create_mat makes. Everything in here works on the residualised
+data matrix (see create_data_mats and residual_mat in
+networkx_functions) so the covariates only have to be taken
+out once.
+'''
+
+def standardise_residuals(R):
+    '''
+    Centre each column of the residuals and scale it so that
+    Z.T * Z / n_subs is the correlation matrix
+    '''
+    import numpy as np
+
+    Z = R - R.mean(axis=0)
+    Z = Z / np.sqrt(np.mean(Z**2, axis=0))
+
+    return Z
+
+
+def shrinkage_corr(R, method='LW'):
+    '''
+    Shrink the correlation matrix of the residuals (R) towards the
+    identity matrix.
+
+    INPUTS:
+        R ------- numpy array (n_subs x n_regions) of residuals
+        method -- 'LW' for Ledoit & Wolf (2004) or 'OAS' for the oracle
+                     approximating shrinkage of Chen et al (2010)
+                     default = 'LW'
+
+    RETURNS:
+        M ------- shrunk (n_regions x n_regions) correlation matrix
+        s ------- the shrinkage intensity (0 is the sample correlation
+                     matrix, 1 is the identity)
+    '''
+    import numpy as np
+
+    Z = standardise_residuals(R)
+    n_subs, n_regions = Z.shape
+
+    # Because the data are standardised the sample covariance is the
+    # correlation matrix and the target (mu * I) is just the identity
+    S = np.dot(Z.T, Z) / n_subs
+    mu = 1.0
+
+    if method == 'LW':
+        Z2 = Z**2
+        beta = np.sum(np.dot(Z2.T, Z2)) / n_subs - np.sum(S**2)
+        beta = beta / (n_subs * n_regions)
+        delta = np.sum((S - mu * np.eye(n_regions))**2) / n_regions
+        beta = min(beta, delta)
+        if delta == 0:
+            s = 0.0
+        else:
+            s = beta / delta
+
+    elif method == 'OAS':
+        alpha = np.mean(S**2)
+        num = alpha + mu**2
+        den = (n_subs + 1.0) * (alpha - mu**2 / n_regions)
+        if den == 0:
+            s = 1.0
+        else:
+            s = min(num / den, 1.0)
+
+    else:
+        print 'Unknown shrinkage method: {}'.format(method)
+        return None, None
+
+    M = (1.0 - s) * S + s * mu * np.eye(n_regions)
+
+    return M, s
+
+
+def partial_corr_from_precision(P):
+    '''
+    Convert a precision (inverse covariance) matrix into
+    a partial correlation matrix
+    '''
+    import numpy as np
+
+    d = np.sqrt(np.diag(P))
+    M = -P / np.outer(d, d)
+    M[np.diag_indices_from(M)] = 1.0
+
+    return M
+
+
+def glasso_path(R, alphas=None, rho=1.0, max_iter=500, tol=1e-4):
+    '''
+    Graphical lasso (sparse inverse covariance) estimates of the
+    partial correlation matrix for a grid of penalties.
+
+    The problem is solved with ADMM (Boyd et al 2011) which only
+    needs an eigendecomposition per iteration so it is all numpy.
+    The penalties are worked through from largest (sparsest) to
+    smallest and each solution is used as the starting point for
+    the next one, which cuts down the number of iterations a lot.
+
+    INPUTS:
+        R --------- numpy array (n_subs x n_regions) of residuals
+        alphas ---- list of penalties (applied to the off diagonal
+                      elements of the precision matrix of the
+                      correlation matrix)
+                      default = 10 values from 0.5 to 0.01
+        rho ------- ADMM step size
+                      default = 1.0
+        max_iter -- maximum number of iterations for each penalty
+                      default = 500
+        tol ------- convergence tolerance
+                      default = 1e-4
+
+    RETURNS:
+        alphas ---- the penalties in the order they were run
+        M_list ---- list of partial correlation matrices, one per penalty
+        n_iter ---- list of the number of iterations each penalty took
+    '''
+    import numpy as np
+
+    if alphas is None:
+        alphas = np.logspace(np.log10(0.5), np.log10(0.01), 10)
+
+    # Work down from the sparsest solution
+    alphas = np.sort(np.array(alphas, dtype='float'))[::-1]
+
+    Z = standardise_residuals(R)
+    n_subs, n_regions = Z.shape
+    S = np.dot(Z.T, Z) / n_subs
+
+    # The diagonal of the precision matrix isn't penalised
+    off_diag = ~np.eye(n_regions, dtype=bool)
+
+    # Start from the inverse of the (diagonal) sample variances
+    # with an empty scaled dual variable
+    Theta = np.diag(1.0 / np.diag(S))
+    U = np.zeros_like(S)
+
+    M_list = []
+    n_iter = []
+
+    for alpha in alphas:
+
+        for i in range(max_iter):
+
+            # Precision update: the closed form solution via the
+            # eigendecomposition of rho * (Theta - U) - S
+            d, Q = np.linalg.eigh(rho * (Theta - U) - S)
+            x = (d + np.sqrt(d**2 + 4.0 * rho)) / (2.0 * rho)
+            X = np.dot(Q * x, Q.T)
+
+            # Sparse update: soft threshold the off diagonal values
+            Theta_old = Theta
+            V = X + U
+            Theta = np.copy(V)
+            Theta[off_diag] = np.sign(V[off_diag]) * np.maximum(np.abs(V[off_diag]) - alpha / rho, 0)
+
+            # Dual update
+            U = U + X - Theta
+
+            # Check the primal and dual residuals
+            r_norm = np.linalg.norm(X - Theta)
+            s_norm = rho * np.linalg.norm(Theta - Theta_old)
+            if r_norm < tol * n_regions and s_norm < tol * n_regions:
+                break
+
+        M_list += [ partial_corr_from_precision(Theta) ]
+        n_iter += [ i + 1 ]
+
+    return alphas, M_list, n_iter
+
+
+def create_mat_estimators(df, aparc_names, covar, demean=False, alphas=None):
+    '''
+    Residualise the data once and then make a dictionary of
+    alternative correlation matrices to go alongside create_mat.
+
+    The keys are the labels that go into the mat_dict keys
+    (eg: CT_LW_covar_ones_all):
+        * LW ------- Ledoit-Wolf shrinkage correlation matrix
+        * OAS ------ oracle approximating shrinkage correlation matrix
+        * GL{:03.0f} - graphical lasso partial correlation matrix where
+                       the number is the penalty x 1000
+                       (eg: GL100 for alpha = 0.1)
+    '''
+    from networkx_functions import create_data_mats, residual_mat
+
+    X, C = create_data_mats(df, aparc_names, covar, demean=demean)
+    R = residual_mat(X, C)
+
+    est_dict = {}
+    est_dict['LW'] = shrinkage_corr(R, method='LW')[0]
+    est_dict['OAS'] = shrinkage_corr(R, method='OAS')[0]
+
+    alphas, M_list, n_iter = glasso_path(R, alphas=alphas)
+    for alpha, M in zip(alphas, M_list):
+        est_dict['GL{:03.0f}'.format(alpha * 1000)] = M
+
+    return est_dict
+
+
+def loo_influence(df, aparc_names, covar, demean=False, cost=None, batch_size=20):
+    '''
+    Leave-one-subject-out influence of every subject on every edge
+    of the create_mat partial correlation matrix.
+
+    Rather than calling create_mat once per subject, this uses the
+    fact that dropping subject k (and refitting the covariates without
+    them) changes the residual cross product matrix W = E.T * E by
+    a single rank-one term:
+
+        W_(-k) = W - e_k * e_k.T / (1 - h_k)
+
+    where e_k is subject k's row of residuals and h_k is their leverage
+    in the covariate design matrix. So once the residuals have been
+    calculated every subject's leave-one-out matrix is just a few
+    array operations.
+
+    INPUTS:
+        df ------------ pandas data frame
+        aparc_names --- list of regions (columns in df)
+        covar --------- list of covariate columns in df
+        demean -------- passed to create_data_mats
+                          default = False
+        cost ---------- if not None then also threshold each leave-one-out
+                          matrix at this cost and report the influence on
+                          nodal degree
+                          default = None
+        batch_size ---- number of subjects to process at once
+                          default = 20
+
+    RETURNS:
+        infl_dict - a dictionary containing
+            * r ------------- (n_regions x n_regions) full sample matrix
+            * r_diff -------- (n_subs x n_edges) r - r_(-k) for each edge in
+                                the upper triangle (np.triu_indices(n_regions, k=1)).
+                                Positive values mean that the subject makes
+                                the edge stronger
+            * mean_r_diff --- (n_subs) the same for the mean r
+          and if cost is not None
+            * degree_diff --- (n_subs x n_regions) degree - degree_(-k)
+            * degree_std_diff (n_subs) the same for the standard deviation
+                                of the degree distribution (the mean degree
+                                is fixed by the cost)
+    '''
+    import numpy as np
+    from networkx_functions import create_data_mats, residual_mat, adjacency_at_cost
+
+    X, C = create_data_mats(df, aparc_names, covar, demean=demean)
+    E = residual_mat(X, C)
+    n_subs, n_regions = E.shape
+    triu_i, triu_j = np.triu_indices(n_regions, k=1)
+
+    # Full sample residual cross products and correlations
+    W = np.dot(E.T, E)
+    d = np.sqrt(np.diag(W))
+    r = W / np.outer(d, d)
+
+    # Leverage of each subject in the design matrix
+    h = np.sum(np.dot(C, np.linalg.pinv(np.dot(C.T, C))) * C, axis=1)
+
+    infl_dict = {}
+    infl_dict['r'] = r
+    infl_dict['r_diff'] = np.zeros([n_subs, len(triu_i)])
+    infl_dict['mean_r_diff'] = np.zeros(n_subs)
+
+    if cost is not None:
+        A = adjacency_at_cost(r, cost)
+        degrees = A.sum(axis=0)
+        infl_dict['degree_diff'] = np.zeros([n_subs, n_regions])
+        infl_dict['degree_std_diff'] = np.zeros(n_subs)
+
+    for start in range(0, n_subs, batch_size):
+        stop = min(start + batch_size, n_subs)
+
+        # Rank-one downdates for the whole batch at once
+        e_b = E[start:stop, :]
+        scale = 1.0 / (1.0 - h[start:stop])
+        W_b = W[np.newaxis, :, :] - scale[:, np.newaxis, np.newaxis] * e_b[:, :, np.newaxis] * e_b[:, np.newaxis, :]
+
+        d_b = np.sqrt(W_b[:, np.arange(n_regions), np.arange(n_regions)])
+        r_b = W_b / (d_b[:, :, np.newaxis] * d_b[:, np.newaxis, :])
+
+        for b, k in enumerate(range(start, stop)):
+            infl_dict['r_diff'][k, :] = r[triu_i, triu_j] - r_b[b, triu_i, triu_j]
+            infl_dict['mean_r_diff'][k] = infl_dict['r_diff'][k, :].mean()
+
+            if cost is not None:
+                degrees_k = adjacency_at_cost(r_b[b], cost).sum(axis=0)
+                infl_dict['degree_diff'][k, :] = degrees - degrees_k
+                infl_dict['degree_std_diff'][k] = np.std(degrees) - np.std(degrees_k)
+
+    return infl_dict
+
+
+def bootstrap_consensus(df, aparc_names, covar, cost=10, n=1000, threshold=0.5, demean=False, batch_size=25, seed=None):
+    '''
+    Bootstrap consensus graph at this cost.
+
+    The subjects are resampled (with replacement) n times, the
+    create_mat partial correlation matrix is recalculated for each
+    resample and thresholded at the cost (see threshold_matrix), and
+    each edge's count of how many of the resampled graphs it turns up
+    in is kept in an integer matrix. The consensus graph keeps the
+    edges that are in at least threshold of them.
+
+    The cross products for a batch of resamples are calculated at
+    once (like permutation_group_corr) and the whole batch is
+    thresholded together.
+
+    INPUTS:
+        df ------------ pandas data frame
+        aparc_names --- list of regions (columns in df)
+        covar --------- list of covariate columns in df
+        cost ---------- cost (percentage) for each resampled graph
+                          default = 10
+        n ------------- number of bootstrap resamples
+                          default = 1000
+        threshold ----- proportion of the resampled graphs an edge
+                          needs to be in to make it into the consensus
+                          default = 0.5
+        demean -------- passed to create_data_mats
+                          default = False
+        batch_size ---- number of resamples to calculate at once
+                          default = 25
+        seed ---------- seed for the random number generator
+                          default = None
+
+    RETURNS:
+        boot_dict - a dictionary containing
+            * count ---------- (n_regions x n_regions) integer number of
+                                 resampled graphs that each edge is in
+            * frequency ------ count / n
+            * A_consensus ---- binary consensus adjacency matrix
+                                 (frequency >= threshold)
+            * n -------------- the number of resamples
+    '''
+    import numpy as np
+    from networkx_functions import create_data_mats, threshold_matrix
+
+    rng = np.random.RandomState(seed)
+
+    X, C = create_data_mats(df, aparc_names, covar, demean=demean)
+    n_subs, n_regions = X.shape
+
+    count = np.zeros([n_regions, n_regions], dtype='int32')
+
+    for start in range(0, n, batch_size):
+        stop = min(start + batch_size, n)
+
+        # Resample the subjects for every bootstrap in the batch
+        idx = rng.randint(0, n_subs, size=(stop - start, n_subs))
+        X_b = X[idx]
+        C_b = C[idx]
+        X_b_T = np.transpose(X_b, (0, 2, 1))
+        C_b_T = np.transpose(C_b, (0, 2, 1))
+
+        # Batched cross products
+        S_b = np.matmul(X_b_T, X_b)
+        P_b = np.matmul(C_b_T, X_b)
+        Q_b = np.matmul(C_b_T, C_b)
+
+        # Take the covariates out and turn what's
+        # left into correlation matrices
+        for b in range(stop - start):
+            S_b[b] -= np.dot(P_b[b].T, np.dot(np.linalg.pinv(Q_b[b]), P_b[b]))
+
+        d_b = np.sqrt(S_b[:, np.arange(n_regions), np.arange(n_regions)])
+        M_b = S_b / (d_b[:, :, np.newaxis] * d_b[:, np.newaxis, :])
+
+        # Threshold the whole batch and add it to the counts
+        count += threshold_matrix(M_b, cost).sum(axis=0).astype('int32')
+
+    boot_dict = {}
+    boot_dict['count'] = count
+    boot_dict['frequency'] = count / np.float(n)
+    boot_dict['A_consensus'] = ( boot_dict['frequency'] >= threshold ).astype('float')
+    boot_dict['A_consensus'][np.diag_indices(n_regions)] = 0
+    boot_dict['n'] = n
+
+    return boot_dict
+
+
+def edges_to_mat(edge_values, n_regions=308):
+    '''
+    Put a vector of upper triangle edge values (eg: one row of the
+    loo_influence r_diff array) back into a symmetric matrix
+    '''
+    import numpy as np
+
+    M = np.zeros([n_regions, n_regions])
+    triu_i, triu_j = np.triu_indices(n_regions, k=1)
+    M[triu_i, triu_j] = edge_values
+    M[triu_j, triu_i] = edge_values
+
+    return M
+
+
+def create_cross_mats(df_dict, aparc_names, covar, demean=False, pairs=None, on='nspn_id'):
+    '''
+    Cross-correlation matrices between two measures (eg: CT and MT at
+    a particular depth, or MT at two different depths).
+
+    Entry [i, j] of the CT x MT matrix is the partial correlation between
+    CT in region i and MT in region j across subjects. Each measure is
+    residualised once, and then each pair of measures only needs a single
+    (n_regions x n_subs) x (n_subs x n_regions) matrix product.
+
+    INPUTS:
+        df_dict ------- dictionary of data frames, one per measure
+                          (eg: { 'CT' : df_ct, 'MT_projfrac+030' : df_mt })
+        aparc_names --- list of regions (columns in each df)
+        covar --------- list of covariate columns in each df
+        demean -------- passed to create_data_mats
+                          default = False
+        pairs --------- list of (measure_a, measure_b) tuples
+                          default = None which means every pair of measures
+        on ------------ column used to line up the subjects across the
+                          data frames. Only subjects in all of them are kept
+                          default = 'nspn_id'
+
+    RETURNS:
+        cross_dict ---- dictionary of (n_regions x n_regions) matrices with
+                          keys '{measure_a}_x_{measure_b}'. These are not
+                          symmetric: rows are measure_a, columns measure_b
+    '''
+    import numpy as np
+    import itertools as it
+    from networkx_functions import create_data_mats, residual_mat
+
+    measures = sorted(df_dict.keys())
+
+    if pairs is None:
+        pairs = list(it.combinations(measures, 2))
+
+    # Only keep the subjects that are in all the data frames,
+    # in the same order for every measure
+    sub_ids = set(df_dict[measures[0]][on].values)
+    for measure in measures[1:]:
+        sub_ids = sub_ids & set(df_dict[measure][on].values)
+    sub_ids = sorted(sub_ids)
+
+    # Residualise and standardise each measure once
+    Z_dict = {}
+    for measure in set([ m for pair in pairs for m in pair ]):
+        df = df_dict[measure].drop_duplicates(on).set_index(on).loc[sub_ids, :]
+        X, C = create_data_mats(df, aparc_names, covar, demean=demean)
+        Z_dict[measure] = standardise_residuals(residual_mat(X, C))
+
+    n_subs = len(sub_ids)
+
+    cross_dict = {}
+    for measure_a, measure_b in pairs:
+        cross_dict['{}_x_{}'.format(measure_a, measure_b)] = np.dot(Z_dict[measure_a].T,
+                                                                    Z_dict[measure_b]) / n_subs
+
+    return cross_dict
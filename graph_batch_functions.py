@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+'''
+Run calculate_nodal_measures and calculate_global_measures (from
+networkx_functions) for a whole list of graphs, eg: every
+measure x covars x group x cost key in graph_dict, with the graphs
+shared out over a pool of processes.
+
+Each graph's results are saved (along with a hash of its edges and
+the settings, see cache_functions) as soon as they're done, so if
+the job dies part of the way through you can just run it again and
+it'll pick up where it left off.
+
+Usage:
+    graph_dict, timing_dict = calculate_measures_batch(graph_dict,
+                                                        key_list,
+                                                        centroids,
+                                                        aparc_names,
+                                                        results_dir,
+                                                        n_processes=8)
+
+after which graph_dict['{key}_NodalMeasures'] and
+graph_dict['{key}_GlobalMeasures'] are ready for save_network_values.
+'''
+
+def graph_seed(key):
+    '''
+    A seed for the random graphs that only depends on the graph's
+    key, so that every graph gets different random graphs (the forked
+    processes would otherwise all start with the same random state)
+    and re-running a graph gives the same ones
+    '''
+    from cache_functions import hash_inputs
+
+    return int(hash_inputs(key)[:8], 16)
+
+
+def _graph_measures_task(args):
+    '''
+    Calculate the nodal and global measures for one graph and time
+    them. The arguments come in as one tuple so this can be passed
+    to Pool.imap_unordered
+    '''
+    import random
+    import time
+    import numpy as np
+    from networkx_functions import calculate_nodal_measures, calculate_global_measures
+
+    key, G, centroids, aparc_names, dist_mats, n, n_runs, seed = args
+
+    # The random graphs come from nx.double_edge_swap which
+    # uses python's random module
+    random.seed(seed)
+    np.random.seed(seed)
+
+    t0 = time.time()
+    # The nodal measures go first so the consensus partition is
+    # cached on the graph when it's needed for the modularity
+    nodal_dict = calculate_nodal_measures(G, centroids, aparc_names, dist_mats=dist_mats, n_runs=n_runs)
+
+    t1 = time.time()
+    global_dict = calculate_global_measures(G, n=n, n_runs=n_runs)
+
+    t2 = time.time()
+
+    timing = { 'nodal'  : t1 - t0,
+               'global' : t2 - t1,
+               'total'  : t2 - t0 }
+
+    return key, nodal_dict, global_dict, timing
+
+
+def calculate_measures_batch(graph_dict, key_list, centroids, aparc_names, results_dir, n=10, n_runs=1, n_processes=1):
+    '''
+    Calculate (or load) the nodal and global measures for every graph
+    in key_list and put them into graph_dict as
+    graph_dict['{key}_NodalMeasures'] and graph_dict['{key}_GlobalMeasures']
+
+    INPUTS:
+        graph_dict ---- dictionary of networkx graphs
+        key_list ------ the keys of the graphs to calculate the measures for
+        centroids ----- (n x 3) array of the regions' coordinates
+        aparc_names --- list of the regions' names
+        results_dir --- where to keep the results: {key}_NodalMeasures.p,
+                          {key}_GlobalMeasures.p and MeasureTimings.txt
+        n ------------- number of random graphs for the global measures
+                          default = 10
+        n_runs -------- number of Louvain runs for each graph's consensus
+                          partition (the random graphs only get one)
+                          default = 1
+        n_processes --- number of processes
+                          default = 1
+
+    RETURNS:
+        graph_dict ---- the same dictionary with the measures added
+        timing_dict --- nodal, global and total time (in seconds) for
+                          each graph that was calculated this time
+                          (not the ones that were loaded)
+    '''
+    import os
+    import time
+    from cache_functions import output_hash, is_up_to_date, save_with_hash, load_output
+    from networkx_functions import create_distance_mats, graph_key
+
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+
+    timings_file = os.path.join(results_dir, 'MeasureTimings.txt')
+
+    # The distances only depend on the centroids so
+    # work them out once for all the graphs
+    dist_mats = create_distance_mats(centroids)
+
+    jobs = []
+    file_dict = {}
+
+    for key in key_list:
+        G = graph_dict[key]
+
+        # The results depend on the graph's edges and the settings
+        inputs = [ graph_key(G), list(aparc_names), centroids, n, n_runs ]
+
+        nodal_file = os.path.join(results_dir, '{}_NodalMeasures.p'.format(key))
+        global_file = os.path.join(results_dir, '{}_GlobalMeasures.p'.format(key))
+
+        nodal_h = output_hash(nodal_file, inputs, kind='pickle')
+        global_h = output_hash(global_file, inputs, kind='pickle')
+
+        file_dict[key] = [ (nodal_file, nodal_h), (global_file, global_h) ]
+
+        if is_up_to_date(nodal_file, nodal_h) and is_up_to_date(global_file, global_h):
+            graph_dict['{}_NodalMeasures'.format(key)] = load_output(nodal_file, kind='pickle')
+            graph_dict['{}_GlobalMeasures'.format(key)] = load_output(global_file, kind='pickle')
+        else:
+            jobs += [ (key, G, centroids, aparc_names, dist_mats, n, n_runs, graph_seed(key)) ]
+
+    print 'Measures: {} graphs already done, {} to calculate'.format(len(key_list) - len(jobs), len(jobs))
+
+    timing_dict = {}
+
+    if len(jobs) == 0:
+        return graph_dict, timing_dict
+
+    start = time.time()
+
+    # Hand out the graphs one at a time and save
+    # each one as soon as it comes back
+    if n_processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(n_processes)
+        results = pool.imap_unordered(_graph_measures_task, jobs, chunksize=1)
+    else:
+        results = ( _graph_measures_task(job) for job in jobs )
+
+    for i, (key, nodal_dict, global_dict, timing) in enumerate(results):
+
+        (nodal_file, nodal_h), (global_file, global_h) = file_dict[key]
+
+        save_with_hash(nodal_dict, nodal_file, nodal_h, kind='pickle')
+        save_with_hash(global_dict, global_file, global_h, kind='pickle')
+
+        graph_dict['{}_NodalMeasures'.format(key)] = nodal_dict
+        graph_dict['{}_GlobalMeasures'.format(key)] = global_dict
+        timing_dict[key] = timing
+
+        with open(timings_file, 'a') as f:
+            f.write('{}\t{:.2f}\t{:.2f}\t{:.2f}\n'.format(key, timing['nodal'], timing['global'], timing['total']))
+
+        print '    {} ({}/{}): nodal {:.1f}s, global {:.1f}s'.format(key, i + 1, len(jobs),
+                                                                    timing['nodal'], timing['global'])
+
+    if n_processes > 1:
+        pool.close()
+        pool.join()
+
+    print 'Measures: {} graphs in {:.1f}s'.format(len(jobs), time.time() - start)
+
+    return graph_dict, timing_dict
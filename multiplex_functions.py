@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+'''
+Functions for looking at the graphs from the different MT depths
+(MT_projfrac+000 to MT_projfrac+100) together, as the layers of one
+multiplex network, rather than as separate networkx graphs.
+
+A "multiplex" is just a dictionary:
+    * A ------------- scipy.sparse csr_matrix of the binary adjacency
+                        matrices stacked on top of each other, so it's
+                        (n_layers * n_nodes x n_nodes) and layer l is
+                        rows l * n_nodes to (l + 1) * n_nodes
+    * n_layers ------ number of layers
+    * n_nodes ------- number of nodes (the same nodes in every layer)
+    * layer_names --- list of names for the layers (eg: the mat_dict keys)
+
+The layers are in order (eg: pial to white matter) and each node is
+only coupled to itself in the layers just above and below it.
+'''
+
+def create_multiplex(A_stack, layer_names=None):
+    '''
+    Make a multiplex from a (n_layers x n x n) stack (or list) of
+    binary adjacency matrices, eg: the output of threshold_matrix
+    on a stack of correlation matrices.
+    '''
+    import numpy as np
+    from scipy import sparse
+
+    A_stack = np.asarray(A_stack)
+    n_layers, n_nodes, n_nodes = A_stack.shape
+
+    # Binarize and take away the diagonals
+    A_stack = ( A_stack != 0 ).astype('float')
+    A_stack[:, np.arange(n_nodes), np.arange(n_nodes)] = 0
+
+    if layer_names is None:
+        layer_names = [ 'Layer{:02.0f}'.format(l) for l in range(n_layers) ]
+
+    mp = { 'A'           : sparse.csr_matrix(A_stack.reshape(n_layers * n_nodes, n_nodes)),
+           'n_layers'    : n_layers,
+           'n_nodes'     : n_nodes,
+           'layer_names' : list(layer_names) }
+
+    return mp
+
+
+def multiplex_from_mats(mat_dict, keys, cost):
+    '''
+    Threshold each of the mat_dict[key] matrices at this cost (see
+    threshold_matrix) and put them together as the layers of a multiplex
+    in the order they're given in keys
+    '''
+    import numpy as np
+    from networkx_functions import threshold_matrix
+
+    M_stack = np.array([ mat_dict[key] for key in keys ])
+
+    return create_multiplex(threshold_matrix(M_stack, cost), layer_names=keys)
+
+
+def multiplex_layer(mp, l):
+    '''
+    The (n x n) sparse adjacency matrix for layer l
+    '''
+    n = mp['n_nodes']
+
+    return mp['A'][l * n:(l + 1) * n, :]
+
+
+def multiplex_degrees(mp):
+    '''
+    (n_layers x n_nodes) array of each node's degree in each layer
+    '''
+    import numpy as np
+
+    return np.diff(mp['A'].indptr).reshape(mp['n_layers'], mp['n_nodes']).astype('float')
+
+
+def multiplex_overlap(mp):
+    '''
+    (n x n) matrix of the number of layers that each edge is in
+    '''
+    from scipy import sparse
+
+    n = mp['n_nodes']
+
+    # Adding up the blocks is the same as multiplying
+    # by a row of identity matrices
+    S = sparse.hstack([ sparse.identity(n, format='csr') ] * mp['n_layers']).tocsr()
+
+    return S.dot(mp['A']).toarray()
+
+
+def multiplex_layer_similarity(mp):
+    '''
+    (n_layers x n_layers) matrix of the Jaccard overlap between the
+    edges in each pair of layers (edges in both / edges in either)
+    '''
+    import numpy as np
+    from scipy import sparse
+
+    L = mp['n_layers']
+    n = mp['n_nodes']
+
+    # One row per layer with one column for each possible edge
+    A_coo = mp['A'].tocoo()
+    E = sparse.csr_matrix((A_coo.data, (A_coo.row // n, (A_coo.row % n) * n + A_coo.col)),
+                            shape=(L, n * n))
+
+    both = E.dot(E.T).toarray()
+    n_edges = np.diag(both)
+    either = n_edges[:, None] + n_edges[None, :] - both
+
+    similarity = np.zeros_like(both)
+    np.divide(both, either, out=similarity, where=either > 0)
+
+    return similarity
+
+
+def multiplex_measures(mp):
+    '''
+    The multiplex nodal and global measures (Battiston et al. 2014)
+
+    RETURNS:
+        measure_dict --- a dictionary containing
+            * degree ------------- (n_layers x n) degree in each layer
+            * overlap_degree ----- (n) sum of the degrees over the layers
+            * participation ------ (n) multiplex participation coefficient:
+                                     1 if a node's edges are spread evenly
+                                     over the layers, 0 if they're all in one
+            * edge_overlap ------- average proportion of the layers that each
+                                     edge (in at least one layer) is in
+            * layer_similarity --- (n_layers x n_layers) Jaccard overlap of
+                                     the edges in each pair of layers
+    '''
+    import numpy as np
+
+    L = mp['n_layers']
+
+    degree = multiplex_degrees(mp)
+    overlap_degree = degree.sum(axis=0)
+
+    participation = np.zeros(mp['n_nodes'])
+    if L > 1:
+        frac_sq = np.zeros_like(degree)
+        np.divide(degree, overlap_degree[None, :], out=frac_sq, where=overlap_degree[None, :] > 0)
+        frac_sq = frac_sq ** 2
+        participation = np.where(overlap_degree > 0,
+                                    L / (L - 1.0) * ( 1 - frac_sq.sum(axis=0) ),
+                                    0)
+
+    O = multiplex_overlap(mp)
+
+    measure_dict = {}
+    measure_dict['degree'] = degree
+    measure_dict['overlap_degree'] = overlap_degree
+    measure_dict['participation'] = participation
+    measure_dict['edge_overlap'] = np.mean(O[O > 0]) / L if np.any(O > 0) else np.nan
+    measure_dict['layer_similarity'] = multiplex_layer_similarity(mp)
+
+    return measure_dict
+
+
+def multilayer_modularity(mp, partition, omega=1.0, gamma=1.0):
+    '''
+    Multilayer modularity (Mucha et al. 2010) of a partition
+
+    INPUTS:
+        mp ----------- multiplex dictionary
+        partition ---- (n_layers x n_nodes) array of module labels (the
+                         same label in two layers means the same module)
+        omega -------- coupling between a node and itself in the
+                         neighbouring layers
+                         default = 1.0
+        gamma -------- resolution parameter
+                         default = 1.0
+
+    RETURNS:
+        Q ------------ multilayer modularity
+    '''
+    import numpy as np
+
+    L = mp['n_layers']
+    n = mp['n_nodes']
+
+    g = np.asarray(partition).reshape(L * n)
+    k = multiplex_degrees(mp)
+    two_m = k.sum(axis=1)
+
+    # The edges inside modules (the stacked adjacency matrix's rows
+    # belong to node i in layer l and its columns to node j in layer l)
+    A_coo = mp['A'].tocoo()
+    layer = A_coo.row // n
+    within = np.sum(A_coo.data[g[A_coo.row] == g[layer * n + A_coo.col]])
+
+    # The expected number for each layer's configuration model
+    expected = 0.0
+    for l in range(L):
+        if two_m[l] > 0:
+            K = np.bincount(g[l * n:(l + 1) * n], weights=k[l], minlength=g.max() + 1)
+            expected += gamma * np.sum(K ** 2) / two_m[l]
+
+    # And the nodes that stay in the same module in the next layer
+    G = g.reshape(L, n)
+    coupled = 2 * omega * np.sum(G[1:] == G[:-1])
+
+    two_mu = two_m.sum() + 2 * omega * n * (L - 1)
+
+    return ( within - expected + coupled ) / two_mu
+
+
+def _local_moving(S, D, two_m, gamma, rng, max_sweeps):
+    '''
+    The first phase of the Louvain algorithm for the multilayer
+    modularity. S is the (N x N) sparse supra-adjacency matrix (edges
+    within the layers plus the inter-layer coupling) and D is the
+    (N x n_layers) matrix of each node's degree in each layer, which
+    is what the null model is built from.
+
+    Each node is moved into whichever neighbouring module increases
+    Q the most, in a random order, until nothing moves. Returns the
+    module labels numbered from 0.
+    '''
+    import numpy as np
+
+    N = S.shape[0]
+
+    # Start with every node on its own, and keep a running total of
+    # the degrees in each layer for each module
+    g = np.arange(N)
+    K = np.array(D, dtype='float')
+    counts = np.ones(N, dtype='int')
+    D_scaled = D * gamma / two_m[None, :]
+
+    for sweep in range(max_sweeps):
+
+        n_moved = 0
+
+        for x in rng.permutation(N):
+            old = g[x]
+
+            # Take the node out of its module
+            K[old] -= D[x]
+            counts[old] -= 1
+
+            # The modules of this node's neighbours (not including itself)
+            nbrs = S.indices[S.indptr[x]:S.indptr[x + 1]]
+            links = S.data[S.indptr[x]:S.indptr[x + 1]]
+            links = links[nbrs != x]
+            nbrs = nbrs[nbrs != x]
+
+            candidates, inverse = np.unique(np.hstack([ g[nbrs], [ old ] ]), return_inverse=True)
+
+            # The change in Q (times 2 mu) for joining each module
+            w = np.bincount(inverse, weights=np.hstack([ links, [ 0 ] ]), minlength=len(candidates))
+            gain = w - np.dot(K[candidates], D_scaled[x])
+
+            # Only move if it's strictly better than going back, and
+            # start a new module if nothing is better than being alone
+            best = candidates[np.argmax(gain)]
+            if gain[candidates == old][0] >= gain.max():
+                best = old
+            if gain.max() < 0:
+                best = old if counts[old] == 0 else np.flatnonzero(counts == 0)[0]
+
+            g[x] = best
+            K[best] += D[x]
+            counts[best] += 1
+
+            if best != old:
+                n_moved += 1
+
+        if n_moved == 0:
+            break
+
+    return np.unique(g, return_inverse=True)[1]
+
+
+def multilayer_partition(mp, omega=1.0, gamma=1.0, seed=None, max_sweeps=100):
+    '''
+    Find a partition of the multiplex with high multilayer modularity
+    using the Louvain algorithm: move the nodes (in each layer) between
+    modules until nothing improves Q, then merge each module into a
+    single node and start again, until the modules stop merging.
+
+    INPUTS:
+        mp ----------- multiplex dictionary
+        omega -------- inter-layer coupling
+                         default = 1.0
+        gamma -------- resolution parameter
+                         default = 1.0
+        seed --------- seed for the random order of the nodes
+                         default = None
+        max_sweeps --- maximum number of passes through the nodes
+                         at each level
+                         default = 100
+
+    RETURNS:
+        partition ---- (n_layers x n_nodes) array of module labels
+                         (numbered from 0)
+        Q ------------ its multilayer modularity
+    '''
+    import numpy as np
+    from scipy import sparse
+
+    L = mp['n_layers']
+    n = mp['n_nodes']
+    N = L * n
+
+    rng = np.random.RandomState(seed)
+
+    # The supra-adjacency matrix: each layer's edges on the diagonal
+    # blocks and omega between each node and its copies in the layers
+    # either side of it
+    A_coo = mp['A'].tocoo()
+    layer = A_coo.row // n
+    rows = [ A_coo.row ]
+    cols = [ layer * n + A_coo.col ]
+    data = [ A_coo.data ]
+    if L > 1 and omega != 0:
+        x = np.arange(N - n)
+        rows += [ x, x + n ]
+        cols += [ x + n, x ]
+        data += [ omega * np.ones(N - n) ] * 2
+    S = sparse.csr_matrix((np.hstack(data), (np.hstack(rows), np.hstack(cols))), shape=(N, N))
+
+    # Each node only has a degree in its own layer
+    k = multiplex_degrees(mp)
+    D = np.zeros([N, L])
+    D[np.arange(N), np.arange(N) // n] = k.reshape(N)
+    two_m = k.sum(axis=1)
+    two_m = np.where(two_m > 0, two_m, 1.0)
+
+    membership = np.arange(N)
+
+    while True:
+        g = _local_moving(S, D, two_m, gamma, rng, max_sweeps)
+        n_modules = g.max() + 1
+
+        if n_modules == S.shape[0]:
+            break
+
+        membership = g[membership]
+
+        # Merge each module into a single node
+        P = sparse.csr_matrix((np.ones(len(g)), (np.arange(len(g)), g)), shape=(len(g), n_modules))
+        S = P.T.dot(S).dot(P).tocsr()
+        D = P.T.dot(D)
+
+    partition = membership.reshape(L, n)
+
+    return partition, multilayer_modularity(mp, partition, omega=omega, gamma=gamma)
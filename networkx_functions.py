@@ -39,58 +39,273 @@ def sort_partition(partition, axial_pos):
     
     return module_list    
     
+def mst_mask(M):
+    '''
+    Boolean (n x n) symmetric array that is True for the edges
+    in the maximum spanning tree of M (ie: the minimum spanning
+    tree when you think of strong correlations as short distances)
+    '''
+    import numpy as np
+    from scipy.sparse.csgraph import minimum_spanning_tree
+
+    n = M.shape[0]
+    triu_i, triu_j = np.triu_indices(n, k=1)
+    w = M[triu_i, triu_j]
+
+    # The minimum spanning tree looks for the smallest
+    # distance, so flip the correlations into positive
+    # distances (zeros count as missing edges for scipy)
+    D = np.zeros([n, n])
+    D[triu_i, triu_j] = w.max() - w + 1.0
+    mst = minimum_spanning_tree(D).tocoo()
+
+    mask = np.zeros([n, n], dtype=bool)
+    mask[mst.row, mst.col] = True
+    mask[mst.col, mst.row] = True
+
+    return mask
+
+
+def rank_edges(M):
+    '''
+    Put every edge in M into the order in which it gets added
+    to the graph as the cost goes up: the minimum spanning tree
+    edges first (so the graph is always connected) and then all
+    the other edges from the strongest to the weakest.
+
+    This is the only sort you need. Because the graphs are nested
+    the graph at any cost is just the first n edges of this list.
+
+    INPUTS:
+        M -------- full association matrix
+
+    RETURNS:
+        edge_i --- array of the first node of each edge (in order)
+        edge_j --- array of the second node of each edge (in order)
+        n_mst ---- number of edges in the minimum spanning tree
+    '''
+    import numpy as np
+
+    n = M.shape[0]
+    triu_i, triu_j = np.triu_indices(n, k=1)
+    w = M[triu_i, triu_j]
+
+    # Sort the edges from strongest to weakest once
+    order = np.argsort(-w, kind='mergesort')
+
+    in_mst = mst_mask(M)[triu_i[order], triu_j[order]]
+
+    # MST edges first, then the rest, both strongest first
+    order = np.hstack([ order[in_mst], order[~in_mst] ])
+
+    return triu_i[order], triu_j[order], np.sum(in_mst)
+
+
+def n_edges_at_cost(n_nodes, cost, n_mst):
+    '''
+    The number of edges in the graph at this cost (percentage of
+    all possible edges). You have to round this number because it
+    won't necessarily be an integer, and if the cost is so small that
+    the minimum spanning tree already covers it then you can't do any
+    better than the MST.
+    '''
+    import numpy as np
+
+    n_edges = int(np.around((cost/100.0) * n_nodes * (n_nodes - 1) / 2.0))
+
+    if n_edges < n_mst:
+        print 'Unable to calculate matrix at this cost - minimum spanning tree is too large'
+        n_edges = n_mst
+
+    return n_edges
+
+
+def adjacency_sweep(M, cost_list):
+    '''
+    Binary adjacency arrays for every cost in cost_list from a
+    single ranking of the edges (see rank_edges).
+
+    INPUTS:
+        M ----------- full association matrix
+        cost_list --- list of costs (percentages, 0 to 100)
+
+    RETURNS:
+        A_array ----- (n_costs x n x n) array of binary symmetric
+                        adjacency matrices, in the same order as cost_list
+    '''
+    import numpy as np
+
+    n = M.shape[0]
+    edge_i, edge_j, n_mst = rank_edges(M)
+
+    A_array = np.zeros([len(cost_list), n, n])
+
+    for c, cost in enumerate(cost_list):
+        n_edges = n_edges_at_cost(n, cost, n_mst)
+        A_array[c, edge_i[:n_edges], edge_j[:n_edges]] = 1
+        A_array[c, edge_j[:n_edges], edge_i[:n_edges]] = 1
+
+    return A_array
+
+
+def degrees_sweep(M, cost_list):
+    '''
+    Nodal degrees at every cost in cost_list without making any
+    graphs at all: each node's degree is just the number of times it
+    turns up in the first n edges of the ranking.
+
+    RETURNS:
+        deg_array --- (n_costs x n) array of degrees
+    '''
+    import numpy as np
+
+    n = M.shape[0]
+    edge_i, edge_j, n_mst = rank_edges(M)
+
+    deg_array = np.zeros([len(cost_list), n])
+
+    for c, cost in enumerate(cost_list):
+        n_edges = n_edges_at_cost(n, cost, n_mst)
+        deg_array[c, :] = ( np.bincount(edge_i[:n_edges], minlength=n)
+                             + np.bincount(edge_j[:n_edges], minlength=n) )
+
+    return deg_array
+
+
+def graphs_at_costs(M, cost_list):
+    '''
+    The networkx graphs you'd get from graph_at_cost for each cost
+    in cost_list, but with the edges only ranked once.
+
+    RETURNS:
+        G_list ------ list of networkx graphs in the same order as cost_list
+    '''
+    import numpy as np
+    import networkx as nx
+
+    n = M.shape[0]
+    edge_i, edge_j, n_mst = rank_edges(M)
+
+    # The edges carry the same (negative correlation) weights
+    # as they always have done in graph_at_cost
+    w = -M[edge_i, edge_j]
+
+    G_list = []
+
+    for cost in cost_list:
+        n_edges = n_edges_at_cost(n, cost, n_mst)
+
+        G = nx.Graph()
+        G.add_nodes_from(range(n))
+        G.add_weighted_edges_from(zip(edge_i[:n_edges].tolist(),
+                                      edge_j[:n_edges].tolist(),
+                                      w[:n_edges].tolist()))
+
+        G_list += [ G ]
+
+    return G_list
+
+
 def graph_at_cost(M, cost):
+    '''
+    Threshold the association matrix M at this cost (percentage of
+    edges to keep) making sure the minimum spanning tree is always
+    included, and return the graph.
+
+    If you need lots of costs for the same matrix then use
+    graphs_at_costs (or adjacency_sweep/degrees_sweep) so the
+    edges only get ranked once.
+    '''
+    return graphs_at_costs(M, [ cost ])[0]
+
     
+def create_edge_ranks(M):
+    '''
+    Everything you need to rebuild the graph_at_cost graph at any cost
+    for this matrix, in a dictionary of small arrays:
+        * edge_i, edge_j -- the edges in the order they're added
+                              (the minimum spanning tree comes first)
+        * weights --------- the value in M for each of these edges
+        * n_mst ----------- number of edges in the minimum spanning tree
+        * n_nodes --------- number of nodes
+
+    Save it with save_edge_ranks and read it back with load_edge_ranks.
+    '''
     import numpy as np
+
+    edge_i, edge_j, n_mst = rank_edges(M)
+
+    rank_dict = { 'edge_i'  : edge_i.astype('uint16'),
+                  'edge_j'  : edge_j.astype('uint16'),
+                  'weights' : M[edge_i, edge_j],
+                  'n_mst'   : np.array(n_mst),
+                  'n_nodes' : np.array(M.shape[0]) }
+
+    return rank_dict
+
+
+def save_edge_ranks(rank_dict, filename):
+    '''
+    Save the edge ranks as a single compressed numpy archive. This
+    replaces one gpickle file per cost with one (much smaller) file
+    per matrix. filename should end in .npz
+    '''
+    import numpy as np
+
+    np.savez_compressed(filename, **rank_dict)
+
+
+def load_edge_ranks(filename):
+    '''
+    Read in an archive written by save_edge_ranks
+    '''
+    import numpy as np
+
+    npz = np.load(filename)
+    rank_dict = dict([ (key, npz[key]) for key in npz.files ])
+    npz.close()
+
+    return rank_dict
+
+
+def graph_from_edge_ranks(rank_dict, cost, weight_sign=-1):
+    '''
+    Rebuild the graph at this cost from the edge ranks. With the
+    default weight_sign (-1) this is the same graph (and weights) as
+    graph_at_cost gives you. Use weight_sign=1 and cost=100 to get the
+    same thing as full_graph.
+    '''
     import networkx as nx
-    
-    # Make a copy of the matrix
-    thr_M = np.copy(M)
 
-    # Set all diagonal values to 0
-    thr_M[np.diag_indices_from(thr_M)] = 0
+    n = int(rank_dict['n_nodes'])
+    n_edges = n_edges_at_cost(n, cost, int(rank_dict['n_mst']))
 
-    # Multiply all values by -1 because the minimum spanning tree
-    # looks for the smallest distance - not the largest correlation!
-    thr_M = thr_M*-1
-    
-    # Read this full matrix into a graph G
-    G = nx.from_numpy_matrix(thr_M)
-    
-    # Make a list of all the sorted edges in the full matrix
-    G_edges_sorted = [ edge for edge in sorted(G.edges(data = True), key = lambda (a, b, dct): dct['weight']) ]
-    
-    # Calculate minimum spanning tree and make a list of the mst_edges
-    mst = nx.minimum_spanning_tree(G)
-    mst_edges = mst.edges(data = True)
-    
-    # Create a list of edges that are *not* in the mst
-    # (because you don't want to add them in twice!)
-    G_edges_sorted_notmst = [ edge for edge in G_edges_sorted if not edge in mst_edges ]
-    
-    # Figure out the number of edges you want to keep for this
-    # particular cost. You have to round this number because it
-    # won't necessarily be an integer, and you have to subtract
-    # the number of edges in the minimum spanning tree because we're
-    # going to ADD this number of edges to it 
-    n_edges = (cost/100.0) * len(G_edges_sorted)
-    n_edges = np.int(np.around(n_edges))
-    n_edges = n_edges - len(mst.edges())
-
-    # If your cost is so small that your minimum spanning tree already covers it
-    # then you can't do any better than the MST and you'll just have to return
-    # it with an accompanying error message
-    if n_edges < 0:
-        print 'Unable to calculate matrix at this cost - minimum spanning tree is too large'
+    G = nx.Graph()
+    G.add_nodes_from(range(n))
+    G.add_weighted_edges_from(zip(rank_dict['edge_i'][:n_edges].tolist(),
+                                  rank_dict['edge_j'][:n_edges].tolist(),
+                                  (weight_sign * rank_dict['weights'][:n_edges]).tolist()))
 
-    # Otherwise, add in the appropriate number of edges (n_edges)
-    # from your sorted list (G_edges_sorted_notmst)
-    else:
-        mst.add_edges_from(G_edges_sorted_notmst[:n_edges])
+    return G
+
+
+def adjacency_from_edge_ranks(rank_dict, cost):
+    '''
+    The binary adjacency array at this cost from the edge ranks
+    '''
+    import numpy as np
 
-    # And return the *updated* minimum spanning tree
-    # as your graph
-    return mst
+    n = int(rank_dict['n_nodes'])
+    n_edges = n_edges_at_cost(n, cost, int(rank_dict['n_mst']))
+
+    edge_i = rank_dict['edge_i'][:n_edges].astype('int')
+    edge_j = rank_dict['edge_j'][:n_edges].astype('int')
+
+    A = np.zeros([n, n])
+    A[edge_i, edge_j] = 1
+    A[edge_j, edge_i] = 1
+
+    return A
 
     
 def full_graph(M):
@@ -110,37 +325,78 @@ def full_graph(M):
     return G
 
         
-def threshold_matrix(M, cost):
+def threshold_matrix(M, cost, weighted=False):
     '''
-    M is the full association matrix.
+    M is the full association matrix, or a stack of them
+    (n_matrices x n x n, eg: one for each MT depth).
     cost is the percentage (0 to 100) at which you'd like to threshold
-    
-    threshold_matrix first creates a copy of the input matrix, then
-    sets all diagonal values to 0. It next calculates the minimum spanning tree,
-    and ensures that those edges are *always* included in the thresholded
-    matrix.
-    
-    then sets all values below the 
-    appropriate percentile to 0
+
+    threshold_matrix calculates the minimum spanning tree of each matrix
+    and makes sure that those edges are *always* included in the
+    thresholded matrix. It then adds in the strongest of the remaining
+    edges until there are the right number of edges for the cost.
+    These are found with argpartition so there's no need to sort all
+    the edges. Edges with the same weight as the weakest one that gets
+    in (eg: the exact zeros in a graphical lasso matrix) are taken in
+    the order of the upper triangle, which is the order rank_edges
+    puts them in, so you get the same graph as graph_at_cost.
+
+    If weighted is False (default) the returned matrix is binary,
+    otherwise the edges keep their values from M. Everything else
+    (including the diagonal) is set to 0.
     '''
-    # Make a copy of the matrix
-    thr_M = np.copy(M)
-    
-    # Set all diagonal values to -999    
-    thr_M[np.diag_indices_from(thr_M)] = -999
-    
-    # Calculate minmum spanning tree
-    G = nx.from_numpy_matrix(M)
-    mst = nx.minimum_spanning_tree(G, weight='weight'*-1)
-    
-    # Calculate the threshold value
-    thr = np.percentile(thr_M[np.triu_indices_from(thr_M, k=1)], cost)
-    
-    # Set all values that are less than the threshold to 0
-    thr_M[thr_M < thr] = 0
-       
-    # Set all values that are not zero to 1
-    thr_M[thr_M != 0] = 1
+    import numpy as np
+
+    # Work with a stack of matrices either way
+    M_stack = np.asarray(M, dtype='float')
+    single = M_stack.ndim == 2
+    if single:
+        M_stack = M_stack[np.newaxis, :, :]
+
+    n_mats, n, n = M_stack.shape
+    triu_i, triu_j = np.triu_indices(n, k=1)
+
+    # The (n_mats x n_pairs) edge weights
+    w = M_stack[:, triu_i, triu_j]
+
+    # Calculate the minimum spanning tree for each matrix and
+    # keep a note of which edges you already have
+    in_mst = np.zeros(w.shape, dtype=bool)
+    for k in range(n_mats):
+        in_mst[k, :] = mst_mask(M_stack[k])[triu_i, triu_j]
+    # (the matrices are complete so the tree always has n-1 edges)
+    n_mst = n - 1
+
+    # Figure out how many more edges you need
+    n_add = n_edges_at_cost(n, cost, n_mst) - n_mst
+
+    keep = np.copy(in_mst)
+
+    if n_add > 0:
+        # Push the MST edges to the very bottom and then pull out
+        # the n_add strongest edges that are left for every matrix
+        # in one go
+        w_notmst = np.where(in_mst, -np.inf, w)
+        w_min = -np.partition(-w_notmst, n_add - 1, axis=1)[:, n_add - 1:n_add]
+        above = w_notmst > w_min
+
+        # Fill up with the edges that tie with the weakest
+        # one, first come first served
+        tied = w_notmst == w_min
+        n_tied = n_add - np.sum(above, axis=1)[:, np.newaxis]
+        keep |= above | ( tied & ( np.cumsum(tied, axis=1) <= n_tied ) )
+
+    # Fill in the thresholded matrices
+    thr_M = np.zeros_like(M_stack)
+    if weighted:
+        values = np.where(keep, w, 0)
+    else:
+        values = keep.astype('float')
+    thr_M[:, triu_i, triu_j] = values
+    thr_M[:, triu_j, triu_i] = values
+
+    if single:
+        thr_M = thr_M[0]
 
     return thr_M
     
@@ -176,57 +432,400 @@ def residuals(x, y):
     return res
     
     
-def calc_modularity(G):
-    
+def graph_key(G):
+    '''
+    A hash of G's nodes and (unweighted) edges, used to check
+    whether anything cached on the graph is still up to date
+    '''
+    import numpy as np
+    from cache_functions import hash_inputs
+
+    nodes = sorted(G.nodes())
+    node_index = dict(zip(nodes, range(len(nodes))))
+    edges = np.array(sorted([ tuple(sorted((node_index[u], node_index[v]))) for u, v in G.edges() ]))
+
+    return hash_inputs([ nodes, edges ])
+
+
+def _louvain_run(args):
+    '''
+    One run of the Louvain algorithm with a particular seed
+    (for the process pool). args is (G, seed)
+    '''
+    import random
+    import numpy as np
+    import community
+
+    G, seed = args
+
+    try:
+        partition = community.best_partition(G, random_state=seed)
+    except TypeError:
+        # Older versions of python-louvain don't take a seed
+        random.seed(seed)
+        np.random.seed(seed)
+        partition = community.best_partition(G)
+
+    return partition
+
+
+def _louvain_runs(G, seeds, n_processes=1):
+    '''
+    Run Louvain once for every seed, sharing the runs
+    between n_processes processes
+    '''
+    jobs = [ (G, seed) for seed in seeds ]
+
+    if n_processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(n_processes)
+        partition_list = pool.map(_louvain_run, jobs)
+        pool.close()
+        pool.join()
+    else:
+        partition_list = [ _louvain_run(job) for job in jobs ]
+
+    return partition_list
+
+
+def _coassignment(partition_list, nodes):
+    '''
+    (n x n) proportion of the partitions in which
+    each pair of nodes is in the same module
+    '''
+    import numpy as np
+
+    P = np.zeros([len(nodes), len(nodes)])
+
+    for partition in partition_list:
+        labels = np.unique([ partition[node] for node in nodes ], return_inverse=True)[1]
+        P += labels[:, None] == labels[None, :]
+
+    return P / len(partition_list)
+
+
+def _partition_cache_key(G, n_runs, seed, tau, max_iter):
+    '''
+    What a consensus partition in G.graph['partition_cache'] depends on
+    '''
+    return [ graph_key(G), n_runs, seed, tau, max_iter ]
+
+
+def set_partition_cache(G, partition_dict, n_runs=1, seed=0, tau=0.5, max_iter=10):
+    '''
+    Put a consensus partition that you've already got (eg: one that's
+    been loaded from a file) into G.graph['partition_cache'] so that
+    consensus_partition (and everything that calls it with the same
+    settings) uses it rather than running Louvain again
+    '''
+    G.graph['partition_cache'] = (_partition_cache_key(G, n_runs, seed, tau, max_iter), partition_dict)
+
+    return G
+
+
+def consensus_partition(G, n_runs=1, seed=0, tau=0.5, n_processes=1, max_iter=10):
+    '''
+    Consensus Louvain partition of the (binarized) graph
+    (Lancichinetti and Fortunato 2012).
+
+    Louvain is run n_runs times with seeds seed to seed + n_runs - 1,
+    and the proportion of the runs in which each pair of nodes is put
+    in the same module (the co-assignment matrix) is calculated. Pairs
+    that are together less than tau of the time are dropped, Louvain is
+    run on what's left of the co-assignment matrix, and this is
+    repeated until all the runs agree.
+
+    The result is kept in G.graph['partition_cache'] so calc_modularity,
+    participation_coefficient and plot_modules all use the same
+    partition, and it's only calculated again if the graph's edges (or
+    the settings) change.
+
+    INPUTS:
+        G ------------- networkx graph
+        n_runs -------- number of Louvain runs (one seeded run is plenty
+                          for the random graphs and single subjects, use
+                          100 for the real group graphs)
+                          default = 1
+        seed ---------- seed for the first run
+                          default = 0
+        tau ----------- co-assignment threshold
+                          default = 0.5
+        n_processes --- number of processes to share the runs between
+                          default = 1
+        max_iter ------ maximum number of consensus iterations
+                          default = 10
+
+    RETURNS:
+        partition_dict - a dictionary containing
+            * partition ----- dictionary of the consensus module for each node
+            * Q ------------- modularity of the consensus partition
+            * Q_runs -------- (n_runs) modularity of each of the Louvain runs
+            * coassignment -- (n x n) co-assignment matrix of the Louvain runs
+                                (nodes in sorted order)
+    '''
     import numpy as np
     import networkx as nx
     import community
-    
-    # Binarize both of the graphs
-    for u,v,d in G.edges(data=True):
-        d['weight']=1
-            
-    # Compute the best partition based on the threshold you've specified in cost
-    partition = community.best_partition(G)
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
 
-    modularity = community.modularity(partition, G)    
-    
-    return modularity
+    key = _partition_cache_key(G, n_runs, seed, tau, max_iter)
+
+    cached = G.graph.get('partition_cache', None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    # Binarize a copy of the graph
+    G_bin = nx.Graph()
+    G_bin.add_nodes_from(G.nodes())
+    G_bin.add_edges_from(G.edges(), weight=1)
+
+    nodes = sorted(G_bin.nodes())
+    seeds = range(seed, seed + n_runs)
+
+    # Modularity isn't defined for a graph without any edges
+    if G_bin.number_of_edges() == 0:
+        partition_dict = { 'partition'    : dict(zip(nodes, range(len(nodes)))),
+                           'Q'            : np.nan,
+                           'Q_runs'       : np.ones(n_runs) * np.nan,
+                           'coassignment' : np.eye(len(nodes)) }
+        set_partition_cache(G, partition_dict, n_runs=n_runs, seed=seed, tau=tau, max_iter=max_iter)
+        return partition_dict
+
+    partition_list = _louvain_runs(G_bin, seeds, n_processes=n_processes)
+
+    partition_dict = {}
+    partition_dict['Q_runs'] = np.array([ community.modularity(partition, G_bin) for partition in partition_list ])
+    partition_dict['coassignment'] = _coassignment(partition_list, nodes)
+
+    # Keep going until the co-assignment matrix is all 0s and 1s
+    P = partition_dict['coassignment']
+    for i in range(max_iter):
+        if np.all(( P == 0 ) | ( P == 1 )):
+            break
+
+        i_idx, j_idx = np.nonzero(np.triu(P >= tau, k=1))
+        G_P = nx.Graph()
+        G_P.add_nodes_from(nodes)
+        G_P.add_weighted_edges_from(zip([ nodes[x] for x in i_idx ],
+                                        [ nodes[x] for x in j_idx ],
+                                        P[i_idx, j_idx].tolist()))
+
+        partition_list = _louvain_runs(G_P, seeds, n_processes=n_processes)
+        P = _coassignment(partition_list, nodes)
+
+    # The modules are the groups of nodes that are (nearly) always together
+    labels = connected_components(csr_matrix(P >= tau), directed=False)[1]
+    consensus = dict(zip(nodes, labels.tolist()))
+
+    partition_dict['partition'] = consensus
+    partition_dict['Q'] = community.modularity(consensus, G_bin)
+
+    set_partition_cache(G, partition_dict, n_runs=n_runs, seed=seed, tau=tau, max_iter=max_iter)
+
+    return partition_dict
+
+
+def calc_modularity(G, n_runs=1):
+    '''
+    Modularity of the (binarized) graph's consensus partition
+    (see consensus_partition). One seeded Louvain run is plenty for
+    the random graphs and single subjects, pass n_runs=100 for the
+    consensus of the real group graphs.
+    '''
+    return consensus_partition(G, n_runs=n_runs)['Q']
+
+
+def graphs_distances(G_list):
+    '''
+    Hop distance matrices (see hop_distances in array_graph_functions)
+    for a list of graphs, with the nodes in sorted order.
+
+    Lots of measures need the shortest path lengths, so each graph's
+    distances are kept in G.graph['distance_cache'] along with a hash
+    of its edges. They're only calculated again if the edges change,
+    and the graphs that do need calculating all go through
+    hop_distances together.
+
+    RETURNS:
+        D_list ------ list of (n x n) distance arrays, one per graph
+    '''
+    import numpy as np
+    from array_graph_functions import nx_to_array_graph, array_graph_dense, hop_distances
+
+    key_list = []
+    todo_dict = {}
+
+    for g, G in enumerate(G_list):
+        nodes = sorted(G.nodes())
+        key = graph_key(G)
+        key_list += [ key ]
+
+        cached = G.graph.get('distance_cache', None)
+        if cached is None or cached[0] != key:
+            # Group the graphs by size so they can be stacked
+            todo_dict.setdefault(len(nodes), []).append(g)
+
+    for n, g_list in todo_dict.items():
+        A_stack = np.array([ array_graph_dense(nx_to_array_graph(G_list[g])) for g in g_list ]).reshape(len(g_list), n, n)
+        D_stack = hop_distances(A_stack)
+        for g, D in zip(g_list, D_stack):
+            G_list[g].graph['distance_cache'] = (key_list[g], D)
+
+    return [ G.graph['distance_cache'][1] for G in G_list ]
+
+
+def graph_distances(G):
+    '''
+    The (cached) hop distance matrix for one graph (see graphs_distances)
+    '''
+    return graphs_distances([ G ])[0]
+
+
+def graphs_clustering(G_list):
+    '''
+    Clustering coefficient of every node (the same as nx.clustering)
+    for a list of graphs, with the nodes in sorted order.
+
+    The graphs of the same size are stacked and go through
+    triangle_clustering (in array_graph_functions) together.
+
+    RETURNS:
+        C_list ------ list of (n) clustering arrays, one per graph
+    '''
+    import numpy as np
+    from array_graph_functions import nx_to_array_graph, array_graph_dense, triangle_clustering
+
+    C_list = [ None ] * len(G_list)
+
+    size_dict = {}
+    for g, G in enumerate(G_list):
+        size_dict.setdefault(G.number_of_nodes(), []).append(g)
+
+    for n, g_list in size_dict.items():
+        A_stack = np.array([ array_graph_dense(nx_to_array_graph(G_list[g])) for g in g_list ]).reshape(len(g_list), n, n)
+        for g, C in zip(g_list, triangle_clustering(A_stack)):
+            C_list[g] = C
+
+    return C_list
 
 
 def calc_efficiency(G): 
+    '''
+    Global efficiency of G: the average of 1 / shortest path length
+    over every pair of nodes (0 for pairs that aren't connected).
 
-    import networkx as nx
-    
-    E=0.0
-    for node in G:
-        path_length=nx.single_source_shortest_path_length(G, node)
-        E += 1.0/sum(path_length.values())
+    This used to add up 1 / (sum of the path lengths from each node)
+    which isn't the standard definition. The hop distances come from
+    the graph's distance cache (see graphs_distances).
+    '''
+    from array_graph_functions import path_length_measures
 
-    return E
+    return path_length_measures(graph_distances(G))['E']
     
-def closeness(G):
-    import networkx as nx
-    
-    closeness_dict = closeness_centrality(G)
 
+def calc_path_length(G):
+    '''
+    Characteristic path length of G (the same as
+    nx.average_shortest_path_length for a connected graph)
+    using the graph's distance cache
+    '''
+    from array_graph_functions import path_length_measures
+
+    return path_length_measures(graph_distances(G))['L']
 
+
+def closeness(G):
+    '''
+    Closeness centrality of every node (the same as
+    nx.closeness_centrality) using the graph's distance cache
+    '''
+    from array_graph_functions import path_length_measures
     
-def shortest_path(G):
-    import networkx as nx
-    import numpy as np
+    nodes = sorted(G.nodes())
+    closeness_array = path_length_measures(graph_distances(G))['closeness']
+    closeness_dict = dict(zip(nodes, closeness_array))
     
-    shortestpl_dict_dict = nx.shortest_path_length(G)
+    # Keep the nodes in the same order as the graph
+    return dict([ (node, closeness_dict[node]) for node in G.nodes() ])
+
     
-    shortestpl_dict = {}
+def shortest_path(G):
+    '''
+    Average shortest path length from each node to every node it
+    can reach (including itself, as nx.shortest_path_length does)
+    using the graph's distance cache. This is the same shortest_path
+    as path_length_measures in array_graph_functions gives you.
+    '''
+    from array_graph_functions import path_length_measures
     
-    for node in G.nodes():
-        shortestpl_dict[node] = np.average(shortestpl_dict_dict[node].values())
+    nodes = sorted(G.nodes())
+    shortestpl_array = path_length_measures(graph_distances(G))['shortest_path']
+    shortestpl_dict = dict(zip(nodes, shortestpl_array))
         
-    return shortestpl_dict
+    return dict([ (node, shortestpl_dict[node]) for node in G.nodes() ])
     
 
-def assign_nodal_distance(G, centroids):
+def create_distance_mats(centroids):
+    '''
+    Work out the euclidean distance between every pair of regions,
+    and whether each pair is in different hemispheres, once so
+    they can be used for any number of graphs.
+
+    Two regions are in different hemispheres if their x coordinates
+    have different signs.
+
+    RETURNS:
+        dist_mats --- a tuple containing
+            * dist ------- (n x n) euclidean distances
+            * interhem --- (n x n) 1 for interhemispheric pairs, 0 otherwise
+    '''
+    import numpy as np
+    from scipy.spatial.distance import pdist, squareform
+
+    centroids = np.asarray(centroids)[:, :3]
+
+    dist = squareform(pdist(centroids))
+
+    x = centroids[:, 0]
+    interhem = ( np.outer(x, x) <= 0 ).astype('float')
+
+    return dist, interhem
+
+
+def nodal_distance_measures(A, dist_mats):
+    '''
+    The average and total length of the edges connected to each
+    node and the proportion of them that are interhemispheric,
+    for one (n x n) adjacency matrix or a (k x n x n) stack of them.
+
+    INPUTS:
+        A ----------- binary adjacency matrix (or stack of them)
+        dist_mats --- the (dist, interhem) output of create_distance_mats
+
+    RETURNS:
+        dist_dict --- a dictionary of (n) or (k x n) arrays containing
+            * average_dist, total_dist and interhem_proportion
+              (nodes without any edges get np.nan for average_dist
+              and interhem_proportion)
+    '''
+    import numpy as np
+
+    dist, interhem = dist_mats
+
+    A = ( np.asarray(A) != 0 ).astype('float')
+    degrees = A.sum(axis=-1)
+    n_edges = np.where(degrees > 0, degrees, np.nan)
+
+    dist_dict = {}
+    dist_dict['total_dist'] = ( A * dist ).sum(axis=-1)
+    dist_dict['average_dist'] = dist_dict['total_dist'] / n_edges
+    dist_dict['interhem_proportion'] = ( A * interhem ).sum(axis=-1) / n_edges
+
+    return dist_dict
+
+
+def assign_nodal_distance(G, centroids, dist_mats=None):
 
     '''
     Give each node in the graph their
@@ -237,66 +836,54 @@ def assign_nodal_distance(G, centroids):
     (defined as edges which different signs for the x 
     coordinate
     
+    If you're doing this for lots of graphs then pass the
+    output of create_distance_mats as dist_mats so the
+    distances are only calculated once
+    
     Returns the graph
     '''
     import networkx as nx
     import numpy as np
-    from scipy.spatial import distance
     
-    # First assign the x, y, z values to each node
-    for i, node in enumerate(G.nodes()):
-        G.node[node]['x'] = centroids[i, 0]
-        G.node[node]['y'] = centroids[i, 1]
-        G.node[node]['z'] = centroids[i, 2]
-        G.node[node]['centroids'] = centroids[i, :]
+    if dist_mats is None:
+        dist_mats = create_distance_mats(centroids)
+    dist, interhem = dist_mats
     
-    # Loop through every node in turn
-    for i, node in enumerate(G.nodes()):
-        # Loop through the edges connecting to this node
-        # Note that "node1" should always be exactly the same
-        # as "node", I've just used another name to keep 
-        # the code clear (which I may not have achieved given
-        # that I thought this comment was necesary...)
-        for node1, node2 in G.edges(nbunch=[node]):
-        
-            # Calculate the eulidean distance for this edge
-            cent1 = G.node[node1]['centroids']
-            cent2 = G.node[node2]['centroids']
-            
-            dist = distance.euclidean(cent1, cent2)
-            
-            # And assign this value to the edge
-            G.edge[node1][node2]['euclidean'] = dist 
-        
-            # Also figure out whether this edge is interhemispheric
-            # by multiplying the x values. If x1 * x2 is negative
-            # then the nodes are in different hemispheres.
-            x1 = G.node[node1]['x']
-            x2 = G.node[node2]['x']
-            
-            if x1*x2 > 0:
-                G.edge[node1][node2]['interhem'] = 0
-            else:
-                G.edge[node1][node2]['interhem'] = 1
-            
-        # Create two nodal attributes (average distance and 
-        # total distance) by summarizing the euclidean distance
-        # for all edges which connect to the node
-        euc_list = [ G.edge[m][n]['euclidean'] for m, n in G.edges(nbunch=node) ]
-        
-        G.node[node]['average_dist'] = np.mean(euc_list)
-        G.node[node]['total_dist'] = np.sum(euc_list)
-        
-        # Create an interhem nodal attribute by getting the average
-        # of the interhem values for all edges which connect to the node
-        
-        interhem_list = [ G.edge[m][n]['interhem'] for m, n in G.edges(nbunch=node) ]
-
-        G.node[node]['interhem_proportion'] = np.mean(interhem_list)
+    # The adjacency matrix with the nodes in the same
+    # order as the centroids
+    nodes = list(G.nodes())
+    node_index = dict(zip(nodes, range(len(nodes))))
+    
+    A = np.zeros([len(nodes), len(nodes)])
+    for node1, node2 in G.edges():
+        i, j = node_index[node1], node_index[node2]
+        A[i, j] = 1
+        A[j, i] = 1
         
+        # Assign the distance and interhem values to the edge
+        G[node1][node2]['euclidean'] = dist[i, j]
+        G[node1][node2]['interhem'] = int(interhem[i, j])
+    
+    # Summarize the edges that connect to each node
+    dist_dict = nodal_distance_measures(A, dist_mats)
+    
+    # Assign the x, y, z values and the summary measures to each node
+    attr_dict = {}
+    for i, node in enumerate(nodes):
+        attr_dict[node] = { 'x'                   : centroids[i, 0],
+                            'y'                   : centroids[i, 1],
+                            'z'                   : centroids[i, 2],
+                            'centroids'           : centroids[i, :],
+                            'average_dist'        : dist_dict['average_dist'][i],
+                            'total_dist'          : dist_dict['total_dist'][i],
+                            'interhem_proportion' : dist_dict['interhem_proportion'][i] }
+    
+    # This works for old and new versions of networkx
+    G.add_nodes_from(attr_dict.items())
+    
     return G
     
-def participation_coefficient(G):
+def participation_coefficient(G, n_runs=1, return_module_dict=False):
     '''
     Computes the participation coefficient for each node (Guimera et al. 2005).
     
@@ -307,10 +894,21 @@ def participation_coefficient(G):
     
     However, Petra V saved the day so now we're back on track
     
+    The counting is now done with matrices (see module_degree_measures
+    in array_graph_functions) and the participation coefficient adds up
+    the proportion of each node's edges to *every* module:
+    
+        pc = 1 - sum over modules of (edges to module / degree)^2
+    
     ------
     Inputs
     ------
     graph = Networkx graph
+    n_runs = number of Louvain runs for the consensus partition
+             (see calc_modularity)
+    return_module_dict = also return the output of module_degree_measures
+             (within module z-scores and roles, nodes in sorted order)
+             so it doesn't have to be counted again
     ------
     Output
     ------
@@ -319,66 +917,29 @@ def participation_coefficient(G):
     # Import the modules you'll need
     import networkx as nx
     import numpy as np
-    import community as community
+    from array_graph_functions import nx_to_array_graph, module_degree_measures
     
     # Binarize both of the graphs
     for u,v,d in G.edges(data=True):
         d['weight']=1
 
-    # Calculate the best modular partition
-    nodal_partition = community.best_partition(G)
-
-    # Reverse the dictionary because the output of Louvain is "backwards"
-    # meaning it saves the module per node, rather than the nodes in each
-    # module
-    module_partition = {}
-    for m,n in zip(nodal_partition.values(),nodal_partition.keys()):
-        try:
-            module_partition[m].append(n)
-        except KeyError:
-            module_partition[m] = [n]
-
-    # Create an empty dictionary for the participation
-    # coefficients
-    pc_dict = {}
-    all_nodes = set(G.nodes())
-    
-    # Loop through modules
-    for m in module_partition.keys():
-        
-        # Print a little note to the screen because it can take a long
-        # time to run this code
-        print 'Calculating pc for nodes in module {} of {}'.format(m, len(module_partition.keys()))
-        
-        # Get the set of nodes in this module
-        mod_list = set(module_partition[m])
-        
-        # Loop through each node (source node) in this module
-        for source in mod_list:
-        
-            # Calculate the degree for the source node
-            degree = float(nx.degree(G=G, nbunch=source))
-            
-            # Calculate the number of these connections
-            # that are to nodes in *other* modules
-            count = 0
-
-            for target in mod_list:
-                
-                # If the edge is in there then increase the counter by 1
-                if (source, target) in G.edges():
-                    count += 1
-
-            # This gives you the within module degree
-            wm_degree = float(count)
+    # The consensus modular partition (the same one that
+    # calc_modularity and plot_modules use)
+    nodal_partition = consensus_partition(G, n_runs=n_runs)['partition']
 
-            # The participation coeficient is 1 - the square of 
-            # the ratio of the within module degree and the total degree
-            pc = 1 - ((float(wm_degree) / float(degree))**2)
-                
-            # Save the participation coefficient to the dictionary
-            pc_dict[source] = pc
-            
+    # Put the partition in the same (sorted) order as the
+    # array graph's nodes and count the edges to each module
+    nodes = sorted(G.nodes())
+    partition_array = np.array([ nodal_partition[node] for node in nodes ])
+    
+    module_dict = module_degree_measures(nx_to_array_graph(G), partition_array)
+    
+    # Create the dictionary of participation coefficients
+    pc_dict = dict(zip(nodes, module_dict['pc'][0]))
+    
+    if return_module_dict:
+        return nodal_partition, pc_dict, module_dict
+    
     return nodal_partition, pc_dict
     
     
@@ -392,7 +953,8 @@ def plot_modules(G,
                  cmap_name='jet',
                  title='',
                  integer_adjust=3,
-                 fractional_adjust=2.5):
+                 fractional_adjust=2.5,
+                 n_runs=1):
     
     import matplotlib.pylab as plt
     import numpy as np
@@ -409,8 +971,9 @@ def plot_modules(G,
     for u,v,d in G_edge.edges(data=True):
         d['weight']=1
         
-    # Compute the best partition based on the threshold you've specified in cost
-    partition = community.best_partition(G)
+    # Compute the consensus partition based on the threshold you've specified in cost
+    # (use the same n_runs as for the participation coefficient so it's the same partition)
+    partition = consensus_partition(G, n_runs=n_runs)['partition']
 
     # Create a sorted list of communitites (modules) according to their average
     # Y coordinate (front to back)
@@ -536,9 +1099,84 @@ def create_mat(df, aparc_names, covar, demean=False):
 
     mat_corr = mat_corr * mat_corr.T
     mat_corr_covar = mat_corr_covar * mat_corr_covar.T
-    
+
     return mat_corr, mat_corr_covar
 
+def create_data_mats(df, aparc_names, covar, demean=False):
+    '''
+    Pull out the two arrays that sit underneath create_mat:
+
+    INPUTS:
+        df ------------ pandas data frame
+        aparc_names --- list of regions (columns in df)
+        covar --------- list of covariate columns in df
+        demean -------- subtract each subject's mean across regions
+                          before anything else (as in create_mat)
+                          default = False
+
+    RETURNS:
+        X ------------- numpy array (n_subs x n_regions) of data
+        C ------------- numpy array (n_subs x n_covars+1) design matrix
+                          with a column of ones added to the end
+    '''
+    import numpy as np
+
+    X = df[aparc_names].values.astype('float')
+
+    if demean:
+        X = X - X.mean(axis=1)[:, np.newaxis]
+
+    C = np.hstack([ df[covar].values.astype('float'),
+                    np.ones([X.shape[0], 1]) ])
+
+    return X, C
+
+def residual_mat(X, C):
+    '''
+    Regress the design matrix C out of every column of X
+    in one go and return the residuals. This gives exactly the
+    same values as calling residuals on each region in turn.
+    '''
+    import numpy as np
+
+    B = np.linalg.lstsq(C, X)[0]
+
+    return X - np.dot(C, B)
+
+def corr_from_residuals(R):
+    '''
+    Turn a subjects x regions array of residuals into the
+    regions x regions correlation matrix. This is the partial
+    correlation matrix (mat_corr_covar) from create_mat when
+    R comes from residual_mat.
+    '''
+    import numpy as np
+
+    # Centre each region (the residuals already have mean zero
+    # if there's an intercept in the design, but just in case)
+    R = R - R.mean(axis=0)
+
+    S = np.dot(R.T, R)
+    d = np.sqrt(np.diag(S))
+
+    return S / np.outer(d, d)
+
+def adjacency_at_cost(M, cost):
+    '''
+    Exactly the same thresholding as graph_at_cost (minimum spanning
+    tree plus the strongest remaining edges up to the cost, with ties
+    broken in the same order) but
+    returns a binary numpy adjacency array rather than a networkx graph.
+
+    INPUTS:
+        M ------ full association matrix
+        cost --- percentage (0 to 100) of edges to keep
+
+    RETURNS:
+        A ------ binary (n x n) symmetric adjacency array
+    '''
+    return threshold_matrix(M, cost)
+
 def assign_node_names(G, aparc_names):
 
     # Assign names to the nodes
@@ -623,45 +1261,48 @@ def rich_club(G, R_list=None, n=10):
     Returns:
         rc ------ dictionary of rich club coefficients for the real graph
         rc_rand - array of rich club coefficients for the n random graphs
+    
+    The normalized coefficients are in calc_rich_club which
+    does the same calculation and returns everything.
     '''
-    # Import the modules you'll need
-    import networkx as nx
-    import numpy as np
+    rc_dict = calc_rich_club(G, R_list=R_list, n=n)
     
-    # First, calculate the rich club coefficient for the regular graph
-    rc_dict = nx.rich_club_coefficient(G, normalized=False)
+    return rc_dict['degree'], rc_dict['rc'], rc_dict['rc_rand']
+
+
+def calc_rich_club(G, R_list=None, n=10):
+    '''
+    The rich club curve of G normalized against n random graphs.
     
-    # Save the degrees as a numpy array
-    deg = np.array(rc_dict.keys())
+    All the graphs go through rich_club_curves (in array_graph_functions)
+    together, which gets the coefficient for every degree from one set
+    of cumulative sums per graph rather than looping over the degrees
+    and the edges like nx.rich_club_coefficient.
     
-    # Save the rich club coefficients as a numpy array
-    rc = np.array(rc_dict.values())
+    Inputs:
+        G ------ networkx graph
+        R_list - list of random graphs with matched degree distribution
+                   (any that are missing are made with random_graph)
+                 Default R_list = None 
+        n ------ number of random graphs
+                 Default n = 10
     
-    # Calculate n different random graphs and their 
-    # rich club coefficients
+    Returns:
+        rc_dict - dictionary containing degree, rc, rc_rand (len(degree) x n),
+                    rc_norm (rc / mean of rc_rand) and rc_norm_std
+    '''
+    import numpy as np
+    from array_graph_functions import nx_to_array_graph, array_graph_dense, rich_club_curves
     
-    # Start by creating an empty array that will hold
-    # the n random graphs' rich club coefficients
-    rc_rand = np.ones([len(rc), n])
+    # Use the random graphs you already have and make the rest
+    R_list = list(R_list or [])[:n]
+    while len(R_list) < n:
+        R_list += [ random_graph(G) ]
     
-    for i in range(n):
-        # If you haven't already calculated random graphs
-        # or you haven't given this function as many random
-        # graphs as it is expecting then calculate a random
-        # graph here
-        if not R_list or len(R_list) <= i:
-            R = random_graph(G)
-        # Otherwise just use the one you already made
-        else:
-            R = R_list[i]
-            
-        # Calculate the rich club coefficient
-        rc_rand_dict = nx.rich_club_coefficient(R, normalized=False)
-        
-        # And save the values to the numpy array you created earlier
-        rc_rand[:, i] = rc_rand_dict.values()
-        
-    return deg, rc, rc_rand
+    A = array_graph_dense(nx_to_array_graph(G))
+    A_null = np.array([ array_graph_dense(nx_to_array_graph(R)) for R in R_list ]).reshape(n, A.shape[0], A.shape[0])
+    
+    return rich_club_curves(A, A_null)
 
 def random_graph(G, Q=10):
     '''
@@ -724,7 +1365,40 @@ def random_graph(G, Q=10):
     return R
     
 
-def calculate_global_measures(G, R_list=None, n=10):
+def lattice_measures(G, n=10, seed=0):
+    '''
+    Average clustering and characteristic path length of n lattice
+    versions of G with the same degrees (see lattice_reference in
+    array_graph_functions).
+
+    The ring the lattices are built round goes through the nodes in
+    anatomical order (see ring_order) if they've been given centroids
+    by assign_nodal_distance, otherwise in the order of the nodes.
+
+    Returns:
+        C_latt -- array of the n lattices' average clustering
+        L_latt -- array of the n lattices' characteristic path lengths
+    '''
+    import numpy as np
+    from array_graph_functions import (nx_to_array_graph, array_graph_dense, ring_order,
+                                        lattice_reference, triangle_clustering,
+                                        hop_distances, path_length_measures)
+    
+    G_arr = nx_to_array_graph(G)
+    
+    order = None
+    if G_arr['centroids'] is not None:
+        order = ring_order(G_arr['centroids'])
+    
+    A_latt = lattice_reference(array_graph_dense(G_arr), order=order, n_lattices=n, seed=seed)
+    
+    C_latt = np.mean(triangle_clustering(A_latt), axis=1)
+    L_latt = np.array([ path_length_measures(D)['L'] for D in hop_distances(A_latt) ])
+    
+    return C_latt, L_latt
+
+
+def calculate_global_measures(G, R_list=None, n=10, n_runs=1):
     '''
     A wrapper function that calls a bunch of useful functions
     and reports a plethora of network measures for the real graph
@@ -734,9 +1408,14 @@ def calculate_global_measures(G, R_list=None, n=10):
     This USED to be called calculate_network_measures. It was
     changed on 2nd July because another loop which calculated nodal
     measures was created!
+    
+    The modularity of G is the consensus of n_runs Louvain runs (see
+    consensus_partition) but the random graphs only get one seeded run
+    each, they're only there to show what you'd get by chance.
     '''
     import networkx as nx
     import numpy as np
+    from array_graph_functions import small_world_measures
     
     #==== SET UP ======================
     # If you haven't already calculated random graphs
@@ -754,17 +1433,20 @@ def calculate_global_measures(G, R_list=None, n=10):
     network_measures_dict = {}
     
     #---- Clustering coefficient ------
-    network_measures_dict['C'] = nx.average_clustering(G)
-    rand_array = np.ones(n)
-    for i in range(n):
-        rand_array[i] = nx.average_clustering(R_list[i])
-    network_measures_dict['C_rand'] = rand_array
+    # (the real and random graphs all at once)
+    C_list = graphs_clustering([ G ] + R_list[:n])
+    network_measures_dict['C'] = np.mean(C_list[0])
+    network_measures_dict['C_rand'] = np.array([ np.mean(C) for C in C_list[1:] ])
     
     #---- Shortest path length --------
-    network_measures_dict['L'] = nx.average_shortest_path_length(G)
+    # Work out the distances for all the graphs at once, they're
+    # kept with each graph and used again for the efficiency
+    graphs_distances([ G ] + R_list[:n])
+    
+    network_measures_dict['L'] = calc_path_length(G)
     rand_array = np.ones(n)
     for i in range(n):
-        rand_array[i] = nx.average_shortest_path_length(R_list[i])
+        rand_array[i] = calc_path_length(R_list[i])
     network_measures_dict['L_rand'] = rand_array
     
     #---- Assortativity ---------------
@@ -775,10 +1457,10 @@ def calculate_global_measures(G, R_list=None, n=10):
     network_measures_dict['a_rand'] = rand_array
 
     #---- Modularity ------------------
-    network_measures_dict['M'] = calc_modularity(G)
+    network_measures_dict['M'] = calc_modularity(G, n_runs=n_runs)
     rand_array = np.ones(n)
     for i in range(n):
-        rand_array[i] = calc_modularity(R_list[i])
+        rand_array[i] = calc_modularity(R_list[i], n_runs=1)
     network_measures_dict['M_rand'] = rand_array
     
     #---- Efficiency ------------------
@@ -796,13 +1478,31 @@ def calculate_global_measures(G, R_list=None, n=10):
     network_measures_dict['sigma'] = sigma_array
     network_measures_dict['sigma_rand'] = 1.0
 
+    #---- Lattice small world ---------
+    # omega and the small world propensity compare G to
+    # lattices with the same degrees as well as to the
+    # random graphs (see small_world_measures)
+    C_latt, L_latt = lattice_measures(G, n=n)
+    network_measures_dict['C_latt'] = C_latt
+    network_measures_dict['L_latt'] = L_latt
+    
+    sw_dict = small_world_measures(network_measures_dict['C'],
+                                    network_measures_dict['L'],
+                                    network_measures_dict['C_rand'],
+                                    network_measures_dict['L_rand'],
+                                    C_latt,
+                                    L_latt)
+    network_measures_dict['omega'] = sw_dict['omega']
+    network_measures_dict['swp'] = sw_dict['swp']
+
     return network_measures_dict
 
-def calculate_nodal_measures(G, centroids, aparc_names):
+def calculate_nodal_measures(G, centroids, aparc_names, dist_mats=None, n_runs=1):
     '''
     A function which returns a dictionary of numpy arrays for a graph's
         * degree
         * participation coefficient
+        * within module degree z-score and node role
         * average distance
         * total distance
         * clustering
@@ -810,10 +1510,18 @@ def calculate_nodal_measures(G, centroids, aparc_names):
         * interhemispheric proportion
         * name
         * hemisphere
+    
+    Pass the output of create_distance_mats as dist_mats if you're
+    calculating the measures for lots of graphs.
+    
+    The modules are the consensus of n_runs Louvain runs (see
+    consensus_partition), use the same n_runs as for
+    calculate_global_measures so they share the partition.
     '''
     
     import numpy as np
     import networkx as nx
+    from array_graph_functions import nx_to_array_graph, betweenness_centrality
     
     #==================================
     # Create the dictionary
@@ -826,13 +1534,17 @@ def calculate_nodal_measures(G, centroids, aparc_names):
     
     #==================================
     # Closeness
-    closeness = nx.closeness_centrality(G).values()
-    nodal_dict['closeness'] = np.array(closeness)
+    # (from the graph's distance cache which
+    # is used again for the shortest paths)
+    nodal_dict['closeness'] = np.array(closeness(G).values())
     
     #==================================
     # Betweenness
-    betweenness = nx.betweenness_centrality(G).values()
-    nodal_dict['betweenness'] = np.array(betweenness)
+    # (Brandes' algorithm on the adjacency matrix, see
+    # betweenness_centrality in array_graph_functions)
+    nodes = sorted(G.nodes())
+    betweenness_dict = dict(zip(nodes, betweenness_centrality(nx_to_array_graph(G))))
+    nodal_dict['betweenness'] = np.array([ betweenness_dict[node] for node in G.nodes() ])
 
     #==================================
     # Shortest path length
@@ -841,20 +1553,30 @@ def calculate_nodal_measures(G, centroids, aparc_names):
     
     #==================================
     # Clustering
-    clustering = nx.clustering(G).values()
-    nodal_dict['clustering'] = np.array(clustering)
+    clustering_dict = dict(zip(nodes, graphs_clustering([ G ])[0]))
+    nodal_dict['clustering'] = np.array([ clustering_dict[node] for node in G.nodes() ])
 
     #==================================
     # Participation coefficent and 
     # module assignment
-    partition, pc_dict = participation_coefficient(G)
+    partition, pc_dict, module_dict = participation_coefficient(G, n_runs=n_runs, return_module_dict=True)
     nodal_dict['module'] = np.array(partition.values())
     nodal_dict['pc'] = np.array(pc_dict.values())
     
+    #==================================
+    # Within module degree z-score and
+    # Guimera and Amaral's node roles
+    # (from the same counting as the pc,
+    # the nodes are in sorted order)
+    z_dict = dict(zip(nodes, module_dict['within_module_z'][0]))
+    role_dict = dict(zip(nodes, module_dict['role'][0]))
+    nodal_dict['within_module_z'] = np.array([ z_dict[node] for node in G.nodes() ])
+    nodal_dict['role'] = np.array([ role_dict[node] for node in G.nodes() ])
+    
     #==================================
     # Euclidean distance and
     # interhem proportion
-    G = assign_nodal_distance(G, centroids)
+    G = assign_nodal_distance(G, centroids, dist_mats=dist_mats)
     average_dist = nx.get_node_attributes(G, 'average_dist').values()
     total_dist = nx.get_node_attributes(G, 'total_dist').values()
     interhem_prop = nx.get_node_attributes(G, 'interhem_proportion').values()
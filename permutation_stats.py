@@ -106,3 +106,171 @@ def bootstrap_ols(df, formula, n=500):
     return t_values, p_values
         
         
+
+def permutation_group_corr(df, aparc_names, covars, group='young', demean=False, n=5000, cost=10, batch_size=25, seed=None):
+    '''
+    Permutation test for the difference between two groups'
+    structural covariance matrices (eg: young vs old).
+
+    The group labels are shuffled n times and both groups'
+    partial correlation matrices (the mat_corr_covar output of
+    create_mat) are recalculated for every shuffle. Rather than
+    calling create_mat over and over again the cross products
+    are calculated for a batch of shuffles at a time, and the
+    second group's values are the whole sample's cross products
+    minus the first group's.
+
+    INPUTS:
+        df           - data frame
+        aparc_names  - list of regions (columns in df)
+        covars       - list of covariate columns in df
+        group        - column in df that is 1 for the first group
+                       and 0 for the second
+                         default = 'young'
+        demean       - passed to create_data_mats
+                         default = False
+        n            - number of permutations
+                         default = 5000
+        cost         - cost at which to threshold the matrices for the
+                       degree and efficiency measures. If None then
+                       only the correlation values are tested
+                         default = 10
+        batch_size   - number of permutations to calculate at once
+                         default = 25
+        seed         - seed for the random number generator
+                         default = None
+
+    RETURNS:
+        perm_dict - a dictionary containing
+            * r_diff ------------ (n_regions x n_regions) true difference
+                                    in r (group==1 minus group==0)
+            * r_diff_p ---------- (n_regions x n_regions) two tailed
+                                    permutation p values for each edge
+            * r_diff_max_null --- (n) maximum absolute edge difference for
+                                    each permutation (for FWE correction)
+            * mean_r_diff ------- true difference in the mean r
+            * mean_r_diff_null -- (n) permuted differences in the mean r
+            * mean_r_diff_p ----- two tailed permutation p value
+          and if cost is not None the same "_null" and "_p" entries for
+            * degree_diff ------- (n_regions) difference in nodal degree
+            * degree_std_diff --- difference in the standard deviation of
+                                    the degree distribution
+            * E_diff ------------ difference in global efficiency
+    '''
+    import numpy as np
+    from networkx_functions import create_data_mats, adjacency_at_cost
+
+    # Set up the random number generator
+    rng = np.random.RandomState(seed)
+
+    # Get the data and design matrices for the whole sample
+    X, C = create_data_mats(df, aparc_names, covars, demean=demean)
+    labels = df[group].values == 1
+
+    n_subs, n_regions = X.shape
+    n_1 = np.sum(labels)
+    triu_i, triu_j = np.triu_indices(n_regions, k=1)
+
+    # The cross products for the whole sample only need
+    # to be calculated once
+    S_all = np.dot(X.T, X)
+    P_all = np.dot(C.T, X)
+    Q_all = np.dot(C.T, C)
+
+    def _corr(S, P, Q):
+        # Take the covariates out of the cross products
+        # and turn what's left into a correlation matrix
+        S = S - np.dot(P.T, np.dot(np.linalg.pinv(Q), P))
+        d = np.sqrt(np.diag(S))
+        return S / np.outer(d, d)
+
+    def _global_measures(M):
+        # Degree and global efficiency of the graph at this cost
+        from array_graph_functions import efficiency_measures
+        A = adjacency_at_cost(M, cost)
+        degrees = A.sum(axis=0)
+        E = efficiency_measures(A, local=False)['E'][0]
+        return degrees, E
+
+    def _measures(S_1, P_1, Q_1):
+        # Calculate everything you need for the two groups
+        # from the first group's cross products
+        M_1 = _corr(S_1, P_1, Q_1)
+        M_0 = _corr(S_all - S_1, P_all - P_1, Q_all - Q_1)
+        measures = { 'r_diff' : M_1 - M_0 }
+        measures['mean_r_diff'] = ( M_1[triu_i, triu_j].mean()
+                                        - M_0[triu_i, triu_j].mean() )
+        if cost is not None:
+            deg_1, E_1 = _global_measures(M_1)
+            deg_0, E_0 = _global_measures(M_0)
+            measures['degree_diff'] = deg_1 - deg_0
+            measures['degree_std_diff'] = np.std(deg_1) - np.std(deg_0)
+            measures['E_diff'] = E_1 - E_0
+        return measures
+
+    #==== TRUE DIFFERENCES ============
+    X_1 = X[labels, :]
+    C_1 = C[labels, :]
+    true_dict = _measures(np.dot(X_1.T, X_1), np.dot(C_1.T, X_1), np.dot(C_1.T, C_1))
+
+    perm_dict = {}
+    perm_dict['r_diff'] = true_dict['r_diff']
+
+    # Keep a count of how many times each edge's permuted difference
+    # is at least as large (in absolute terms) as the true one rather
+    # than storing n full matrices
+    edge_count = np.zeros([n_regions, n_regions])
+    abs_r_diff = np.abs(true_dict['r_diff'])
+
+    perm_dict['r_diff_max_null'] = np.zeros(n)
+
+    global_names = [ 'mean_r_diff' ]
+    if cost is not None:
+        global_names += [ 'degree_std_diff', 'E_diff' ]
+        perm_dict['degree_diff_null'] = np.zeros([n, n_regions])
+    for name in global_names:
+        perm_dict['{}_null'.format(name)] = np.zeros(n)
+
+    #==== PERMUTATIONS ================
+    for start in range(0, n, batch_size):
+        stop = min(start + batch_size, n)
+
+        # Pick the first group's subjects for every permutation in the batch
+        idx = np.array([ rng.permutation(n_subs)[:n_1] for i in range(start, stop) ])
+        X_b = X[idx]
+        C_b = C[idx]
+        X_b_T = np.transpose(X_b, (0, 2, 1))
+        C_b_T = np.transpose(C_b, (0, 2, 1))
+
+        # Batched cross products for the first group
+        S_b = np.matmul(X_b_T, X_b)
+        P_b = np.matmul(C_b_T, X_b)
+        Q_b = np.matmul(C_b_T, C_b)
+
+        for b, i in enumerate(range(start, stop)):
+            measures = _measures(S_b[b], P_b[b], Q_b[b])
+
+            abs_diff = np.abs(measures['r_diff'])
+            edge_count += abs_diff >= abs_r_diff
+            perm_dict['r_diff_max_null'][i] = abs_diff[triu_i, triu_j].max()
+
+            for name in global_names:
+                perm_dict['{}_null'.format(name)][i] = measures[name]
+            if cost is not None:
+                perm_dict['degree_diff_null'][i, :] = measures['degree_diff']
+
+    #==== P VALUES ====================
+    perm_dict['r_diff_p'] = (edge_count + 1.0) / (n + 1.0)
+    perm_dict['r_diff_p'][np.diag_indices_from(edge_count)] = 1.0
+
+    for name in global_names:
+        perm_dict[name] = true_dict[name]
+        null = perm_dict['{}_null'.format(name)]
+        perm_dict['{}_p'.format(name)] = ( np.sum(np.abs(null) >= np.abs(true_dict[name])) + 1.0 ) / (n + 1.0)
+
+    if cost is not None:
+        perm_dict['degree_diff'] = true_dict['degree_diff']
+        null = perm_dict['degree_diff_null']
+        perm_dict['degree_diff_p'] = ( np.sum(np.abs(null) >= np.abs(true_dict['degree_diff']), axis=0) + 1.0 ) / (n + 1.0)
+
+    return perm_dict
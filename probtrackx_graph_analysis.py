@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+'''
+This code takes every subject's probtrackx connectivity matrix
+(the prob_connectivity.txt outputs of probtrackx_create_connectivity_matrix)
+thresholds it and calculates the global and nodal graph measures.
+
+The results are written out as one subjects x measures table of the
+global measures and one subjects x nodes text file for each of the
+nodal measures. The subjects are shared out over a pool of processes.
+'''
+
+#=============================================================================
+# IMPORTS
+#=============================================================================
+import os
+import sys
+import numpy as np
+import pandas as pd
+from glob import glob
+from multiprocessing import Pool
+
+from networkx_functions import threshold_matrix
+from array_graph_functions import create_array_graph, array_graph_measures
+
+#=============================================================================
+# FUNCTIONS
+#=============================================================================
+
+def usage():
+    import sys
+    print "USAGE: probtrackx_graph_analysis.py <data_dir> <occ> <cost|abs> <threshold> [n_processes]"
+    print "       cost thresholds keep the minimum spanning tree and the strongest"
+    print "         <threshold> percent of the connections"
+    print "       abs thresholds keep every connection with a probability of at"
+    print "         least <threshold>"
+    sys.exit()
+
+def load_prob_matrix(m_file):
+    '''
+    Read in the probtrackx matrix and make it symmetric (the
+    seed to target and target to seed values aren't the same)
+    '''
+    M = np.loadtxt(m_file)
+    M = ( M + M.T ) / 2.0
+    M[np.diag_indices_from(M)] = 0
+
+    return M
+
+def threshold_prob_matrix(M, threshold_type, threshold):
+    '''
+    Return the edges (each one once) that survive the threshold
+    '''
+    if threshold_type == 'cost':
+        A = threshold_matrix(M, threshold)
+    else:
+        A = M >= threshold
+
+    edge_i, edge_j = np.nonzero(np.triu(A, k=1))
+
+    return edge_i, edge_j
+
+def subject_measures(args):
+    '''
+    Calculate the graph measures for one subject. The arguments
+    come in as one tuple so this can be passed to Pool.map
+    '''
+    subid, m_file, threshold_type, threshold = args
+
+    M = load_prob_matrix(m_file)
+    edge_i, edge_j = threshold_prob_matrix(M, threshold_type, threshold)
+
+    G_arr = create_array_graph(edge_i, edge_j, M.shape[0], weights=M[edge_i, edge_j])
+
+    global_dict, nodal_dict = array_graph_measures(G_arr)
+
+    return subid, global_dict, nodal_dict
+
+def main():
+    '''
+    Read in the commandline arguments, calculate the measures
+    for every subject and write them out
+    '''
+    #=========================================================================
+    # READ IN COMMANDLINE ARGUMENTS
+    #=========================================================================
+
+    if len(sys.argv) < 5:
+        usage()
+
+    data_dir = sys.argv[1]
+    occ = sys.argv[2]
+    threshold_type = sys.argv[3]
+    threshold = np.float(sys.argv[4])
+
+    if len(sys.argv) > 5:
+        n_processes = int(sys.argv[5])
+    else:
+        n_processes = 4
+
+    if not threshold_type in [ 'cost', 'abs' ]:
+        print '{} is not a threshold type'.format(threshold_type)
+        usage()
+
+    #=========================================================================
+    # FIND ALL THE SUBJECTS' MATRICES
+    #=========================================================================
+
+    matrix_file_list = glob(os.path.join(data_dir,
+                                            'SUB_DATA',
+                                            '*',
+                                            'SURFER',
+                                            'MRI{}'.format(occ),
+                                            'probtrackx',
+                                            'prob_connectivity.txt'))
+
+    matrix_file_list.sort()
+
+    # The subject id is the name of the directory under SUB_DATA
+    subid_list = [ m_file.split(os.sep)[-5] for m_file in matrix_file_list ]
+
+    print 'Found {} connectivity matrices'.format(len(matrix_file_list))
+
+    results_dir = os.path.join(data_dir, 'PROBTRACKX_GRAPHS', 'MRI{}'.format(occ))
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+
+    thr_name = '{}_{:g}'.format(threshold_type.upper(), threshold)
+
+    table_file = os.path.join(results_dir, 'GlobalMeasures_{}.csv'.format(thr_name))
+
+    #=========================================================================
+    # CALCULATE THE MEASURES
+    #=========================================================================
+
+    if not os.path.isfile(table_file) and len(matrix_file_list) > 0:
+
+        args_list = [ (subid, m_file, threshold_type, threshold)
+                        for subid, m_file in zip(subid_list, matrix_file_list) ]
+
+        # Hand the subjects out to the pool a few at a time
+        pool = Pool(n_processes)
+        results_list = pool.map(subject_measures, args_list, chunksize=4)
+        pool.close()
+        pool.join()
+
+        #=====================================================================
+        # WRITE OUT THE RESULTS
+        #=====================================================================
+
+        # One row per subject for the global measures
+        df = pd.DataFrame([ global_dict for subid, global_dict, nodal_dict in results_list ],
+                            index=[ subid for subid, global_dict, nodal_dict in results_list ])
+        df.index.name = 'nspn_id'
+        df.to_csv(table_file)
+
+        # And one subjects x nodes file for each of the nodal measures
+        for measure in results_list[0][2].keys():
+            nodal_array = np.vstack([ nodal_dict[measure] for subid, global_dict, nodal_dict in results_list ])
+            np.savetxt(os.path.join(results_dir, 'Nodal_{}_{}.txt'.format(measure, thr_name)),
+                            nodal_array,
+                            fmt='%.5f')
+
+        print 'Results saved in {}'.format(results_dir)
+
+#=============================================================================
+# Only run when this is called as a script (not when it's imported to use
+# subject_measures) because the pool would be started on import otherwise
+#=============================================================================
+
+if __name__ == '__main__':
+    main()
+
+#=============================================================================
+# THE END
+#=============================================================================
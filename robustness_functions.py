@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+'''
+Functions for looking at how a graph falls apart as its nodes are
+removed, either the hubs first (a targeted attack) or at random
+(random failure).
+
+Rather than working out the components and the efficiency from
+scratch after every node is removed, the nodes are added back in
+the reverse order and a union-find keeps track of the components
+as they join up. That gives the size of the giant component after
+every removal in one pass through the edges.
+
+The efficiency is approximated from the size and number of edges
+of each component as it grows (the average path length of a random
+graph with the same number of nodes and edges, Fronczak et al.
+2004). That's only close for graphs that look random: it's within
+about 0.02 of the exact efficiency for Barabasi-Albert graphs, but
+the cost 10 structural covariance graphs are modular and spatially
+embedded, so their paths are longer than a random graph's and the
+approximation overshoots by about 0.05 to 0.17 (most of all before
+many nodes have gone). For those graphs ask for the exact efficiency
+(n_exact > 0, see exact_efficiency) which is calculated at a handful
+of points along the curve. It's slower, but the giant component and
+R are exact either way.
+
+Usage:
+    rob_dict = robustness_curves(A, strategy='degree')
+    rob_dict = robustness_curves(A, strategy='random', n_random=100, seed=0)
+'''
+
+def attack_scores(A, strategy='degree'):
+    '''
+    How important each node is for a targeted attack: its degree
+    or betweenness ('degree' or 'betweenness'), or all zeros for
+    random failure ('random')
+    '''
+    import numpy as np
+    from array_graph_functions import array_graph_dense, betweenness_centrality
+
+    if isinstance(A, dict):
+        A = array_graph_dense(A)
+    A = ( np.asarray(A) != 0 ).astype('float')
+
+    if strategy == 'degree':
+        return A.sum(axis=1)
+    elif strategy == 'betweenness':
+        return betweenness_centrality(A)
+    elif strategy == 'random':
+        return np.zeros(A.shape[0])
+
+    raise ValueError('{} is not an attack strategy'.format(strategy))
+
+
+def attack_order(A, strategy='degree', seed=None, scores=None):
+    '''
+    The order in which to remove the nodes
+
+    INPUTS:
+        A ------------- (n x n) adjacency matrix or array graph
+        strategy ------ 'degree' or 'betweenness' (the highest first,
+                          ties are broken at random) or 'random'
+                          default = 'degree'
+        seed ---------- seed for the random order or the tie breaks
+                          default = None
+        scores -------- the output of attack_scores if you've already
+                          got it (so the betweenness isn't recalculated)
+                          default = None
+
+    RETURNS:
+        order --------- (n) array of node indices
+    '''
+    import numpy as np
+
+    if scores is None:
+        scores = attack_scores(A, strategy=strategy)
+
+    rng = np.random.RandomState(seed)
+    tie_break = rng.rand(len(scores))
+
+    # Sort by the score (biggest first) and then by the tie breaks
+    return np.lexsort((tie_break, -np.asarray(scores)))
+
+
+def _approx_path_length(n_nodes, n_edges):
+    '''
+    Average shortest path length of a connected component with
+    n_nodes nodes and n_edges edges, from the random graph
+    approximation ln(n) / ln(k) where k is the average degree.
+    It can't be less than 1 or more than for a chain of nodes
+    ((n + 1) / 3) which is what a tree with k close to 1 looks like.
+
+    Modular or spatially embedded graphs have longer paths than
+    this, so the efficiency that comes from it is too high for them
+    (see the notes at the top).
+    '''
+    import numpy as np
+
+    k = 2.0 * n_edges / n_nodes
+    L_chain = ( n_nodes + 1 ) / 3.0
+
+    if k > 1:
+        L = np.log(n_nodes) / np.log(k)
+    else:
+        L = L_chain
+
+    return max(1.0, min(L, L_chain))
+
+
+def removal_curves(A, order):
+    '''
+    The size of the giant component and the (approximate) global
+    efficiency after removing each of the nodes in order, from
+    adding the nodes back in the reverse order with a union-find.
+
+    INPUTS:
+        A ------------- (n x n) adjacency matrix or array graph
+        order --------- (n) array of the nodes in the order they're removed
+
+    RETURNS:
+        giant --------- (n + 1) array of the fraction of the nodes that are
+                          in the largest component after 0 to n removals
+        E_approx ------ (n + 1) array of the approximate global efficiency
+                          (averaged over all n (n - 1) pairs of the original
+                          nodes, so removed nodes count as unreachable),
+                          too high for modular graphs (see exact_efficiency)
+    '''
+    import numpy as np
+    from array_graph_functions import array_graph_dense
+
+    if isinstance(A, dict):
+        A = array_graph_dense(A)
+    A = np.asarray(A) != 0
+    n = A.shape[0]
+
+    # Self loops don't join anything up
+    A = A & ~np.eye(n, dtype='bool')
+
+    neighbours = [ np.flatnonzero(A[i]) for i in range(n) ]
+
+    parent = np.arange(n)
+    size = np.ones(n, dtype='int')
+    n_edges = np.zeros(n, dtype='int')
+    present = np.zeros(n, dtype='bool')
+
+    def find(x):
+        # Follow the parents up to the root and then point
+        # everything on the way straight at it
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def pair_efficiency(root):
+        # Ordered pairs in the component / their average path length
+        if size[root] < 2:
+            return 0.0
+        return size[root] * ( size[root] - 1 ) / _approx_path_length(size[root], n_edges[root])
+
+    giant = np.zeros(n + 1)
+    E_approx = np.zeros(n + 1)
+
+    biggest = 0
+    total = 0.0
+
+    # After all n removals there's nothing left, so go backwards
+    # from there adding one node at a time
+    for r in range(n - 1, -1, -1):
+        x = order[r]
+        present[x] = True
+
+        # The components this node joins together, and how
+        # many of its edges go into each of them
+        roots = [ find(y) for y in neighbours[x] if present[y] ]
+        joined = {}
+        for root in roots:
+            joined[root] = joined.get(root, 0) + 1
+
+        for root in joined.keys():
+            total -= pair_efficiency(root)
+
+        # Merge them all into the biggest one
+        new_root = x
+        if len(joined) > 0:
+            new_root = max(joined.keys(), key=lambda root: size[root])
+            parent[x] = new_root
+            size[new_root] += 1
+            n_edges[new_root] += len(roots)
+            for root in joined.keys():
+                if root != new_root:
+                    parent[root] = new_root
+                    size[new_root] += size[root]
+                    n_edges[new_root] += n_edges[root]
+
+        total += pair_efficiency(new_root)
+        biggest = max(biggest, size[new_root])
+
+        giant[r] = biggest / float(n)
+        E_approx[r] = total / ( n * ( n - 1.0 ) )
+
+    return giant, E_approx
+
+
+def exact_efficiency(A, order, n_removed):
+    '''
+    The exact global efficiency (over all n (n - 1) pairs of the original
+    nodes) after removing the first n_removed[i] nodes in order, for all
+    the points at once. Use this (through n_exact in robustness_curves)
+    for the structural covariance graphs, where the approximate
+    efficiency from removal_curves is too high.
+    '''
+    import numpy as np
+    from array_graph_functions import array_graph_dense, efficiency_measures
+
+    if isinstance(A, dict):
+        A = array_graph_dense(A)
+    A = np.asarray(A) != 0
+    n = A.shape[0]
+
+    A_stack = np.repeat(A[np.newaxis, :, :], len(n_removed), axis=0)
+    for i, r in enumerate(n_removed):
+        A_stack[i, order[:r], :] = False
+        A_stack[i, :, order[:r]] = False
+
+    return efficiency_measures(A_stack, local=False)['E']
+
+
+def robustness_curves(A, strategy='degree', n_random=10, n_exact=0, seed=None):
+    '''
+    Attack (or random failure) curves for one graph
+
+    INPUTS:
+        A ------------- (n x n) adjacency matrix or array graph
+        strategy ------ 'degree', 'betweenness' or 'random' (see attack_order)
+                          default = 'degree'
+        n_random ------ number of random orders to average over for
+                          random failure (or to break the ties in the
+                          targeted attacks)
+                          default = 10
+        n_exact ------- number of points along the curve (evenly spaced
+                          from no nodes removed to all of them) where the
+                          exact efficiency is calculated too (0 to
+                          skip the exact efficiency, which is only
+                          sensible for graphs that look random)
+                          default = 0
+        seed ---------- random seed
+                          default = None
+
+    RETURNS:
+        rob_dict ------ a dictionary containing
+            * fraction_removed ---- (n + 1) 0 to 1
+            * giant --------------- (n + 1) average fraction of the nodes
+                                      in the largest component
+            * E_approx ------------ (n + 1) average approximate efficiency
+            * exact_fraction ------ (n_exact) where the exact efficiency was
+                                      calculated (empty if n_exact is 0)
+            * E_exact ------------- (n_exact) average exact efficiency
+            * R ------------------- robustness (Schneider et al. 2011): the
+                                      average size of the giant component
+                                      over all the removals
+    '''
+    import numpy as np
+    from array_graph_functions import array_graph_dense
+
+    if isinstance(A, dict):
+        A = array_graph_dense(A)
+    A = np.asarray(A) != 0
+    n = A.shape[0]
+
+    rng = np.random.RandomState(seed)
+
+    # The targeted attacks only differ in how the ties
+    # are broken so they don't need as many repeats
+    if strategy == 'random':
+        n_orders = n_random
+    else:
+        n_orders = min(n_random, 3)
+
+    n_removed = np.unique(np.round(np.linspace(0, n, n_exact)).astype('int'))
+    E_exact = np.zeros(len(n_removed))
+
+    scores = attack_scores(A, strategy=strategy)
+
+    giant_list = []
+    E_approx_list = []
+
+    for i in range(n_orders):
+        order = attack_order(A, seed=rng.randint(2**31 - 1), scores=scores)
+
+        giant, E_approx = removal_curves(A, order)
+        giant_list += [ giant ]
+        E_approx_list += [ E_approx ]
+        if n_exact > 0:
+            E_exact += exact_efficiency(A, order, n_removed) / n_orders
+
+    rob_dict = {}
+    rob_dict['fraction_removed'] = np.arange(n + 1) / float(n)
+    rob_dict['giant'] = np.mean(giant_list, axis=0)
+    rob_dict['E_approx'] = np.mean(E_approx_list, axis=0)
+    rob_dict['exact_fraction'] = n_removed / float(n)
+    rob_dict['E_exact'] = E_exact
+    rob_dict['R'] = np.mean(rob_dict['giant'][1:])
+
+    return rob_dict
@@ -53,6 +53,7 @@ from create_correlation_matrix import *
 
 sys.path.append(os.path.join(scripts_dir, 'NSPN_CODE'))
 from networkx_functions import *
+from cache_functions import create_cache, load_or_create, cache_summary
 
 #=============================================================================
 # Define a few fun functions
@@ -493,6 +494,9 @@ print "Making or loading graphs"
 
 graph_dict = {}
 
+# Keep track of which edge rankings are up to date
+cache_dict = create_cache()
+
 # Make the graphs data directory if it doesn't already exist
 if not os.path.isdir(os.path.join(data_dir, 'GRAPHS')):
 
@@ -505,39 +509,31 @@ for k in mat_dict.keys():
     M = mat_dict[k]
     
     #=======
-    # Read in the full graph first
+    # Rank the edges once for each matrix
     #=======
     
-    # Define the graph's file name
-    g_filename = os.path.join(data_dir, 'GRAPHS', 'Graph_{}_COST_100.gpickle'.format(k))
+    # The same ranked edges archive as CT_analysis_wrapper.py
+    # so there's only one copy of the graphs on disk
+    r_filename = os.path.join(data_dir, 'GRAPHS', 'Ranks_{}.npz'.format(k))
     
-    # If it already exists just read it in from the pickled file
-    if os.path.isfile(g_filename):
-        graph_dict['{}_COST_100'.format(k)] = nx.read_gpickle(g_filename)
+    # Read it in unless it's missing or the matrix it was made
+    # from has changed, in which case you'll have to create it
+    rank_dict = load_or_create(cache_dict, r_filename,
+                                [ M, 'create_edge_ranks' ],
+                                lambda : create_edge_ranks(M),
+                                kind='ranks')
     
-    # Otherwise you'll have to create it using the graph_at_cost function above
-    else:
-        graph_dict['{}_COST_100'.format(k)] = full_graph(M)
-        
-        # Save it as a gpickle file so you don't have to do this next time!
-        nx.write_gpickle(graph_dict['{}_COST_100'.format(k)], g_filename)
+    # The full graph first (the same as full_graph)
+    graph_dict['{}_COST_100'.format(k)] = graph_from_edge_ranks(rank_dict, 100, weight_sign=1)
     
     # For three different costs...
     for cost in [2, 10, 20]:
         
-        # Define the graph's file name
-        g_filename = os.path.join(data_dir, 'GRAPHS', 'Graph_{}_COST_{:02.0f}.gpickle'.format(k, cost))
-        
-        # If it already exists just read it in from the pickled file
-        if os.path.isfile(g_filename):
-            graph_dict['{}_COST_{:02.0f}'.format(k, cost)] = nx.read_gpickle(g_filename)
-        
-        # Otherwise you'll have to create it using the graph_at_cost function above
-        else:
-            graph_dict['{}_COST_{:02.0f}'.format(k, cost)] = graph_at_cost(M, cost)
-            
-            # Save it as a gpickle file so you don't have to do this next time!
-            nx.write_gpickle(graph_dict['{}_COST_{:02.0f}'.format(k, cost)], g_filename)
+        # The same as graph_at_cost
+        graph_dict['{}_COST_{:02.0f}'.format(k, cost)] = graph_from_edge_ranks(rank_dict, cost)
+
+# Report how much was re-used
+cache_summary(cache_dict)
     
 #=============================================================================
 # Make some pictures